@@ -0,0 +1,394 @@
+"""
+Benchmarks of `ptonppl` against simulated backends (see `simulation.py`),
+measuring the latency of single lookups, the throughput of bulk lookups
+(through `ptonppl.control` and through the command-line tool) and the CPU
+cost of the parsers:
+
+    python benchmarks/bench.py run [--profile campus] [--output FILE]
+
+Results can be stored (with `--output`), and compared between versions, to
+catch performance regressions:
+
+    python benchmarks/bench.py compare benchmarks/results/OLD.json FILE
+
+Instead of simulating the backends, their responses to the lookups of a
+roster (one PUID, NetID, alias or email address per line) can be recorded
+once, from the campus network, and then replayed:
+
+    python benchmarks/bench.py record CASSETTE --roster FILE
+    python benchmarks/bench.py run --replay CASSETTE --roster FILE
+"""
+
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import typing
+
+import click
+import click.testing
+
+import ptonppl
+import ptonppl.__main__
+import ptonppl.cache
+import ptonppl.control
+import ptonppl.ldap
+import ptonppl.ldapcmd
+import ptonppl.webdir
+
+import simulation
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+
+DEFAULT_DIRECTORY_SIZE = 10000
+DEFAULT_ROSTER_SIZE = 500
+DEFAULT_SINGLE_LOOKUPS = 200
+DEFAULT_JOBS = 8
+
+# Relative change of a metric past which it is reported as a regression
+DEFAULT_THRESHOLD = 0.10
+
+# (metrics whose name ends with this are better when higher, such as
+# throughputs; all other metrics are durations, which are better lower)
+HIGHER_IS_BETTER_SUFFIX = "_per_s"
+
+PARSER_REPEAT = 5
+
+
+def make_roster(
+        size: int,
+        directory_size: int,
+        seed: int = 0,
+) -> typing.List[str]:
+    """
+    Random mix of the identifiers of people in `simulation.Directory`:
+    NetIDs, email addresses and PUIDs, and some identifiers of nobody.
+    """
+    rng = random.Random(seed)
+
+    roster = []
+    for _ in range(size):
+        i = rng.randrange(directory_size)
+        draw = rng.random()
+        if draw < 0.4:
+            roster.append(simulation.Directory.netid(i))
+        elif draw < 0.7:
+            roster.append(simulation.Directory.email(i))
+        elif draw < 0.9:
+            roster.append(simulation.Directory.puid(i))
+        else:
+            roster.append("nobody{:06d}".format(i))
+
+    return roster
+
+
+def _read_roster(path: str) -> typing.List[str]:
+    with open(path) as f:
+        return f.read().split()
+
+
+# Benchmarks (each returns a dictionary of metrics)
+
+def bench_single(values: typing.List[str]) -> typing.Dict[str, float]:
+
+    timings = []
+
+    for value in values:
+        # (each lookup goes to the backends, rather than the cache)
+        ptonppl.cache.memory_cache = ptonppl.cache.MemoryCache()
+
+        time_start = time.perf_counter()
+        ptonppl.control.search(value=value)
+        timings.append(time.perf_counter() - time_start)
+
+    timings.sort()
+
+    return {
+        "single.mean_s": statistics.mean(timings),
+        "single.p50_s": timings[len(timings) // 2],
+        "single.p95_s": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "single.lookups_per_s": len(timings) / sum(timings),
+    }
+
+
+def bench_bulk(
+        values: typing.List[str],
+        jobs: int = DEFAULT_JOBS,
+) -> typing.Dict[str, float]:
+
+    metrics = dict()
+
+    for (name, lookups) in [
+        ("batch", lambda: ptonppl.control.search_batch(values=values)),
+        ("many", lambda: ptonppl.control.search_many(values=values, workers=jobs)),
+    ]:
+        simulation.reset()
+
+        time_start = time.perf_counter()
+        for _ in lookups():
+            pass
+        metrics["bulk.{}.lookups_per_s".format(name)] = len(values) / (time.perf_counter() - time_start)
+
+    # the command-line tool, from reading the roster to printing the records
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as roster:
+        roster.write("\n".join(values))
+        roster.flush()
+
+        runner = click.testing.CliRunner()
+
+        for (name, args) in [
+            ("cli", ["search", "-t", "csv", "-i", roster.name]),
+            ("cli_jobs", ["search", "-t", "csv", "-i", roster.name, "-j", str(jobs)]),
+        ]:
+            simulation.reset()
+
+            time_start = time.perf_counter()
+            result = runner.invoke(ptonppl.__main__.cli, args)
+            elapsed = time.perf_counter() - time_start
+
+            if result.exit_code != 0:
+                raise RuntimeError("ptonppl {} failed: {!r}".format(" ".join(args), result.exception))
+
+            metrics["bulk.{}.lookups_per_s".format(name)] = len(values) / elapsed
+
+    simulation.reset()
+
+    return metrics
+
+
+def _best(f) -> float:
+    return min(timeit.repeat(f, repeat=PARSER_REPEAT, number=1))
+
+
+def bench_parsers(directory: simulation.Directory) -> typing.Dict[str, float]:
+
+    entries = directory.search("(uid=*)")[:1000]
+
+    page = simulation.render_webdir(entries[:25])
+    ldif = simulation.render_ldif(entries).decode("utf-8").splitlines()
+
+    return {
+        "parse.webdir_s": _best(lambda: ptonppl.webdir._parse_results(page)) / 25,
+        "parse.ldif_s": _best(lambda: list(ptonppl.ldapcmd._iter_ldif(ldif))) / len(entries),
+        "parse.ldap_entry_s": _best(lambda: [
+            ptonppl.ldap.LdapPtonPerson(ldap_result=ptonppl.ldap._add_dn_attributes(dn=dn, entry=dict(attributes)))
+            for (dn, attributes) in entries
+        ]) / len(entries),
+    }
+
+
+def run_benchmarks(
+        roster: typing.List[str],
+        single_lookups: int,
+        jobs: int,
+        directory: simulation.Directory,
+) -> typing.Dict[str, float]:
+
+    metrics = dict()
+
+    metrics.update(bench_single(roster[:single_lookups]))
+    metrics.update(bench_bulk(roster, jobs=jobs))
+    metrics.update(bench_parsers(directory))
+
+    return metrics
+
+
+# Results
+
+def _describe(mode: str, profile: typing.Optional[str], metrics: typing.Dict[str, float]) -> typing.Dict[str, typing.Any]:
+    return {
+        "ptonppl": ptonppl.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "mode": mode,
+        "profile": profile,
+        "metrics": metrics,
+    }
+
+
+def _format_metric(name: str, value: float) -> str:
+    if name.endswith(HIGHER_IS_BETTER_SUFFIX):
+        return "{:.1f}/s".format(value)
+    if value < 1e-3:
+        return "{:.1f}us".format(value * 1e6)
+    return "{:.2f}ms".format(value * 1e3)
+
+
+def _print_metrics(metrics: typing.Dict[str, float]):
+    for (name, value) in metrics.items():
+        print("  {:<32} {:>12}".format(name, _format_metric(name, value)))
+
+
+def compare_results(
+        baseline: typing.Dict[str, typing.Any],
+        current: typing.Dict[str, typing.Any],
+        threshold: float = DEFAULT_THRESHOLD,
+) -> typing.List[str]:
+    """
+    Print the change of each metric from `baseline` to `current`, and
+    return the names of those that got worse by more than `threshold`.
+    """
+
+    regressions = []
+
+    for key in ["mode", "profile"]:
+        if baseline.get(key) != current.get(key):
+            print("warning: comparing results of different {}s ({} and {})".format(
+                key, baseline.get(key), current.get(key)), file=sys.stderr)
+
+    print("  {:<32} {:>12} {:>12} {:>8}".format(
+        "metric", baseline["ptonppl"], current["ptonppl"], "change"))
+
+    for (name, new_value) in current["metrics"].items():
+        old_value = baseline["metrics"].get(name)
+        if old_value is None or old_value == 0:
+            continue
+
+        change = new_value / old_value - 1
+
+        # a regression is a slower duration, or a lower throughput
+        worse = -change if name.endswith(HIGHER_IS_BETTER_SUFFIX) else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(name)
+            flag = "  <- regression"
+
+        print("  {:<32} {:>12} {:>12} {:>+7.0%}{}".format(
+            name, _format_metric(name, old_value), _format_metric(name, new_value), change, flag))
+
+    return regressions
+
+
+# Command-line interface
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("run")
+@click.option("--profile", type=click.Choice(sorted(simulation.PROFILES.keys())), default="instant",
+              help="Latency and failures of the simulated backends.")
+@click.option("--directory-size", type=int, default=DEFAULT_DIRECTORY_SIZE, metavar="N",
+              help="Number of people in the simulated directory.")
+@click.option("--roster-size", type=int, default=DEFAULT_ROSTER_SIZE, metavar="N",
+              help="Number of values looked up in bulk.")
+@click.option("--single", "single_lookups", type=int, default=DEFAULT_SINGLE_LOOKUPS, metavar="N",
+              help="Number of values looked up one at a time.")
+@click.option("-j", "--jobs", type=int, default=DEFAULT_JOBS, metavar="N",
+              help="Number of concurrent lookups in the concurrent benchmarks.")
+@click.option("--seed", type=int, default=0,
+              help="Seed of the roster and of the simulated failures.")
+@click.option("--replay", "cassette_path", type=click.Path(dir_okay=False, exists=True), metavar="CASSETTE",
+              help="Replay recorded responses, instead of simulating the backends.")
+@click.option("--speed", type=float, default=0.0,
+              help="Speed of the replay, relative to the recording (0: instant).")
+@click.option("--roster", "roster_path", type=click.Path(dir_okay=False, exists=True), metavar="FILE",
+              help="Values to look up (required to replay).")
+@click.option("-o", "--output", type=click.Path(dir_okay=False), metavar="FILE",
+              help="Store the results (e.g., in benchmarks/results/).")
+@click.option("--compare", "baseline_path", type=click.Path(dir_okay=False, exists=True), metavar="FILE",
+              help="Compare the results with those stored in FILE.")
+@click.option("--threshold", type=float, default=DEFAULT_THRESHOLD,
+              help="Relative change reported as a regression.")
+def cli_run(profile, directory_size, roster_size, single_lookups, jobs, seed,
+            cassette_path, speed, roster_path, output, baseline_path, threshold):
+    """
+    Run the benchmarks.
+    """
+
+    directory = simulation.Directory(size=directory_size)
+
+    if roster_path is not None:
+        roster = _read_roster(roster_path)
+    else:
+        roster = make_roster(size=roster_size, directory_size=directory_size, seed=seed)
+
+    if cassette_path is not None:
+        if roster_path is None:
+            raise click.UsageError("--roster is required to replay the lookups that were recorded")
+
+        (mode, profile) = ("replay", None)
+        context = simulation.replay(cassette_path, speed=speed)
+    else:
+        mode = "simulate"
+        context = simulation.simulate(directory, profiles=simulation.make_profiles(profile, seed=seed))
+
+    with context as cassette:
+        metrics = run_benchmarks(roster=roster, single_lookups=single_lookups, jobs=jobs, directory=directory)
+
+    if mode == "replay" and cassette.misses > 0:
+        print("warning: {} requests were not recorded in the cassette".format(cassette.misses), file=sys.stderr)
+
+    results = _describe(mode=mode, profile=profile, metrics=metrics)
+
+    print("ptonppl {} ({}{})".format(
+        results["ptonppl"], mode, ", {}".format(profile) if profile is not None else ""))
+    _print_metrics(metrics)
+
+    if output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+        print()
+        if len(compare_results(baseline, results, threshold=threshold)) > 0:
+            sys.exit(1)
+
+
+@cli.command("record")
+@click.argument("cassette_path", type=click.Path(dir_okay=False), metavar="CASSETTE")
+@click.option("--roster", "roster_path", type=click.Path(dir_okay=False, exists=True), metavar="FILE",
+              required=True, help="Values to look up.")
+@click.option("--single", "single_lookups", type=int, default=DEFAULT_SINGLE_LOOKUPS, metavar="N",
+              help="Number of values looked up one at a time.")
+def cli_record(cassette_path, roster_path, single_lookups):
+    """
+    Record the responses of the real backends to the lookups of the
+    benchmarks (which requires access to the campus network).
+    """
+
+    roster = _read_roster(roster_path)
+
+    with simulation.record(cassette_path):
+        # (the same lookups as those of `run`, so that all are replayed)
+        bench_single(roster[:single_lookups])
+        bench_bulk(roster, jobs=1)
+
+
+@cli.command("compare")
+@click.argument("baseline_path", type=click.Path(dir_okay=False, exists=True), metavar="BASELINE")
+@click.argument("current_path", type=click.Path(dir_okay=False, exists=True), metavar="CURRENT")
+@click.option("--threshold", type=float, default=DEFAULT_THRESHOLD,
+              help="Relative change reported as a regression.")
+def cli_compare(baseline_path, current_path, threshold):
+    """
+    Compare results stored by `run --output`.
+    """
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    with open(current_path) as f:
+        current = json.load(f)
+
+    if len(compare_results(baseline, current, threshold=threshold)) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
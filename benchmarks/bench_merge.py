@@ -0,0 +1,134 @@
+"""
+Micro-benchmark of the merging of partial records, as `ptonppl.control`
+does when several backends each provide some of the fields of a person,
+comparing the original (copying) records with `AbstractPtonPerson`.
+
+    python benchmarks/bench_merge.py [COUNT]
+
+By default, 20,000 people are each merged from three partial records.
+"""
+
+import copy
+import sys
+import time
+import typing
+
+import ptonppl.abstract
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+
+DEFAULT_COUNT = 20000
+
+REPEAT = 3
+
+
+class _CopyingPtonPerson:
+    """
+    The records as they were before `AbstractPtonPerson` was made immutable
+    (every merge, and every access to `original`, made deep copies).
+    """
+
+    _puid = None
+    _netid = None
+    _alias = None
+    _email = None
+    _pustatus = None
+    _cn = None
+
+    _original = None
+
+    def __init__(self, original=None, **fields):
+        self._original = original
+        for (name, value) in fields.items():
+            setattr(self, "_" + name, value)
+
+    def merge(self, obj):
+        self_copy = copy.deepcopy(self)
+
+        self_copy._puid = self_copy._puid or obj._puid
+        self_copy._netid = self_copy._netid or obj._netid
+        self_copy._alias = self_copy._alias or obj._alias
+        self_copy._email = self_copy._email or obj._email
+        self_copy._pustatus = self_copy._pustatus or obj._pustatus
+        self_copy._cn = self_copy._cn or obj._cn
+
+        if obj._original is not None:
+            orig = copy.deepcopy(obj._original)
+            if self_copy._original is not None:
+                orig.update(self_copy._original)
+            self_copy._original = orig
+
+        return self_copy
+
+    @property
+    def original(self):
+        if self._original is not None:
+            return copy.deepcopy(self._original)
+
+    @property
+    def as_dict(self):
+        return ptonppl.abstract.AbstractPtonPerson._make_dict(self)
+
+
+def _partial_records(cls, i: int) -> typing.List[typing.Any]:
+    # (as answered by LDAP, the web directory, and the proxy, for instance)
+    netid = "sim{:06d}".format(i)
+    email = "first.last.{:06d}@princeton.edu".format(i)
+
+    attributes = {
+        "uid": [netid.encode()],
+        "cn": [b"First Last"],
+        "displayName": [b"First Last"],
+        "givenName": [b"First"],
+        "sn": [b"Last"],
+        "pustatus": [b"undergraduate"],
+        "ou": [b"Computer Science"],
+        "telephoneNumber": [b"(609) 258-0000"],
+        "street": [b"35 Olden Street"],
+    }
+
+    return [
+        cls(original=dict(attributes), netid=netid, cn="First Last", pustatus="undergraduate"),
+        cls(original={"uid": netid, "mail": email, "title": "Student"}, netid=netid, email=email),
+        cls(original={"uid": [netid.encode()], "universityid": ["96{:07d}".format(i).encode()]},
+            netid=netid, puid="96{:07d}".format(i)),
+    ]
+
+
+def _workload(people):
+    for records in people:
+        obj = records[0]
+        for new_obj in records[1:]:
+            obj = obj.merge(new_obj)
+
+        # (as when the record is output, and stored in a mirror)
+        obj.as_dict
+        obj.as_dict
+        original = obj.original
+        [original[key] for key in original]
+
+
+def _best(cls, count: int) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        people = [_partial_records(cls, i) for i in range(count)]
+        time_start = time.perf_counter()
+        _workload(people)
+        timings.append(time.perf_counter() - time_start)
+    return min(timings)
+
+
+def main(count: int):
+    time_copying = _best(_CopyingPtonPerson, count)
+    time_shared = _best(ptonppl.abstract.AbstractPtonPerson, count)
+
+    print("{} people, merged from 3 partial records each".format(count))
+    print("  {:<24} {:8.1f} ms".format("copying records:", time_copying * 1000))
+    print("  {:<24} {:8.1f} ms  ({:.1f}x)".format(
+        "AbstractPtonPerson:", time_shared * 1000, time_copying / time_shared))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT)
@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of the output of records, comparing the original printing
+of the `json` and `csv` output types with `ptonppl.output.RecordWriter`.
+
+    python benchmarks/bench_output.py [COUNT]
+
+By default, 100,000 records are output (to memory).
+"""
+
+import io
+import sys
+import time
+
+import ptonppl.abstract
+import ptonppl.constants
+import ptonppl.output
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+
+DEFAULT_COUNT = 100000
+
+REPEAT = 3
+
+
+def _people(count: int):
+    return [
+        ptonppl.abstract.AbstractPtonPerson.from_dict({
+            "puid": "96{:07d}".format(i),
+            "netid": "sim{:06d}".format(i),
+            "alias": "first.last.{:06d}".format(i),
+            "email": "first.last.{:06d}@princeton.edu".format(i),
+            "type": "undergraduate",
+            "name": "Last, First {}".format(i),
+        })
+        for i in range(count)
+    ]
+
+
+# The output types as they were printed before `RecordWriter` (the `json`
+# output was not valid JSON, and `as_dict` was computed once per cell)
+
+def _original_json(people, fields, file):
+    print("{", file=file)
+    for obj in people:
+        print("    {},".format(obj.as_dict.__repr__()), file=file)
+    print("}", file=file)
+
+
+def _original_csv(people, fields, file):
+    def quote_csv_cell(s):
+        if ',' in s:
+            return '"{}"'.format(s.replace('"', '\"'))
+        return s
+
+    print(",".join(fields), file=file)
+    for obj in people:
+        print(",".join(
+            list(map(
+                lambda field: quote_csv_cell(obj.as_dict.get(field, "")),
+                fields))), file=file)
+
+
+def _writer(type):
+    def write(people, fields, file):
+        writer = ptonppl.output.RecordWriter(type=type, fields=fields, file=file)
+        writer.prologue()
+        for obj in people:
+            writer.write(obj)
+        writer.epilogue()
+    return write
+
+
+def _best(f, people, fields) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        file = io.StringIO()
+        time_start = time.perf_counter()
+        f(people, fields, file)
+        timings.append(time.perf_counter() - time_start)
+    return min(timings)
+
+
+def main(count: int):
+    people = _people(count)
+    fields = ptonppl.constants.OUTPUT_CSV_HEADER[:]
+
+    print("{} records".format(count))
+
+    for (label, f, baseline) in [
+        ("json (original):", _original_json, None),
+        ("json:", _writer("json"), _original_json),
+        ("ndjson:", _writer("ndjson"), _original_json),
+        ("csv (original):", _original_csv, None),
+        ("csv:", _writer("csv"), _original_csv),
+    ]:
+        elapsed = _best(f, people, fields)
+        line = "  {:<20} {:8.1f} ms  {:10.0f} records/s".format(label, elapsed * 1000, count / elapsed)
+        if baseline is not None:
+            line += "  ({:.2f}x)".format(_best(baseline, people, fields) / elapsed)
+        print(line)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT)
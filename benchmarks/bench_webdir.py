@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of the extraction of results from campus directory pages,
+comparing the original full-page parse with the fast path of
+`ptonppl.webdir`.
+
+    python benchmarks/bench_webdir.py [PAGE.html ...]
+
+By default, the synthetic results page of the test suite is used.
+"""
+
+import os
+import sys
+import timeit
+
+import ptonppl.webdir
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+
+DEFAULT_PAGES = [
+    os.path.join(os.path.dirname(__file__), os.pardir, "tests", "data", "webdir-results.html"),
+]
+
+REPEAT = 5
+NUMBER = 20
+
+
+def _full_parse(content: bytes):
+    return list(map(ptonppl.webdir._parse_result, ptonppl.webdir._parse_raw_results(content)))
+
+
+def _fast_parse(content: bytes):
+    return ptonppl.webdir._parse_results_fast(content)
+
+
+def _strained_parse(content: bytes):
+    # fast path without `lxml`, whether or not it is installed
+    parser = ptonppl.webdir.HTML_PARSER
+    ptonppl.webdir.HTML_PARSER = "html.parser"
+    try:
+        return ptonppl.webdir._parse_results_fast(content)
+    finally:
+        ptonppl.webdir.HTML_PARSER = parser
+
+
+def _best(f, content: bytes) -> float:
+    timings = timeit.repeat(lambda: f(content), repeat=REPEAT, number=NUMBER)
+    return min(timings) / NUMBER
+
+
+def main(paths):
+    for path in paths:
+        with open(path, "rb") as f:
+            content = f.read()
+
+        expected = _full_parse(content)
+        assert _fast_parse(content) == expected
+        assert _strained_parse(content) == expected
+
+        time_full = _best(_full_parse, content)
+
+        print("{}: {} rows, {:.0f} KB".format(
+            os.path.basename(path), len(expected), len(content) / 1024))
+        print("  {:<24} {:8.2f} ms".format("full page parse:", time_full * 1000))
+
+        for label, f in [
+            ("fast path (html.parser):", _strained_parse),
+            ("fast path ({}):".format(ptonppl.webdir.HTML_PARSER), _fast_parse),
+        ]:
+            time_fast = _best(f, content)
+            print("  {:<24} {:8.2f} ms  ({:.2f}x)".format(label, time_fast * 1000, time_full / time_fast))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or DEFAULT_PAGES)
@@ -0,0 +1,747 @@
+"""
+Simulated backends for the benchmarks: a synthetic directory, served by
+fake LDAP connections, a fake campus directory website and a fake LDAP
+proxy, each with its own latency and failure rate, so that `ptonppl` can
+be measured without access to the campus network.
+
+Responses of the real backends can also be recorded once in a "cassette"
+file, and replayed deterministically afterwards:
+
+    with simulation.record("campus.json"):
+        ptonppl.control.search("lumbroso")
+
+    with simulation.replay("campus.json"):
+        ptonppl.control.search("lumbroso")
+"""
+
+import base64
+import contextlib
+import json
+import random
+import re
+import threading
+import time
+import typing
+import urllib.parse
+
+import ldap
+import ldap.controls
+import requests
+
+import ptonppl.cache
+import ptonppl.constants
+import ptonppl.health
+import ptonppl.ldap
+import ptonppl.metrics
+import ptonppl.requests
+import ptonppl.webdir
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+
+# (the entries of the directory are those of `python-ldap`: a DN, and a
+# dictionary of attributes, each with a list of values as bytes)
+
+Entry = typing.Tuple[str, typing.Dict[str, typing.List[bytes]]]
+
+
+class Profile:
+    """
+    Behavior of a simulated backend: each request takes `latency` seconds,
+    plus up to `jitter` seconds drawn at random, and fails with probability
+    `failure_rate`.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            failure_rate: float = 0.0,
+            seed: typing.Optional[int] = None,
+    ):
+        self._latency = latency
+        self._jitter = jitter
+        self._failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, latency: typing.Optional[float] = None):
+        with self._lock:
+            jitter = self._random.uniform(0, self._jitter)
+
+        latency = (latency if latency is not None else self._latency) + jitter
+        if latency > 0:
+            time.sleep(latency)
+
+    def fails(self) -> bool:
+        with self._lock:
+            return self._random.random() < self._failure_rate
+
+    def __repr__(self) -> str:
+        return "Profile(latency={!r}, jitter={!r}, failure_rate={!r})".format(
+            self._latency, self._jitter, self._failure_rate)
+
+
+# Typical conditions, by name (for each of the "ldap", "webdir" and "proxy"
+# backends); the local `ldapsearch` command is never simulated, and is
+# unavailable, as it is on most machines
+
+PROFILES: typing.Dict[str, typing.Dict[str, typing.Tuple[float, float, float]]] = {
+    # no latency: only the CPU cost of `ptonppl` itself is measured
+    "instant": {
+        "ldap": (0.0, 0.0, 0.0),
+        "webdir": (0.0, 0.0, 0.0),
+        "proxy": (0.0, 0.0, 0.0),
+    },
+    # on campus, where the LDAP server is reachable
+    "campus": {
+        "ldap": (0.005, 0.005, 0.01),
+        "webdir": (0.150, 0.100, 0.02),
+        "proxy": (0.300, 0.200, 0.02),
+    },
+    # off campus, where the LDAP server is not reachable
+    "offsite": {
+        "ldap": (0.050, 0.0, 1.0),
+        "webdir": (0.200, 0.150, 0.05),
+        "proxy": (0.400, 0.300, 0.05),
+    },
+}
+
+
+def make_profiles(
+        name: str,
+        seed: typing.Optional[int] = None,
+) -> typing.Dict[str, Profile]:
+    return {
+        backend: Profile(latency=latency, jitter=jitter, failure_rate=failure_rate, seed=seed)
+        for (backend, (latency, jitter, failure_rate)) in PROFILES[name].items()
+    }
+
+
+# Synthetic directory
+
+_FIRST_NAMES = ["Ada", "Alan", "Grace", "Edsger", "Barbara", "Donald", "Frances", "John", "Radia", "Ken"]
+_LAST_NAMES = ["Lovelace", "Turing", "Hopper", "Dijkstra", "Liskov", "Knuth", "Allen", "Backus", "Perlman", "Thompson"]
+_STATUSES = ["undergraduate", "graduate", "faculty", "staff"]
+_DEPARTMENTS = ["Computer Science", "Mathematics", "Physics", "Chemistry", "History"]
+
+
+class Directory:
+    """
+    Directory of `size` fictitious people, with NetIDs `sim000000`, ...,
+    PUIDs `960000000`, ..., and addresses `first.last.000000@princeton.edu`,
+    ... (which are also their aliases).
+    """
+
+    def __init__(self, size: int = 10000):
+        self._entries: typing.List[Entry] = list()
+
+        # entries, by (lowercase) attribute, then (lowercase) value
+        self._index: typing.Dict[str, typing.Dict[str, typing.List[int]]] = dict()
+
+        for i in range(size):
+            self._add(self._person(i))
+
+    @staticmethod
+    def netid(i: int) -> str:
+        return "sim{:06d}".format(i)
+
+    @staticmethod
+    def puid(i: int) -> str:
+        return "96{:07d}".format(i)
+
+    @staticmethod
+    def email(i: int) -> str:
+        return "{}.{}.{:06d}@princeton.edu".format(
+            _FIRST_NAMES[i % len(_FIRST_NAMES)].lower(),
+            _LAST_NAMES[(i // len(_FIRST_NAMES)) % len(_LAST_NAMES)].lower(),
+            i)
+
+    def _person(self, i: int) -> Entry:
+        first = _FIRST_NAMES[i % len(_FIRST_NAMES)]
+        last = _LAST_NAMES[(i // len(_FIRST_NAMES)) % len(_LAST_NAMES)]
+        netid = self.netid(i)
+
+        attributes = {
+            "uid": netid,
+            "universityid": self.puid(i),
+            "mail": self.email(i),
+            "eduPersonPrincipalName": ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format(netid),
+            "cn": "{} {}".format(first, last),
+            "displayName": "{} {}".format(first, last),
+            "givenName": first,
+            "sn": last,
+            "pustatus": _STATUSES[i % len(_STATUSES)],
+            "ou": _DEPARTMENTS[i % len(_DEPARTMENTS)],
+            "title": "Member",
+            "telephoneNumber": "(609) 258-{:04d}".format(i % 10000),
+            "street": "{} Nassau Hall".format(i % 500),
+            "puinterofficeaddress": "Nassau Hall",
+            "modifyTimestamp": "20200101000000Z",
+        }
+
+        dn = "uid={},{}".format(netid, ptonppl.constants.LDAP_BASE_DN)
+
+        return dn, {key: [value.encode("utf-8")] for (key, value) in attributes.items()}
+
+    def _add(self, entry: Entry):
+        position = len(self._entries)
+        self._entries.append(entry)
+
+        (_, attributes) = entry
+        for (key, values) in attributes.items():
+            index = self._index.setdefault(key.lower(), dict())
+            for value in values:
+                index.setdefault(value.decode("utf-8").lower(), list()).append(position)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def search(self, ldap_filter: typing.Optional[str] = None) -> typing.List[Entry]:
+        """
+        Entries matching `ldap_filter`, which may only be made of equality
+        (or presence) tests, and of `&` and `|` combinations of these.
+        """
+        if ldap_filter is None:
+            return list(self._entries)
+
+        positions = self._match(_parse_filter(ldap_filter))
+
+        return [self._entries[position] for position in sorted(positions)]
+
+    def _match(self, node) -> typing.Set[int]:
+        (op, args) = node
+
+        if op == "|":
+            return set().union(*map(self._match, args))
+
+        if op == "&":
+            return set.intersection(*map(self._match, args))
+
+        (key, value) = args
+        index = self._index.get(key.lower(), dict())
+
+        if value == "*":
+            return {position for positions in index.values() for position in positions}
+
+        return set(index.get(value.lower(), list()))
+
+    def webdir_search(self, field: str, op: str, value: str) -> typing.List[Entry]:
+        """
+        Entries matching a search of the campus directory website, by NetID
+        (exactly) or by email address (exactly, or as a prefix).
+        """
+        key = "uid" if field == ptonppl.constants.WebdirFields.NETID.value else "mail"
+        value = value.lower()
+
+        if op == ptonppl.constants.WebdirFilterOps.BEGINS_WITH.value:
+            positions = {
+                position
+                for (other_value, other_positions) in self._index.get(key, dict()).items()
+                if other_value.startswith(value)
+                for position in other_positions
+            }
+        else:
+            positions = set(self._index.get(key, dict()).get(value, list()))
+
+        return [self._entries[position] for position in sorted(positions)]
+
+
+def _parse_filter(ldap_filter: str):
+
+    # (a recursive descent parser of the filters that `ptonppl` produces)
+
+    def parse(pos: int):
+        assert ldap_filter[pos] == "("
+        pos += 1
+
+        if ldap_filter[pos] in "&|":
+            op = ldap_filter[pos]
+            pos += 1
+            args = []
+            while ldap_filter[pos] == "(":
+                (arg, pos) = parse(pos)
+                args.append(arg)
+            assert ldap_filter[pos] == ")"
+            return (op, args), pos + 1
+
+        end = ldap_filter.index(")", pos)
+        (key, value) = ldap_filter[pos:end].split("=", 1)
+        value = re.sub(r"\\([0-9a-fA-F]{2})", lambda m: chr(int(m.group(1), 16)), value)
+
+        return ("=", (key, value)), end + 1
+
+    if not ldap_filter.startswith("("):
+        ldap_filter = "({})".format(ldap_filter)
+
+    (node, _) = parse(0)
+
+    return node
+
+
+# Rendering of entries, as the campus directory website and the proxy do
+
+_WEBDIR_PAGE = """<!DOCTYPE html>
+<html lang="en" dir="ltr">
+<head><meta charset="utf-8" /><title>Advanced People Search | Princeton University</title></head>
+<body class="path-search">
+  <main id="main-content">
+    <div class="people-results">
+      <h2>People</h2>
+      <div class="bordered">
+{rows}
+      </div>
+    </div>
+  </main>
+</body>
+</html>
+"""
+
+_WEBDIR_ROW = """        <div class="row">
+          <div class="people-search-result">
+            <div class="people-search-result-name">{sn}, {givenName}</div>
+            <div class="title">{title}</div>
+            <div class="people-search-result-department">{ou}</div>
+            <div class="people-search-result-contact">
+              <a class="people-search-email" href="mailto:{mail}">{mail}</a>
+              <span class="people-search-result-phone">{telephoneNumber}</span>
+            </div>
+            <div class="expanded-details">
+              <h4>NetID</h4>
+              <span class="expanded-details-value">{uid}</span>
+              <h4>University ID</h4>
+              <span class="expanded-details-value">{universityid}</span>
+              <h4>Office Location</h4>
+              <span class="expanded-details-value">{street}</span>
+              <h4>Interoffice Address</h4>
+              <span class="expanded-details-value">{puinterofficeaddress}</span>
+            </div>
+          </div>
+        </div>"""
+
+
+def render_webdir(entries: typing.List[Entry]) -> bytes:
+    rows = [
+        _WEBDIR_ROW.format(**{key: values[0].decode("utf-8") for (key, values) in attributes.items()})
+        for (_, attributes) in entries
+    ]
+    return _WEBDIR_PAGE.format(rows="\n".join(rows)).encode("utf-8")
+
+
+def render_ldif(entries: typing.List[Entry]) -> bytes:
+    lines = ["# extended LDIF", "#", "# LDAPv3", ""]
+
+    for (dn, attributes) in entries:
+        lines.append("dn: {}".format(dn))
+        for (key, values) in attributes.items():
+            for value in values:
+                lines.append("{}: {}".format(key, value.decode("utf-8")))
+        lines.append("")
+
+    lines += ["# search result", "search: 2", "result: 0 Success", ""]
+
+    return "\n".join(lines).encode("utf-8")
+
+
+# Sources of responses: each answers an LDAP search with a list of entries,
+# or an HTTP request with a status code and content (along with how long
+# the response took, when it is known)
+
+LdapResponse = typing.Tuple[typing.List[Entry], bool, typing.Optional[float]]
+HttpResponse = typing.Tuple[int, bytes, typing.Optional[float]]
+
+
+def _ldap_key(ldap_filter: typing.Optional[str], attrlist: typing.Optional[typing.List[str]], size_limit: int) -> str:
+    return json.dumps([ldap_filter, sorted(attrlist) if attrlist is not None else None, size_limit])
+
+
+def _http_key(url: str, params: typing.Optional[str]) -> str:
+    return url if not params else "{}?{}".format(url, params)
+
+
+class DirectorySource:
+    """
+    Responses of the backends, computed from a `Directory`.
+    """
+
+    def __init__(self, directory: Directory):
+        self._directory = directory
+
+    def ldap(self, ldap_filter, attrlist, size_limit) -> LdapResponse:
+        # (copies, as `ptonppl.ldap` adds attributes to the entries)
+        entries = [
+            (dn, {
+                key: values
+                for (key, values) in attributes.items()
+                if attrlist is None or key in attrlist
+            })
+            for (dn, attributes) in self._directory.search(ldap_filter)
+        ]
+
+        # (as the server does, report whether there were more results)
+        if 0 < size_limit < len(entries):
+            return entries[:size_limit], True, None
+
+        return entries, False, None
+
+    def http(self, url, params) -> HttpResponse:
+        if url == ptonppl.constants.LDAP_DEFAULT_PROXY_URL:
+            (field, value) = params.split("=", 1)
+            entries = self._directory.search("({}={})".format(field, value))
+            return 200, render_ldif(entries[:1]), None
+
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        for field in ptonppl.constants.WebdirFields:
+            if field.value in query:
+                entries = self._directory.webdir_search(
+                    field=field.value,
+                    op=query.get(field.value + "f", [""])[0],
+                    value=query[field.value][0])
+                return 200, render_webdir(entries), None
+
+        return 404, b"", None
+
+
+class Cassette:
+    """
+    Responses recorded from the real backends, stored as JSON in `path`.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._ldap: typing.Dict[str, typing.Any] = dict()
+        self._http: typing.Dict[str, typing.Any] = dict()
+        self._lock = threading.Lock()
+        self._misses = 0
+
+    @property
+    def misses(self) -> int:
+        """
+        Number of requests replayed that had not been recorded.
+        """
+        return self._misses
+
+    def load(self):
+        with open(self._path) as f:
+            data = json.load(f)
+        self._ldap = data["ldap"]
+        self._http = data["http"]
+
+    def save(self):
+        with open(self._path, "w") as f:
+            json.dump({"ldap": self._ldap, "http": self._http}, f, indent=1, sort_keys=True)
+
+    def put_ldap(self, ldap_filter, attrlist, size_limit, response: LdapResponse):
+        (entries, truncated, elapsed) = response
+        with self._lock:
+            self._ldap[_ldap_key(ldap_filter, attrlist, size_limit)] = {
+                "entries": [
+                    [dn, {key: [base64.b64encode(value).decode("ascii") for value in values]
+                          for (key, values) in attributes.items()}]
+                    for (dn, attributes) in entries
+                ],
+                "truncated": truncated,
+                "elapsed": elapsed,
+            }
+
+    def put_http(self, url, params, response: HttpResponse):
+        (status, content, elapsed) = response
+        with self._lock:
+            self._http[_http_key(url, params)] = {
+                "status": status,
+                "content": base64.b64encode(content).decode("ascii"),
+                "elapsed": elapsed,
+            }
+
+    def ldap(self, ldap_filter, attrlist, size_limit) -> LdapResponse:
+        recorded = self._ldap.get(_ldap_key(ldap_filter, attrlist, size_limit))
+        if recorded is None:
+            with self._lock:
+                self._misses += 1
+            return [], False, None
+
+        entries = [
+            (dn, {key: [base64.b64decode(value) for value in values] for (key, values) in attributes.items()})
+            for (dn, attributes) in recorded["entries"]
+        ]
+        return entries, recorded["truncated"], recorded["elapsed"]
+
+    def http(self, url, params) -> HttpResponse:
+        recorded = self._http.get(_http_key(url, params))
+        if recorded is None:
+            with self._lock:
+                self._misses += 1
+            return 404, b"", None
+
+        return recorded["status"], base64.b64decode(recorded["content"]), recorded["elapsed"]
+
+
+class RecordingSource:
+    """
+    Responses of the real backends, which are recorded in a `Cassette`.
+    """
+
+    def __init__(self, cassette: Cassette):
+        self._cassette = cassette
+        self._session = requests.Session()
+
+        # (the connections to the real server are those `ptonppl` would use)
+        self._pool = ptonppl.ldap.ConnectionPool()
+
+    def ldap(self, ldap_filter, attrlist, size_limit) -> LdapResponse:
+        time_start = time.monotonic()
+
+        entries: typing.List[Entry] = list()
+        truncated = False
+
+        with self._pool.connection() as server:
+            msg_id = server.search_ext(
+                base=ptonppl.constants.LDAP_BASE_DN,
+                scope=ldap.SCOPE_SUBTREE,
+                filterstr=ldap_filter or "(objectClass=*)",
+                attrlist=attrlist,
+                sizelimit=size_limit,
+            )
+            while True:
+                try:
+                    (_, results) = server.result(msgid=msg_id, all=0)
+                except ldap.SIZELIMIT_EXCEEDED:
+                    truncated = True
+                    break
+                if not results:
+                    break
+                entries.extend(results)
+
+        response = (entries, truncated, time.monotonic() - time_start)
+        self._cassette.put_ldap(ldap_filter, attrlist, size_limit, response)
+
+        return response
+
+    def http(self, url, params) -> HttpResponse:
+        time_start = time.monotonic()
+
+        r = self._session.get(url, params=params, timeout=ptonppl.requests.DEFAULT_TIMEOUT)
+
+        response = (r.status_code, r.content, time.monotonic() - time_start)
+        self._cassette.put_http(url, params, response)
+
+        return response
+
+
+# Simulated transports, which `ptonppl` is made to use instead of the real
+# LDAP connections and HTTP session
+
+class SimulatedConnection:
+    """
+    Stand-in for `ldap.ldapobject.LDAPObject`, answering the requests made
+    by `ptonppl.ldap` from `source`.
+    """
+
+    protocol_version = 3
+
+    def __init__(self, source, profile: Profile):
+        self._source = source
+        self._profile = profile
+        self._pending: typing.Dict[int, typing.Tuple[typing.List[Entry], bool]] = dict()
+        self._next_id = 1
+
+    def search_ext(self, base, scope, filterstr=None, attrlist=None, serverctrls=None, sizelimit=0, **kwargs):
+        (entries, truncated, elapsed) = self._source.ldap(filterstr, attrlist, sizelimit)
+
+        self._profile.delay(elapsed)
+        if self._profile.fails():
+            raise ldap.SERVER_DOWN({"desc": "Can't contact LDAP server (simulated)"})
+
+        # (pages are requested by the offset of their first entry)
+        if serverctrls:
+            control = serverctrls[0]
+            start = int(control.cookie or b"0")
+            end = start + control.size
+            cookie = str(end).encode("ascii") if end < len(entries) else b""
+            entries = entries[start:end]
+            truncated = cookie
+
+        msg_id = self._next_id
+        self._next_id += 1
+        self._pending[msg_id] = (list(entries), truncated)
+
+        return msg_id
+
+    def result(self, msgid, all=1, timeout=None):
+        (entries, truncated) = self._pending[msgid]
+
+        if len(entries) == 0:
+            del self._pending[msgid]
+            if truncated:
+                raise ldap.SIZELIMIT_EXCEEDED({"desc": "Size limit exceeded (simulated)"})
+            return ldap.RES_SEARCH_RESULT, []
+
+        return ldap.RES_SEARCH_ENTRY, [entries.pop(0)]
+
+    def result3(self, msgid, all=1, timeout=None):
+        (entries, cookie) = self._pending.pop(msgid)
+        control = ldap.controls.SimplePagedResultsControl(True, size=0, cookie=cookie or b"")
+        return ldap.RES_SEARCH_RESULT, entries, msgid, [control]
+
+    def whoami_s(self):
+        return ""
+
+    def unbind_s(self):
+        pass
+
+
+class _SimulatedPool(ptonppl.ldap.ConnectionPool):
+
+    def __init__(self, source, profile: Profile):
+        super().__init__()
+        self._source = source
+        self._profile = profile
+
+    def _create(self):
+        return SimulatedConnection(source=self._source, profile=self._profile)
+
+
+class SimulatedSession:
+    """
+    Stand-in for the `requests.Session` of `ptonppl.requests`, answering
+    requests to the campus directory website (`webdir` profile) and to the
+    LDAP proxy (`proxy` profile) from `source`.
+    """
+
+    def __init__(self, source, profiles: typing.Dict[str, Profile]):
+        self._source = source
+        self._profiles = profiles
+
+    def get(self, url, params=None, stream=False, **kwargs):
+        (status, content, elapsed) = self._source.http(url, params)
+
+        profile = self._profiles["proxy" if url == ptonppl.constants.LDAP_DEFAULT_PROXY_URL else "webdir"]
+        profile.delay(elapsed)
+        if profile.fails():
+            (status, content) = (503, b"")
+
+        r = requests.models.Response()
+        r.status_code = status
+        r.url = _http_key(url, params)
+        r._content = content
+        r._content_consumed = True
+
+        return r
+
+
+# Installation of the simulation
+
+def reset():
+    """
+    Forget everything `ptonppl` remembers from one search to the next (its
+    caches, and the health and metrics of the backends).
+    """
+    ptonppl.cache.memory_cache = ptonppl.cache.MemoryCache()
+    ptonppl.webdir.harvest_index = None
+    ptonppl.health.registry.reset()
+    ptonppl.metrics.registry.reset()
+
+
+@contextlib.contextmanager
+def _installed(source, profiles: typing.Dict[str, Profile]):
+    saved = (
+        ptonppl.ldap.pool,
+        ptonppl.ldap._ldap_restricted,
+        ptonppl.requests.session,
+        ptonppl.constants.LDAP_DEFAULT_CMD,
+    )
+
+    ptonppl.ldap.pool = _SimulatedPool(source=source, profile=profiles["ldap"])
+    ptonppl.requests.session = SimulatedSession(source=source, profiles=profiles)
+
+    # (the probe of the attributes that are available is skipped)
+    ptonppl.ldap._ldap_restricted = False
+
+    # the local `ldapsearch` command is not simulated
+    ptonppl.constants.LDAP_DEFAULT_CMD = "ptonppl-simulated-ldapsearch-unavailable"
+
+    reset()
+
+    try:
+        yield
+
+    finally:
+        (
+            ptonppl.ldap.pool,
+            ptonppl.ldap._ldap_restricted,
+            ptonppl.requests.session,
+            ptonppl.constants.LDAP_DEFAULT_CMD,
+        ) = saved
+
+
+@contextlib.contextmanager
+def simulate(
+        directory: Directory,
+        profiles: typing.Optional[typing.Dict[str, Profile]] = None,
+) -> typing.Iterator[Directory]:
+    """
+    Answer the searches of `ptonppl` from `directory`, with the latency and
+    failures of `profiles` (by default, instantly and without failures).
+    """
+    profiles = profiles if profiles is not None else make_profiles("instant")
+
+    with _installed(source=DirectorySource(directory), profiles=profiles):
+        yield directory
+
+
+@contextlib.contextmanager
+def record(path: str) -> typing.Iterator[Cassette]:
+    """
+    Forward the searches of `ptonppl` to the real backends, and record
+    their responses in the cassette file `path`.
+    """
+    cassette = Cassette(path)
+
+    with _installed(source=RecordingSource(cassette), profiles=make_profiles("instant")):
+        try:
+            yield cassette
+        finally:
+            cassette.save()
+
+
+@contextlib.contextmanager
+def replay(
+        path: str,
+        speed: float = 1.0,
+) -> typing.Iterator[Cassette]:
+    """
+    Answer the searches of `ptonppl` with the responses recorded in the
+    cassette file `path`, each taking as long as it did when recorded
+    (divided by `speed`; replayed instantly when it is 0).
+    """
+    cassette = Cassette(path)
+    cassette.load()
+
+    profiles = {
+        backend: Profile(latency=0.0)
+        for backend in ["ldap", "webdir", "proxy"]
+    }
+
+    with _installed(source=_Scaled(source=cassette, speed=speed), profiles=profiles):
+        yield cassette
+
+
+class _Scaled:
+
+    def __init__(self, source, speed: float):
+        self._source = source
+        self._speed = speed
+
+    def _scale(self, elapsed: typing.Optional[float]) -> typing.Optional[float]:
+        if elapsed is None or self._speed <= 0:
+            return None
+        return elapsed / self._speed
+
+    def ldap(self, *args) -> LdapResponse:
+        (entries, truncated, elapsed) = self._source.ldap(*args)
+        return entries, truncated, self._scale(elapsed)
+
+    def http(self, *args) -> HttpResponse:
+        (status, content, elapsed) = self._source.http(*args)
+        return status, content, self._scale(elapsed)
@@ -1,5 +1,7 @@
 
 import io
+import itertools
+import json
 import sys
 import time
 import typing
@@ -9,8 +11,16 @@ import click_help_colors
 
 import ptonppl
 import ptonppl.abstract
+import ptonppl.cache
+import ptonppl.checkpoint
 import ptonppl.constants
 import ptonppl.control
+import ptonppl.health
+import ptonppl.metrics
+import ptonppl.mirror
+import ptonppl.output
+import ptonppl.planner
+import ptonppl.trace
 
 
 __author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
@@ -22,25 +32,90 @@ try:
     OutputFormatType = typing.Union[
         typing.Literal["term"],
         typing.Literal["json"],
+        typing.Literal["ndjson"],
         typing.Literal["csv"],
         typing.Literal["emails"],
     ]
 except AttributeError:
     OutputFormatType = str
 
+cli_opt_type = click.option(
+    "--type", "-t",
+    type=click.Choice(ptonppl.output.OUTPUT_TYPES, case_sensitive=False),
+    default="term", metavar="TYPE",
+    help="Output type (e.g.: term, json, ndjson, csv, emails)."
+)
+
+cli_opt_fields = click.option(
+    "--fields", "-f",
+    type=str,
+    default=",".join(ptonppl.constants.OUTPUT_CSV_HEADER), metavar="FIELDS",
+    help="Fields to keep (e.g.: 'puid,netid,email')."
+)
+
+cli_opt_header = click.option(
+    "--header/--no-header", " /-nh",
+    is_flag=True, default=True,
+    help="Include or remove header in output."
+)
+
+
+def _parse_fields(fields: typing.Optional[str]) -> typing.List[str]:
+    if fields is None:
+        return ptonppl.constants.OUTPUT_CSV_HEADER[:]
+
+    return [
+        field
+        for field in fields.lower().split(",")
+        if field in ptonppl.constants.OUTPUT_CSV_HEADER
+    ]
+
+
+class DefaultCommandGroup(click_help_colors.HelpColorsGroup):
+    """
+    Group of commands that falls back to a default command when the first
+    argument is not the name of one of its commands, so that, for instance,
+    `ptonppl lumbroso` is the same as `ptonppl search lumbroso`.
+    """
+
+    def __init__(self, *args, default_command: typing.Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if self.default_command is not None and (
+                len(args) == 0 or
+                (args[0] not in self.commands and args[0] not in ctx.help_option_names + ["--version"])):
+            args = [self.default_command, *args]
 
-@click.command(
+        return super().parse_args(ctx, args)
+
+
+@click.group(
+    cls=DefaultCommandGroup,
+    default_command="search",
+    help_headers_color='yellow',
+    help_options_color='bright_yellow'
+)
+@cli_opt_version
+def cli():
+    """
+    Lookup the directory information (PUID, NetID, email, name) of any
+    Princeton campus person, using whichever of LDAP, web directory or
+    proxy server is available.
+
+    Without a command, the arguments are those of `search`.
+    """
+
+
+@cli.command(
+    name="search",
     cls=click_help_colors.HelpColorsCommand,
     help_headers_color='yellow',
     help_options_color='bright_yellow'
 )
 @click.argument("query", nargs=-1)
-@click.option(
-    "--type", "-t",
-    type=click.Choice(["term", "json", "csv", "emails"], case_sensitive=False),
-    default="term", metavar="TYPE",
-    help="Output type (e.g.: term, json, csv, emails)."
-)
+@cli_opt_type
 @click.option(
     "--uniq/--not-uniq", "-u/-nu",
     is_flag=True, default=True,
@@ -56,19 +131,79 @@ except AttributeError:
     type=click.File("r"),
     help="Read input from a file stream."
 )
+@cli_opt_fields
+@cli_opt_header
 @click.option(
-    "--fields", "-f",
-    type=str,
-    default=",".join(ptonppl.constants.OUTPUT_CSV_HEADER), metavar="FIELDS",
-    help="Fields to keep (e.g.: 'puid,netid,email')."
+    "--batch-size", "-b",
+    type=click.IntRange(min=1),
+    default=ptonppl.constants.LDAP_BATCH_SIZE, metavar="SIZE",
+    help="Number of queries grouped in each batched LDAP search."
 )
 @click.option(
-    "--header/--no-header", " /-nh",
+    "--jobs", "-j",
+    type=click.IntRange(min=1),
+    default=1, metavar="N",
+    help="Number of queries looked up concurrently."
+)
+@click.option(
+    "--hedge",
+    type=click.FloatRange(min=0), metavar="SECONDS",
+    help="Start the next backend when one is slower than this."
+)
+@click.option(
+    "--cache", "cache_path",
+    type=click.Path(dir_okay=False, writable=True), metavar="PATH",
+    help="Remember results in (and reuse them from) this SQLite file."
+)
+@click.option(
+    "--cache-ttl",
+    type=click.IntRange(min=0),
+    default=ptonppl.constants.CACHE_DEFAULT_TTL, metavar="SECONDS",
+    help="Maximum age of the cached results that are reused."
+)
+@click.option(
+    "--mirror", "mirror_path",
+    type=click.Path(dir_okay=False, exists=True), metavar="PATH",
+    help="Answer from this local mirror first (see: ptonppl mirror)."
+)
+@click.option(
+    "--all-attributes",
+    is_flag=True, default=False,
+    help="Fetch every LDAP attribute, not only those needed for the fields."
+)
+@click.option(
+    "--harvest/--no-harvest",
     is_flag=True, default=True,
-    help="Include or remove header in output."
+    help="Remember everyone listed on the web directory pages fetched."
+)
+@click.option(
+    "--explain",
+    is_flag=True, default=False,
+    help="Print the plan of each search, with the timing of each step."
+)
+@click.option(
+    "--metrics", "metrics_output",
+    type=click.File("w"), metavar="FILE",
+    help="Dump the metrics of each backend (counts, latencies) as JSON."
+)
+@click.option(
+    "--trace", "trace_output",
+    type=click.File("w"), metavar="FILE",
+    help="Write the attempts made for each query as a line of JSON."
+)
+@click.option(
+    "--dedup-window",
+    type=click.IntRange(min=0),
+    default=ptonppl.constants.DEDUP_WINDOW, metavar="N",
+    help="Number of recent NetIDs remembered to filter out duplicates."
+)
+@click.option(
+    "--checkpoint", "checkpoint_path",
+    type=click.Path(dir_okay=False, writable=True), metavar="FILE",
+    help="Record completed queries in this file, to resume from it if interrupted."
 )
 @cli_opt_version
-def cli(
+def cli_search(
         query: typing.Tuple[str],
         type: OutputFormatType,
         uniq: bool,
@@ -76,6 +211,19 @@ def cli(
         input: typing.Optional[io.TextIOWrapper],
         fields: typing.Optional[str],
         header: bool,
+        batch_size: int,
+        jobs: int,
+        hedge: typing.Optional[float],
+        cache_path: typing.Optional[str],
+        cache_ttl: int,
+        mirror_path: typing.Optional[str],
+        all_attributes: bool,
+        harvest: bool,
+        explain: bool,
+        metrics_output: typing.Optional[io.TextIOWrapper],
+        trace_output: typing.Optional[io.TextIOWrapper],
+        dedup_window: int,
+        checkpoint_path: typing.Optional[str],
 ):
     """
     Lookup the directory information (PUID, NetID, email, name) of any
@@ -83,7 +231,13 @@ def cli(
     proxy server is available.
     """
 
-    # Check for input file
+    # (imported here rather than globally, so that `--help` and `--version`
+    # do not have to load the backends)
+    import ptonppl.ldap
+    import ptonppl.webdir
+
+    # Check for input file (which is read as the queries are processed, so
+    # that it may be arbitrarily large, or a stream)
 
     if input is not None:
         try:
@@ -91,46 +245,115 @@ def cli(
         except io.UnsupportedOperation:
             pass
 
-        input_string = input.read()
-        input_tokens = input_string.split()
+    queries = _iter_queries(query=query, input=input)
 
-        query = (*query, *input_tokens)
+    # (peek at the first queries, to tell a single search from many)
+    first_queries = list(itertools.islice(queries, 2))
+    queries = itertools.chain(first_queries, queries)
 
-    if fields is None:
-        fields = ptonppl.constants.OUTPUT_CSV_HEADER[:]
+    fields = _parse_fields(fields)
 
-    else:
-        fields = [
-            field
-            for field in fields.lower().split(",")
-            if field in ptonppl.constants.OUTPUT_CSV_HEADER
-        ]
+    cache: typing.Optional[ptonppl.cache.PersistentCache] = None
+    if cache_path is not None:
+        cache = ptonppl.cache.PersistentCache(path=cache_path, ttl=cache_ttl)
+
+    mirror: typing.Optional[ptonppl.mirror.Mirror] = None
+    if mirror_path is not None:
+        mirror = ptonppl.mirror.Mirror(path=mirror_path)
+
+    # Only request from LDAP the attributes needed for the output fields
+    # (unless the records are cached, as they may later be needed in full)
+
+    ptonppl.ldap.set_requested_fields(
+        fields=ptonppl.output.needed_fields(type=type, fields=fields, header=header) if cache is None else None,
+        fetch_all=all_attributes,
+    )
+
+    # Index every person resolved, under all of their identifiers (PUID,
+    # NetID, alias and email address), so that later queries for the same
+    # person, in any form, are answered without any further search
+
+    ptonppl.cache.memory_cache = ptonppl.cache.MemoryCache(
+        maxsize=ptonppl.constants.IDENTITY_INDEX_MAXSIZE,
+        ttl=float("inf"),
+    )
+
+    # Index every person found on the web directory pages, for this run
+
+    if harvest:
+        ptonppl.webdir.harvest_index = ptonppl.cache.MemoryCache()
+
+    tracer: typing.Optional[ptonppl.trace.Tracer] = None
+    if trace_output is not None:
+        tracer = ptonppl.trace.Tracer(file=trace_output)
+
+    # Queries completed by an earlier run with the same checkpoint are not
+    # searched again, and the queries completed by this run are recorded
+
+    # (queries whose lookup failed, e.g., because a backend could not be
+    # reached, are not recorded, so that the next run searches them again)
+
+    checkpoint: typing.Optional[ptonppl.checkpoint.Checkpoint] = None
+    failures: typing.Optional[typing.Set[str]] = None
+    if checkpoint_path is not None:
+        checkpoint = ptonppl.checkpoint.Checkpoint(path=checkpoint_path)
+        failures = set()
 
     # Initial statistics
 
-    count_total: int = len(query)
     count_success: int = 0
     count_error: int = 0
     count_duplicate: int = 0
+    count_results: int = 0
 
     time_start: float = time.time()
 
     # NetIDs should be a unique, and fairly available piece of data to
-    # check whether we've seen an object before
+    # check whether we've seen an object before (only the most recent ones
+    # are remembered, and records are not kept once output)
 
-    seen_netids: typing.Set[str] = set()
-    results: typing.List[ptonppl.abstract.AbstractPtonPerson] = list()
+    seen_netids = ptonppl.cache.RecentSet(maxsize=dedup_window)
 
-    if type == "json":
-        print("{")
+    writer = ptonppl.output.RecordWriter(type=type, fields=fields, header=header)
+    writer.prologue()
 
-    elif type == "csv" and header:
-        print(",".join(fields))
+    # lookup objects (when there are many queries, resolve them in batches
+    # to save on round trips, and concurrently if so requested)
 
-    for q in query:
+    # (explaining searches requires that they are made one at a time)
 
-        # lookup object
-        obj = ptonppl.control.search(value=q)
+    def lookup(values: typing.Iterable[str]):
+        if explain:
+            return (
+                (q, _explain_search(
+                    value=q, hedge=hedge, cache=cache, mirror=mirror, tracer=tracer, failures=failures))
+                for q in values
+            )
+        elif jobs > 1:
+            return ptonppl.control.search_many(
+                values=values, workers=jobs, chunk_size=batch_size,
+                hedge=hedge, cache=cache, mirror=mirror, tracer=tracer, failures=failures)
+        elif len(first_queries) > 1:
+            return ptonppl.control.search_batch(
+                values=values, chunk_size=batch_size,
+                hedge=hedge, cache=cache, mirror=mirror, tracer=tracer, failures=failures)
+        else:
+            return (
+                (q, ptonppl.control.search(
+                    value=q, hedge=hedge, cache=cache, mirror=mirror, tracer=tracer, failures=failures))
+                for q in values
+            )
+
+    if checkpoint is not None:
+        lookups = checkpoint.resume(values=queries, lookup=lookup, failures=failures)
+    else:
+        lookups = lookup(queries)
+
+    # (output is buffered, but flushed regularly, so that the records of a
+    # long job are not all held back until the end)
+    time_flushed = time.monotonic()
+
+    for (q, obj) in lookups:
 
         # may not have been found
         if obj is None:
@@ -139,56 +362,33 @@ def cli(
 
         count_success += 1
 
-        if obj.netid in seen_netids:
+        if not seen_netids.add(obj.netid):
             count_duplicate += 1
             if uniq:
                 continue
 
-        # save new results
-        seen_netids.add(obj.netid)
-        results.append(obj)
-
-        if type == "json":
-            print("    {},".format(obj.as_dict.__repr__()))
-
-        elif type == "csv":
-            def quote_csv_cell(s):
-                if ',' in s:
-                    return '"{}"'.format(s.replace('"', '\"'))
-                return s
-            print(",".join(
-                list(map(
-                    lambda field: quote_csv_cell(obj.as_dict.get(field, "")),
-                    fields))))
-
-        elif type == "term":
-            pattern = "{}"
-            if header:
-                print(obj.common_name)
-                pattern = "  {}"
-            if "netid" in fields:
-                print(pattern.format(obj.netid))
-            if "puid" in fields:
-                print(pattern.format(obj.puid))
-            if "email" in fields:
-                print(pattern.format(obj.email))
-            if header:
-                print()
-
-        elif type == "emails":
-            print(
-                '"{name}" <{email}>,'.format(
-                    name=obj.common_name,
-                    email=obj.email.lower(),
-                )
-            )
+        count_results += 1
 
-    if type == "json":
-        print("}")
+        writer.write(obj)
+
+        if time.monotonic() - time_flushed >= ptonppl.constants.OUTPUT_FLUSH_INTERVAL:
+            writer.flush()
+            time_flushed = time.monotonic()
+
+    writer.epilogue()
+
+    if checkpoint is not None:
+        checkpoint.close()
+
+    if cache is not None:
+        cache.close()
+
+    if mirror is not None:
+        mirror.close()
 
     # End statistics
 
-    count_results = len(results)
+    count_total = count_success + count_error
     time_end: float = time.time()
     time_elapsed: float = time_end - time_start
 
@@ -211,6 +411,263 @@ def cli(
             ),
             file=sys.stderr,
         )
+        if checkpoint is not None:
+            _print_checkpoint(checkpoint)
+        _print_identity_index()
+        _print_backend_health()
+        _print_backend_metrics()
+
+    if metrics_output is not None:
+        json.dump(ptonppl.metrics.registry.snapshot(), metrics_output, indent=2)
+        metrics_output.write("\n")
+
+
+def _iter_queries(
+        query: typing.Iterable[str],
+        input: typing.Optional[typing.TextIO] = None,
+) -> typing.Iterator[str]:
+
+    yield from query
+
+    if input is not None:
+        for line in input:
+            yield from line.split()
+
+
+def _explain_search(
+        value: str,
+        **kwargs
+) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+
+    reports = []
+    obj = ptonppl.control.search(value=value, explain=reports, **kwargs)
+
+    print("# plan for {!r} ({}):".format(value, ptonppl.planner.classify(value)), file=sys.stderr)
+
+    for (index, report) in enumerate(reports, 1):
+        print(
+            "#  {index:>2}. {step:<45} {cost:>14}  {outcome:<12} {elapsed:>8}".format(
+                index=index,
+                step=report["step"],
+                cost=(
+                    "(est. {:.0f}ms)".format(report["cost"] * 1000)
+                    if "cost" in report else ""),
+                outcome=report.get("outcome", "not needed"),
+                elapsed=(
+                    "{:.0f}ms".format(report["elapsed"] * 1000)
+                    if "elapsed" in report else ""),
+            ),
+            file=sys.stderr,
+        )
+
+    return obj
+
+
+def _print_checkpoint(checkpoint: ptonppl.checkpoint.Checkpoint):
+    print(
+        "# checkpoint: {resumed} queries resumed, {recorded} recorded, {failed} failed (left pending), "
+        "{completed} completed".format(
+            resumed=checkpoint.resumed,
+            recorded=checkpoint.recorded,
+            failed=checkpoint.failed,
+            completed=checkpoint.completed,
+        ),
+        file=sys.stderr,
+    )
+
+
+def _print_identity_index():
+    index_stats = ptonppl.cache.memory_cache.stats
+    print(
+        "# index: {hits} queries answered, {size} identifiers known".format(**index_stats),
+        file=sys.stderr,
+    )
+
+
+def _print_backend_health():
+    for health in ptonppl.health.registry:
+        health_stats = health.stats
+        print(
+            "# backend {name}: {state}, {calls} calls, {failures} failures, "
+            "{rejected} skipped, {error_rate:.0%} recent errors, {latency} average latency".format(
+                name=health.name,
+                latency=(
+                    "{:.0f}ms".format(health_stats["latency"] * 1000)
+                    if health_stats["latency"] is not None else "no"),
+                **{key: value for (key, value) in health_stats.items() if key != "latency"}
+            ),
+            file=sys.stderr,
+        )
+
+
+def _print_backend_metrics():
+
+    def ms(seconds: typing.Optional[float]) -> str:
+        return "{:.0f}ms".format(seconds * 1000) if seconds is not None else "-"
+
+    for (backend, metrics) in ptonppl.metrics.registry.snapshot().items():
+        latency = metrics["latency"]
+        print(
+            "# latency {backend}: {counts}; p50 {p50}, p95 {p95}, p99 {p99}, max {max}".format(
+                backend=backend,
+                counts=", ".join(
+                    "{} {}".format(count, outcome)
+                    for (outcome, count) in sorted(metrics["counts"].items())
+                ),
+                p50=ms(latency["p50"]),
+                p95=ms(latency["p95"]),
+                p99=ms(latency["p99"]),
+                max=ms(latency["max"]),
+            ),
+            file=sys.stderr,
+        )
+
+
+@cli.command(
+    name="enumerate",
+    cls=click_help_colors.HelpColorsCommand,
+    help_headers_color='yellow',
+    help_options_color='bright_yellow'
+)
+@click.argument("ldap_filter", metavar="FILTER")
+@cli_opt_type
+@cli_opt_fields
+@cli_opt_header
+@click.option(
+    "--page-size",
+    type=click.IntRange(min=1),
+    default=ptonppl.constants.LDAP_PAGE_SIZE, metavar="SIZE",
+    help="Number of entries retrieved from LDAP at a time."
+)
+@click.option(
+    "--stats", "-s",
+    is_flag=True, default=False,
+    help="Display statistics once processing is done."
+)
+def cli_enumerate(
+        ldap_filter: str,
+        type: OutputFormatType,
+        fields: typing.Optional[str],
+        header: bool,
+        page_size: int,
+        stats: bool,
+):
+    """
+    List every person of the LDAP directory matching an arbitrary FILTER,
+    e.g., '(puclassyear=2024)', streaming results page by page.
+    """
+
+    import ptonppl.ldap
+
+    fields = _parse_fields(fields)
+
+    ptonppl.ldap.set_requested_fields(
+        fields=ptonppl.output.needed_fields(type=type, fields=fields, header=header))
+
+    count_results: int = 0
+    time_start: float = time.time()
+
+    writer = ptonppl.output.RecordWriter(type=type, fields=fields, header=header)
+    writer.prologue()
+
+    for obj in ptonppl.ldap.iter_search(ldap_filter=ldap_filter, page_size=page_size):
+        writer.write(obj)
+        count_results += 1
+
+    writer.epilogue()
+
+    time_elapsed: float = time.time() - time_start
+
+    if stats:
+        print("# counts: {results} output".format(results=count_results), file=sys.stderr)
+        print("# timing: {elapsed:.2}s".format(elapsed=time_elapsed), file=sys.stderr)
+
+
+@cli.group(
+    name="mirror",
+    cls=click_help_colors.HelpColorsGroup,
+    help_headers_color='yellow',
+    help_options_color='bright_yellow'
+)
+def cli_mirror():
+    """
+    Maintain a local mirror of the directory, to answer searches without
+    network access (with: ptonppl search --mirror PATH).
+    """
+
+
+@cli_mirror.command(
+    name="sync",
+    cls=click_help_colors.HelpColorsCommand,
+    help_headers_color='yellow',
+    help_options_color='bright_yellow'
+)
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "--filter", "ldap_filter",
+    type=str, metavar="FILTER",
+    help="Entries to mirror (default: same as last sync, or '{}').".format(
+        ptonppl.constants.LDAP_MIRROR_FILTER)
+)
+@click.option(
+    "--full",
+    is_flag=True, default=False,
+    help="Download every entry again, and drop those that were removed."
+)
+@click.option(
+    "--page-size",
+    type=click.IntRange(min=1),
+    default=ptonppl.constants.LDAP_PAGE_SIZE, metavar="SIZE",
+    help="Number of entries retrieved from LDAP at a time."
+)
+def cli_mirror_sync(
+        path: str,
+        ldap_filter: typing.Optional[str],
+        full: bool,
+        page_size: int,
+):
+    """
+    Create or update the mirror stored in PATH, only downloading the
+    entries that changed since the last sync.
+    """
+
+    with ptonppl.mirror.Mirror(path=path) as mirror:
+        result = mirror.sync(ldap_filter=ldap_filter, full=full, page_size=page_size)
+        info = mirror.info
+
+    print(
+        "# sync: {mode}, {updated} updated, {removed} removed, {entries} entries".format(
+            mode="full" if result["full"] else "incremental",
+            updated=result["updated"],
+            removed=result["removed"],
+            entries=info["entries"],
+        ),
+        file=sys.stderr,
+    )
+    print("# timing: {elapsed:.2}s".format(elapsed=result["elapsed"]), file=sys.stderr)
+
+
+@cli_mirror.command(
+    name="info",
+    cls=click_help_colors.HelpColorsCommand,
+    help_headers_color='yellow',
+    help_options_color='bright_yellow'
+)
+@click.argument("path", type=click.Path(dir_okay=False, exists=True))
+def cli_mirror_info(path: str):
+    """
+    Describe the mirror stored in PATH.
+    """
+
+    with ptonppl.mirror.Mirror(path=path) as mirror:
+        info = mirror.info
+
+    print("entries: {}".format(info["entries"]))
+    print("filter: {}".format(info["filter"]))
+    print("modified: {}".format(info["modified"]))
+    print("last sync: {}".format(
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info["last_sync"]))
+        if info["last_sync"] is not None else None))
 
 
 def main():
@@ -1,46 +1,130 @@
 
+import collections
 import copy
+import functools
 import typing
 
+import ptonppl.constants
+
 
 __author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
 
 __all__ = [
     "AbstractPtonPerson",
+    "normalize_identifier",
 ]
 
 
+def normalize_identifier(value: typing.Any) -> str:
+    """
+    Normalize a PUID, NetID, alias or email address into the form under
+    which it is indexed (see `AbstractPtonPerson.identifiers`).
+    """
+    return str(value).strip().lower()
+
+
 class AbstractPtonPerson:
+    """
+    Record of a person, which cannot be modified once created: merging two
+    records produces a new one, which shares (rather than copies) the
+    original payloads of both.
+    """
+
+    __slots__ = (
+        "_puid",
+        "_netid",
+        "_alias",
+        "_email",
+        "_pustatus",
+        "_cn",
+        "_original",
+        "_as_dict",
+        "_frozen",
+    )
+
+    def __init__(
+            self,
+            puid: typing.Optional[int] = None,
+            netid: typing.Optional[str] = None,
+            alias: typing.Optional[str] = None,
+            email: typing.Optional[str] = None,
+            pustatus: typing.Optional[str] = None,
+            cn: typing.Optional[str] = None,
+            original: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+    ):
+        self._puid = puid
+        self._netid = netid
+        self._alias = alias
+        self._email = email
+        self._pustatus = pustatus
+        self._cn = cn
+        self._original = original
+        self._as_dict = None
+
+        # (the `__init__` of a subclass may still set fields once this one
+        # returns, see `__init_subclass__`)
+        if type(self).__init__ is AbstractPtonPerson.__init__:
+            self._frozen = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # the records of a subclass are frozen once its own `__init__` has
+        # returned, as it may set their fields directly
+        init = cls.__dict__.get("__init__")
+        if init is None:
+            return
+
+        @functools.wraps(init)
+        def __init__(self, *args, **kwargs):
+            init(self, *args, **kwargs)
+
+            # (unless it was called by the `__init__` of a further subclass)
+            if type(self).__init__ is __init__:
+                self._frozen = True
 
-    _puid: typing.Optional[int] = None
-    _netid: typing.Optional[str] = None
-    _alias: typing.Optional[str] = None
-    _email: typing.Optional[str] = None
-    _pustatus: typing.Optional[str] = None
-    _cn: typing.Optional[str] = None
+        cls.__init__ = __init__
 
-    _original: typing.Optional[typing.Any] = None
+    def __getattr__(self, name: str) -> typing.Any:
+        # (the fields that a subclass did not set are missing)
+        if name in AbstractPtonPerson.__slots__:
+            return None
+
+        raise AttributeError("{!r} object has no attribute {!r}".format(type(self).__name__, name))
+
+    def __setattr__(self, name: str, value: typing.Any):
+        # (fields may only be set while the record is being built)
+        if self._frozen:
+            raise AttributeError("{!r} object is immutable".format(type(self).__name__))
+
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name: str):
+        if self._frozen:
+            raise AttributeError("{!r} object is immutable".format(type(self).__name__))
+
+        object.__delattr__(self, name)
+
+    def __reduce__(self):
+        # (copies and pickles are rebuilt, rather than set field by field)
+        return _make, (
+            type(self), self._puid, self._netid, self._alias, self._email,
+            self._pustatus, self._cn, self._original,
+        )
 
     def merge(self, obj: 'AbstractPtonPerson') -> 'AbstractPtonPerson':
-        # defensive copy
-        self_copy = copy.deepcopy(self)
 
         # pick best version of attribute
-        self_copy._puid = self_copy._puid or obj._puid
-        self_copy._netid = self_copy._netid or obj._netid
-        self_copy._alias = self_copy._alias or obj._alias
-        self_copy._email = self_copy._email or obj._email
-        self_copy._pustatus = self_copy._pustatus or obj._pustatus
-        self_copy._cn = self_copy._cn or obj._cn
-
-        # update original dict
-        if obj._original is not None:
-            orig = copy.deepcopy(obj._original)
-            if self_copy._original is not None:
-                orig.update(self_copy._original)
-            self_copy._original = orig
-
-        return self_copy
+        return _make(
+            type(self),
+            puid=self._puid or obj._puid,
+            netid=self._netid or obj._netid,
+            alias=self._alias or obj._alias,
+            email=self._email or obj._email,
+            pustatus=self._pustatus or obj._pustatus,
+            cn=self._cn or obj._cn,
+            original=_chain(self._original, obj._original),
+        )
 
     @property
     def complete(self):
@@ -80,12 +164,62 @@ class AbstractPtonPerson:
 
     @property
     def original(self) -> typing.Any:
-        # defensive copy
-        if self._original is not None:
-            return copy.deepcopy(self._original)
+        # defensive copy (merged payloads, which are only chained, are
+        # flattened into one mapping, as they were when merging copied them)
+        original = self._original
+        if isinstance(original, collections.ChainMap):
+            original = dict(original)
+
+        if original is not None:
+            return copy.deepcopy(original)
+
+    @property
+    def identifiers(self) -> typing.Set[str]:
+        """
+        Every (normalized) value that identifies this person, that is, any
+        value that, if searched, should produce this record.
+        """
+        keys = set()
+
+        if self._puid is not None:
+            keys.add(normalize_identifier(self._puid))
+
+        for name in [self._netid, self._alias]:
+            if name is not None:
+                keys.add(normalize_identifier(name))
+                keys.add(normalize_identifier(
+                    ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format(name)))
+
+        if self._email is not None:
+            keys.add(normalize_identifier(self._email))
+
+        return keys
+
+    @classmethod
+    def from_dict(cls, d: typing.Dict[str, typing.Any]) -> 'AbstractPtonPerson':
+        """
+        Rebuild a record from the output of `as_dict`.
+        """
+        return _make(
+            cls,
+            puid=d.get("puid"),
+            netid=d.get("netid"),
+            alias=d.get("alias"),
+            email=d.get("email"),
+            pustatus=d.get("type"),
+            cn=d.get("name"),
+        )
 
     @property
     def as_dict(self) -> typing.Dict[str, typing.Any]:
+        # (computed once, as the record does not change; a copy is returned,
+        # which the caller is free to modify)
+        if self._as_dict is None:
+            object.__setattr__(self, "_as_dict", self._make_dict())
+
+        return dict(self._as_dict)
+
+    def _make_dict(self) -> typing.Dict[str, typing.Any]:
         ret = dict()
 
         for (name, val) in [
@@ -103,3 +237,38 @@ class AbstractPtonPerson:
             del ret["alias"]
 
         return ret
+
+
+def _make(
+        cls: typing.Type[AbstractPtonPerson],
+        *args: typing.Any,
+        **kwargs: typing.Any,
+) -> AbstractPtonPerson:
+    # (records of any subclass are built from their fields, without its own
+    # `__init__`, whose arguments may differ)
+    obj = object.__new__(cls)
+    AbstractPtonPerson.__init__(obj, *args, **kwargs)
+    object.__setattr__(obj, "_frozen", True)
+    return obj
+
+
+def _chain(
+        first: typing.Optional[typing.Mapping[str, typing.Any]],
+        second: typing.Optional[typing.Mapping[str, typing.Any]],
+) -> typing.Optional[typing.Mapping[str, typing.Any]]:
+
+    # the keys of `first` take precedence over those of `second`
+    if first is None:
+        return second
+
+    if second is None:
+        return first
+
+    maps = []
+    for mapping in [first, second]:
+        if isinstance(mapping, collections.ChainMap):
+            maps.extend(mapping.maps)
+        else:
+            maps.append(mapping)
+
+    return collections.ChainMap(*maps)
@@ -0,0 +1,133 @@
+
+import typing
+
+import ptonppl.abstract
+import ptonppl.constants
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "Backend",
+    "registry",
+    "register",
+    "unregister",
+]
+
+
+class Backend:
+    """
+    Description of a backend that `ptonppl.control` can search: which LDAP
+    fields it can search (mapped to the name of the field expected by its
+    `search` function), which fields of `ptonppl.abstract.AbstractPtonPerson`
+    its records provide, and its `cost` (the expected duration of a search,
+    in seconds, until its actual latency has been observed).
+    """
+
+    def __init__(
+            self,
+            name: str,
+            search: typing.Callable[[str, str], typing.Optional[ptonppl.abstract.AbstractPtonPerson]],
+            fields: typing.Dict[str, str],
+            attributes: typing.Iterable[str],
+            cost: float,
+    ):
+        self._name = name
+        self._search = search
+        self._fields = dict(fields)
+        self._attributes = frozenset(attributes)
+        self._cost = cost
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def fields(self) -> typing.Dict[str, str]:
+        return self._fields
+
+    @property
+    def attributes(self) -> typing.FrozenSet[str]:
+        return self._attributes
+
+    @property
+    def cost(self) -> float:
+        return self._cost
+
+    def can_search(self, ldap_field: str) -> bool:
+        return ldap_field in self._fields
+
+    def search(
+            self,
+            ldap_field: str,
+            value: str,
+    ) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+        return self._search(self._fields[ldap_field], value)
+
+    def __repr__(self) -> str:
+        return "Backend({!r})".format(self._name)
+
+
+# The built-in backends (their modules, and dependencies, are only imported
+# when they are first searched)
+
+def _search_ldap(
+        ldap_field: str,
+        value: str,
+) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+    import ptonppl.ldap
+    return ptonppl.ldap.search_one(ldap_field=ldap_field, ldap_value=value)
+
+
+def _search_webdir(
+        field: str,
+        value: str,
+) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+    import ptonppl.webdir
+    return ptonppl.webdir.search_one(field=field, value=value)
+
+
+def _search_ldapcmd(
+        ldap_field: str,
+        value: str,
+) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+    import ptonppl.ldapcmd
+    return ptonppl.ldapcmd.search_one(ldap_field=ldap_field, ldap_value=value)
+
+
+# Backends, by name, in order of preference (for equal costs)
+
+registry: typing.Dict[str, Backend] = dict()
+
+
+def register(backend: Backend):
+    registry[backend.name] = backend
+
+
+def unregister(name: str):
+    registry.pop(name, None)
+
+
+register(Backend(
+    name="ldap",
+    search=_search_ldap,
+    fields={"mail": "mail", "uid": "uid", "universityid": "universityid"},
+    attributes=["puid", "netid", "email", "alias", "type", "name"],
+    cost=ptonppl.constants.BACKEND_DEFAULT_COSTS["ldap"],
+))
+
+register(Backend(
+    name="webdir",
+    search=_search_webdir,
+    fields={"mail": "mail", "uid": "netid"},
+    attributes=["puid", "netid", "email", "alias", "name"],
+    cost=ptonppl.constants.BACKEND_DEFAULT_COSTS["webdir"],
+))
+
+register(Backend(
+    name="ldapcmd",
+    search=_search_ldapcmd,
+    fields={"mail": "mail", "uid": "uid", "universityid": "universityid"},
+    attributes=["puid", "netid", "email", "alias", "type", "name"],
+    cost=ptonppl.constants.BACKEND_DEFAULT_COSTS["ldapcmd"],
+))
@@ -0,0 +1,359 @@
+
+import collections
+import json
+import sqlite3
+import threading
+import time
+import typing
+
+import ptonppl.abstract
+import ptonppl.constants
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "MemoryCache",
+    "RecentSet",
+    "PersistentCache",
+    "memory_cache",
+]
+
+
+# Index of the records stored in a SQLite file (here, and in a local mirror
+# of the directory, see `ptonppl.mirror`), which maps each identifier of a
+# person to the key of their record
+
+_IDENTIFIERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS identifiers (
+    identifier TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS identifiers_key ON identifiers (key);
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    key TEXT PRIMARY KEY,
+    record TEXT NOT NULL,
+    created REAL NOT NULL
+);
+""" + _IDENTIFIERS_SCHEMA
+
+
+def _record_key(
+        obj: ptonppl.abstract.AbstractPtonPerson,
+        identifiers: typing.Set[str],
+) -> str:
+    # the NetID is the most stable identifier, use it as the key if it is
+    # available
+    return ptonppl.abstract.normalize_identifier(
+        obj.netid if obj.netid is not None else sorted(identifiers)[0])
+
+
+def _index_identifiers(
+        db: sqlite3.Connection,
+        key: str,
+        identifiers: typing.Set[str],
+):
+    # (the identifiers the record no longer has are dropped)
+    db.execute("DELETE FROM identifiers WHERE key = ?", (key,))
+
+    # an identifier already indexed for another record is not taken over
+    # (e.g., by an address whose local part is someone else's NetID),
+    # except by the record whose key (NetID) it is, or derives from
+    owned = {key, ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format(key)}
+
+    db.executemany(
+        "INSERT OR IGNORE INTO identifiers (identifier, key) VALUES (?, ?)",
+        [(identifier, key) for identifier in identifiers - owned],
+    )
+    db.executemany(
+        "INSERT OR REPLACE INTO identifiers (identifier, key) VALUES (?, ?)",
+        [(identifier, key) for identifier in identifiers & owned],
+    )
+
+
+def _drop_orphan_identifiers(db: sqlite3.Connection, table: str):
+    db.execute("DELETE FROM identifiers WHERE key NOT IN (SELECT key FROM {})".format(table))
+
+
+class PersistentCache:
+    """
+    Cache of resolved records, stored in a local SQLite file so that it
+    survives from one run to the next.
+
+    Each record is indexed under every one of its identifiers (PUID, NetID,
+    alias and email address), so that it is found whichever one of them is
+    searched; records older than `ttl` seconds are ignored.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            ttl: typing.Optional[float] = None,
+    ):
+        self._path = path
+        self._ttl = ttl if ttl is not None else ptonppl.constants.CACHE_DEFAULT_TTL
+
+        # the connection is shared by all threads, and serialized here
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl
+
+    def get(
+            self,
+            value: str,
+            default: typing.Any = None,
+    ) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+        identifier = ptonppl.abstract.normalize_identifier(value)
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT records.record, records.created FROM identifiers "
+                "JOIN records ON records.key = identifiers.key "
+                "WHERE identifiers.identifier = ?",
+                (identifier,),
+            ).fetchone()
+
+        if row is None:
+            return default
+
+        (record, created) = row
+        if time.time() - created > self._ttl:
+            return default
+
+        return ptonppl.abstract.AbstractPtonPerson.from_dict(json.loads(record))
+
+    def put(self, obj: ptonppl.abstract.AbstractPtonPerson):
+        identifiers = obj.identifiers
+        if len(identifiers) == 0:
+            return
+
+        key = _record_key(obj=obj, identifiers=identifiers)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO records (key, record, created) VALUES (?, ?, ?)",
+                (key, json.dumps(obj.as_dict), time.time()),
+            )
+            _index_identifiers(db=self._db, key=key, identifiers=identifiers)
+            self._db.commit()
+
+    def purge(self) -> int:
+        """
+        Remove the expired records from the cache, and return their number.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM records WHERE created < ?",
+                (time.time() - self._ttl,),
+            )
+            _drop_orphan_identifiers(db=self._db, table="records")
+            self._db.commit()
+
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self) -> 'PersistentCache':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MemoryCache:
+    """
+    Bounded, thread-safe, in-process LRU cache of resolved records.
+
+    Each record is indexed under every one of its identifiers, each of
+    which counts towards `maxsize`; entries expire after `ttl` seconds.
+    Values that could not be resolved can also be remembered, for the
+    shorter `negative_ttl`, so that repeated lookups of a value that does
+    not exist do not go through every backend each time.
+    """
+
+    def __init__(
+            self,
+            maxsize: typing.Optional[int] = None,
+            ttl: typing.Optional[float] = None,
+            negative_ttl: typing.Optional[float] = None,
+    ):
+        self._maxsize = (
+            maxsize if maxsize is not None
+            else ptonppl.constants.MEMORY_CACHE_MAXSIZE)
+        self._ttl = (
+            ttl if ttl is not None
+            else ptonppl.constants.MEMORY_CACHE_TTL)
+        self._negative_ttl = (
+            negative_ttl if negative_ttl is not None
+            else ptonppl.constants.MEMORY_CACHE_NEGATIVE_TTL)
+
+        self._lock = threading.Lock()
+
+        # identifier -> (expiration time, record or None)
+        self._entries: typing.Dict[
+            str, typing.Tuple[float, typing.Optional[ptonppl.abstract.AbstractPtonPerson]]
+        ] = collections.OrderedDict()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "size": len(self._entries),
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+            self,
+            value: str,
+            default: typing.Any = None,
+    ) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+        """
+        Return the record cached for `value`; `None` if `value` is cached
+        as not found, and `default` if it is not cached at all.
+        """
+        identifier = ptonppl.abstract.normalize_identifier(value)
+
+        with self._lock:
+            entry = self._entries.get(identifier)
+
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[identifier]
+                self._expirations += 1
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return default
+
+            self._entries.move_to_end(identifier)
+            self._hits += 1
+
+            return entry[1]
+
+    def _insert(
+            self,
+            identifiers: typing.Iterable[str],
+            ttl: float,
+            obj: typing.Optional[ptonppl.abstract.AbstractPtonPerson],
+    ):
+        if self._maxsize <= 0:
+            return
+
+        expiration = time.monotonic() + ttl
+
+        with self._lock:
+            for identifier in identifiers:
+                self._entries[identifier] = (expiration, obj)
+                self._entries.move_to_end(identifier)
+
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def put(
+            self,
+            obj: ptonppl.abstract.AbstractPtonPerson,
+            value: typing.Optional[str] = None,
+    ):
+        """
+        Cache `obj` under each of its identifiers, as well as under the
+        `value` that was searched to find it, if any.
+        """
+        identifiers = obj.identifiers
+        if value is not None:
+            identifiers.add(ptonppl.abstract.normalize_identifier(value))
+
+        self._insert(identifiers=identifiers, ttl=self._ttl, obj=obj)
+
+    def put_missing(self, value: str):
+        """
+        Remember that `value` could not be resolved.
+        """
+        self._insert(
+            identifiers=[ptonppl.abstract.normalize_identifier(value)],
+            ttl=self._negative_ttl,
+            obj=None,
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RecentSet:
+    """
+    Set of the `maxsize` keys most recently added (or checked), which is
+    used to filter out duplicates from a stream in bounded memory: beyond
+    `maxsize` distinct keys, the oldest are forgotten, so that a duplicate
+    may go unnoticed, but no key is ever wrongly reported as seen.
+    """
+
+    def __init__(self, maxsize: typing.Optional[int] = None):
+        self._maxsize = (
+            maxsize if maxsize is not None
+            else ptonppl.constants.DEDUP_WINDOW)
+
+        self._keys: typing.Dict[typing.Hashable, None] = collections.OrderedDict()
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._keys
+
+    def add(self, key: typing.Hashable) -> bool:
+        """
+        Add `key`, and return whether it was not already in the set.
+        """
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return False
+
+        self._keys[key] = None
+
+        if len(self._keys) > self._maxsize:
+            self._keys.popitem(last=False)
+
+        return True
+
+
+# Cache used by `ptonppl.control.search`: it can be replaced by a differently
+# configured `MemoryCache`, or set to `None` to disable in-memory caching
+
+memory_cache: typing.Optional[MemoryCache] = MemoryCache()
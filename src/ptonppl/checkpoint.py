@@ -0,0 +1,218 @@
+
+import collections
+import json
+import os
+import sqlite3
+import time
+import typing
+
+import ptonppl.abstract
+import ptonppl.constants
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "Checkpoint",
+]
+
+
+LookupResult = typing.Tuple[str, typing.Optional[ptonppl.abstract.AbstractPtonPerson]]
+
+
+# Number of lines of the checkpoint indexed at a time, when it is loaded
+
+_LOAD_BATCH_SIZE = 1000
+
+
+class Checkpoint:
+    """
+    Records each input of a job in the file at `path` as soon as it has
+    completed (whether it was found or not), as one line of JSON, so that
+    a job restarted with the same checkpoint does not repeat the searches
+    of the inputs completed before it was interrupted.
+
+    The file is only ever appended to: if the job was interrupted while an
+    input was being recorded, the incomplete line is discarded. The inputs
+    completed by earlier runs are indexed in a temporary SQLite database,
+    rather than in memory, so that checkpoints may be arbitrarily large.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._loaded = 0
+        self._resumed = 0
+        self._recorded = 0
+        self._failed = 0
+
+        # (an empty path is a temporary database, deleted once closed)
+        self._index = sqlite3.connect("", check_same_thread=False)
+        self._index.execute("CREATE TABLE completed (query TEXT PRIMARY KEY, record TEXT)")
+
+        self._load()
+
+        self._file = open(path, "a", encoding="utf-8")
+        self._time_synced = time.monotonic()
+
+    @property
+    def completed(self) -> int:
+        """
+        Number of inputs recorded in the checkpoint, by this run and the
+        earlier ones.
+        """
+        return self._loaded + self._recorded
+
+    @property
+    def resumed(self) -> int:
+        """
+        Number of inputs answered from the checkpoint, during this run.
+        """
+        return self._resumed
+
+    @property
+    def recorded(self) -> int:
+        """
+        Number of inputs recorded in the checkpoint, during this run.
+        """
+        return self._recorded
+
+    @property
+    def failed(self) -> int:
+        """
+        Number of inputs whose lookup failed during this run, which were
+        not recorded (and will be looked up again by the next run).
+        """
+        return self._failed
+
+    def _load(self):
+        try:
+            f = open(self._path, "r+", encoding="utf-8")
+        except FileNotFoundError:
+            return
+
+        with f:
+            offset = 0
+            rows = []
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                rows.append((entry["query"], json.dumps(entry["record"])))
+                offset += len(line.encode("utf-8"))
+
+                if len(rows) >= _LOAD_BATCH_SIZE:
+                    self._index_rows(rows)
+                    rows = []
+
+            self._index_rows(rows)
+
+            # (drop whatever follows the last complete line, so that the
+            # lines appended from now on are not mangled with it)
+            f.truncate(offset)
+
+        self._index.commit()
+        (self._loaded,) = self._index.execute("SELECT COUNT(*) FROM completed").fetchone()
+
+    def _index_rows(self, rows: typing.List[typing.Tuple[str, str]]):
+        # (the last line recorded for an input is the one that counts)
+        self._index.executemany("INSERT OR REPLACE INTO completed VALUES (?, ?)", rows)
+
+    def _lookup(self, value: str) -> typing.Tuple[bool, typing.Optional[typing.Dict[str, typing.Any]]]:
+        row = self._index.execute("SELECT record FROM completed WHERE query = ?", (value,)).fetchone()
+        if row is None:
+            return False, None
+
+        return True, json.loads(row[0])
+
+    def __contains__(self, value: str) -> bool:
+        return self._lookup(value)[0]
+
+    def get(self, value: str) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+        (_, record) = self._lookup(value)
+        if record is None:
+            return None
+
+        return ptonppl.abstract.AbstractPtonPerson.from_dict(record)
+
+    def record(
+            self,
+            value: str,
+            obj: typing.Optional[ptonppl.abstract.AbstractPtonPerson],
+    ):
+        record = obj.as_dict if obj is not None else None
+
+        # each line is written out immediately, so that it survives the
+        # process being interrupted, but only synced to disk regularly
+        self._file.write(json.dumps({"query": value, "record": record}) + "\n")
+        self._file.flush()
+        self._recorded += 1
+
+        if time.monotonic() - self._time_synced >= ptonppl.constants.CHECKPOINT_SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._time_synced = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+
+        self.sync()
+        self._file.close()
+        self._index.close()
+
+    def resume(
+            self,
+            values: typing.Iterable[str],
+            lookup: typing.Callable[[typing.Iterable[str]], typing.Iterable[LookupResult]],
+            failures: typing.Optional[typing.Set[str]] = None,
+    ) -> typing.Iterator[LookupResult]:
+        """
+        Yields the same results as `lookup(values)`, in the same order (that
+        of `values`, for the lookups of `ptonppl.control`), except that the
+        values completed by earlier runs are answered from the checkpoint,
+        rather than given to `lookup`; the other values are recorded as they
+        complete, except those that `lookup` adds to `failures` (see
+        `ptonppl.control.search`), which are left for the next run.
+        """
+        # (as `lookup` reads ahead of its output, the values answered from the
+        # checkpoint are held back until the results of the values that were
+        # before them have been yielded)
+        queue: typing.Deque[typing.Tuple[bool, LookupResult]] = collections.deque()
+
+        def pending() -> typing.Iterator[str]:
+            for value in values:
+                (hit, record) = self._lookup(value)
+                if hit:
+                    queue.append((True, (
+                        value,
+                        ptonppl.abstract.AbstractPtonPerson.from_dict(record) if record is not None else None,
+                    )))
+                    self._resumed += 1
+                    continue
+                queue.append((False, (value, None)))
+                yield value
+
+        for (value, obj) in lookup(pending()):
+            while queue[0][0]:
+                yield queue.popleft()[1]
+            queue.popleft()
+
+            if failures is not None and value in failures:
+                # (each result is only checked once, so that the set does
+                # not grow with the number of values)
+                failures.discard(value)
+                self._failed += 1
+            else:
+                self.record(value, obj)
+
+            yield (value, obj)
+
+        for (replayed, result) in queue:
+            if replayed:
+                yield result
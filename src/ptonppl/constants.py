@@ -1,11 +1,11 @@
 
 import base64
-import distutils.version
 import enum
+import os
+import sys
+import types
 import typing
 
-import ldap
-
 
 __author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
 
@@ -14,11 +14,42 @@ __all__ = [
     "LDAP_URI",
     "LDAP_24_API",
     "LDAP_BASE_DN",
+    "LDAP_POOL_SIZE",
+    "LDAP_POOL_CHECK_INTERVAL",
+    "LDAP_PAGE_SIZE",
+    "LDAP_BATCH_SIZE",
+    "DEFAULT_WORKERS",
+    "BACKEND_MAX_CONCURRENCY",
+    "BACKEND_DEFAULT_COSTS",
+    "PLANNER_MIN_OBSERVATIONS",
+    "HEDGE_MAX_INFLIGHT",
+    "HEDGE_MAX_WORKERS",
+    "LDAPCMD_RACE",
+    "LDAP_MAX_TRIES",
+    "HEALTH_WINDOW",
+    "HEALTH_MIN_CALLS",
+    "HEALTH_MAX_ERROR_RATE",
+    "HEALTH_MAX_CONSECUTIVE_FAILURES",
+    "HEALTH_COOLDOWN",
 
     "ATTRIBUTES_TOP_LEVEL",
     "ATTRIBUTES_PUBLIC",
     "ATTRIBUTES_FULL",
-    "LDAP_ATTRIBUTE_MAPPING"
+    "LDAP_ATTRIBUTE_MAPPING",
+    "LDAP_FIELD_ATTRIBUTES",
+    "LDAP_REQUIRED_ATTRIBUTES",
+    "LDAP_PROBE_CACHE_PATH",
+    "LDAP_PROBE_CACHE_TTL",
+
+    "LDAP_MIRROR_FILTER",
+    "CACHE_DEFAULT_TTL",
+    "MEMORY_CACHE_MAXSIZE",
+    "MEMORY_CACHE_TTL",
+    "MEMORY_CACHE_NEGATIVE_TTL",
+    "IDENTITY_INDEX_MAXSIZE",
+    "DEDUP_WINDOW",
+    "OUTPUT_FLUSH_INTERVAL",
+    "CHECKPOINT_SYNC_INTERVAL",
 ]
 
 
@@ -31,13 +62,71 @@ LDAP_URI: str = "ldap://{hostname}".format(hostname=LDAP_HOSTNAME)
 # Flag on whether using SSL/TLS
 LDAP_URI_SECURE: bool = "ldaps://" in LDAP_URI
 
-# Determine which version of the LDAP package
-LDAP_24_API: bool = (distutils.version.LooseVersion(ldap.__version__) >=
-                     distutils.version.LooseVersion("2.4"))
+# Determine which version of the LDAP package (`LDAP_24_API: bool`, see
+# `_LazyConstants` below, as this requires importing the package)
 
 # Base domain name for Princeton University
 LDAP_BASE_DN: str = "o=Princeton University,c=US"
 
+# Maximum number of connections to the LDAP server kept by the pool, and
+# idle time (in seconds) after which a connection is checked before reuse
+LDAP_POOL_SIZE: int = 8
+LDAP_POOL_CHECK_INTERVAL: float = 30
+
+# Number of entries per page when enumerating the directory
+LDAP_PAGE_SIZE: int = 500
+
+# Maximum number of values packed into a single OR-filter by batch searches
+LDAP_BATCH_SIZE: int = 50
+
+# Default number of worker threads for concurrent searches
+DEFAULT_WORKERS: int = 8
+
+# Maximum number of concurrent calls to each backend
+BACKEND_MAX_CONCURRENCY: typing.Dict[str, int] = {
+    "ldap": 8,
+    "webdir": 4,
+    "ldapcmd": 4,
+}
+
+# Expected duration (in seconds) of a search on each backend, used to order
+# the plan of a search until the actual latency of enough searches has been
+# observed
+BACKEND_DEFAULT_COSTS: typing.Dict[str, float] = {
+    "ldap": 0.05,
+    "webdir": 0.5,
+    "ldapcmd": 1.0,
+}
+PLANNER_MIN_OBSERVATIONS: int = 5
+
+# Maximum number of attempts of a single hedged search running at once
+HEDGE_MAX_INFLIGHT: int = 3
+
+# Number of threads shared by all hedged searches
+HEDGE_MAX_WORKERS: int = 32
+
+# Whether the `ldapsearch` command and the proxy are queried concurrently,
+# rather than one after the other
+LDAPCMD_RACE: bool = True
+
+# Maximum number of tries of an LDAP search when the server is unreachable
+LDAP_MAX_TRIES: int = 3
+
+# Number of most recent calls to each backend over which its error rate and
+# latency are computed, and minimum number of them before the error rate is
+# taken into account
+HEALTH_WINDOW: int = 20
+HEALTH_MIN_CALLS: int = 10
+
+# The circuit of a backend opens (so that it is no longer called) when its
+# error rate, or its number of consecutive failures, reaches these limits
+HEALTH_MAX_ERROR_RATE: float = 0.5
+HEALTH_MAX_CONSECUTIVE_FAILURES: int = 3
+
+# Time (in seconds) after which a single call is let through an open circuit,
+# to probe whether the backend has recovered
+HEALTH_COOLDOWN: float = 30
+
 
 # Cached sets of attributes
 
@@ -82,6 +171,12 @@ ATTRIBUTES_FULL: typing.Set[str] = {
     "universityidref",
 }
 
+# Location and lifetime (in seconds) of the cached result of probing which
+# attributes the LDAP server makes available
+LDAP_PROBE_CACHE_PATH: str = os.path.join(
+    os.path.expanduser("~"), ".cache", "ptonppl", "ldap-probe.json")
+LDAP_PROBE_CACHE_TTL: int = 24 * 60 * 60
+
 # Mappings with Princeton terminology
 
 LDAP_ATTRIBUTE_MAPPING = {
@@ -92,6 +187,27 @@ LDAP_ATTRIBUTE_MAPPING = {
     "name": "cn",
 }
 
+# Attributes needed to build a record from an LDAP entry, by output field
+# (the email address falls back to the principal name)
+
+LDAP_FIELD_ATTRIBUTES: typing.Dict[str, typing.List[str]] = {
+    "puid": ["universityid"],
+    "netid": ["uid"],
+    "email": ["mail", "eduPersonPrincipalName"],
+    "alias": ["mail"],
+    "type": ["pustatus"],
+    "name": ["cn"],
+}
+
+# Attributes that are always needed, because they determine whether a
+# record is complete (see `AbstractPtonPerson.complete`)
+
+LDAP_REQUIRED_ATTRIBUTES: typing.Set[str] = {
+    attribute
+    for field in ["puid", "netid", "email"]
+    for attribute in LDAP_FIELD_ATTRIBUTES[field]
+}
+
 
 # Web filter operations
 
@@ -147,10 +263,9 @@ ID_AUTHORIZED_CHARS = "abcdefghijklmnopqrstuvwxyz.0123456789_"
 
 LDAP_IGNORE_FIELDS = ["search", "result"]
 
-LDAP_CMD_PATTERN = "{{cmd}} -x -h {host} -u -b {base_dn} \"{{query}}\"".format(
-    host=LDAP_HOSTNAME,
-    base_dn=LDAP_BASE_DN,
-)
+# Arguments of the `ldapsearch` command, which is run without a shell (the
+# filter is appended as the last argument)
+LDAP_CMD_ARGS = ["-x", "-h", LDAP_HOSTNAME, "-u", "-b", LDAP_BASE_DN]
 
 LDAP_DEFAULT_CMD = "ldapsearch"
 
@@ -167,5 +282,52 @@ LDAP_DEFAULT_PROXY_URL = base64.b64decode(
 PARSED_LDAP_KEY = "uid"
 
 
+# Default filter of the entries copied to a local mirror of the directory
+LDAP_MIRROR_FILTER: str = "(uid=*)"
+
+# Default lifetime of entries of the persistent cache (in seconds)
+CACHE_DEFAULT_TTL: int = 7 * 24 * 60 * 60
+
+# Default size (in identifiers) and lifetimes (in seconds) of entries of
+# the in-memory cache, both for found and for not found values
+MEMORY_CACHE_MAXSIZE: int = 10000
+MEMORY_CACHE_TTL: float = 15 * 60
+MEMORY_CACHE_NEGATIVE_TTL: float = 60
+
+# Size (in identifiers) of the in-memory cache of a run of the command-line
+# tool, which indexes each person resolved under all of their identifiers,
+# for the duration of the run
+IDENTITY_INDEX_MAXSIZE: int = 500000
+
+
 # Output formats
 OUTPUT_CSV_HEADER = ["puid", "netid", "email", "alias", "type", "name"]
+
+# Number of the most recent NetIDs output that are remembered to filter out
+# duplicate records (so that memory does not grow with the size of the input)
+DEDUP_WINDOW: int = 100000
+
+# Maximum time (in seconds) records are held in the output buffer
+OUTPUT_FLUSH_INTERVAL: float = 1.0
+
+# Maximum time (in seconds) the inputs recorded in a checkpoint may remain
+# unsynced to disk (they are written as soon as they complete, so they only
+# risk being lost if the system, rather than the process, stops)
+CHECKPOINT_SYNC_INTERVAL: float = 1.0
+
+
+class _LazyConstants(types.ModuleType):
+    # `ldap` is only imported when a constant that depends on it is needed,
+    # so that importing `ptonppl` remains fast (the class of the module is
+    # replaced, rather than defining a module-level `__getattr__`, which is
+    # not supported before Python 3.7)
+
+    @property
+    def LDAP_24_API(self) -> bool:
+        import distutils.version
+        import ldap
+        return (distutils.version.LooseVersion(ldap.__version__) >=
+                distutils.version.LooseVersion("2.4"))
+
+
+sys.modules[__name__].__class__ = _LazyConstants
@@ -1,71 +1,460 @@
 
+import collections
+import concurrent.futures
+import threading
+import time
 import typing
 
 import ptonppl.abstract
+import ptonppl.cache
 import ptonppl.constants
-import ptonppl.ldap
-import ptonppl.ldapcmd
-import ptonppl.webdir
+import ptonppl.executors
+import ptonppl.health
+import ptonppl.metrics
+import ptonppl.mirror
+import ptonppl.planner
+import ptonppl.trace
+
+# NOTE: the backends (`ptonppl.ldap`, `ptonppl.webdir`, `ptonppl.ldapcmd`)
+# and their dependencies are only imported when a search is first made,
+# so that importing `ptonppl` remains fast
 
 
 __author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
 
 __all__ = [
     "search",
+    "search_batch",
+    "search_many",
 ]
 
 
-def search(
+# Bound the number of concurrent calls to each backend, so that resolving
+# many values in parallel does not hammer any one of them
+
+_backend_semaphores: typing.Dict[str, threading.BoundedSemaphore] = {
+    backend: threading.BoundedSemaphore(limit)
+    for (backend, limit) in ptonppl.constants.BACKEND_MAX_CONCURRENCY.items()
+}
+_backend_semaphores_lock = threading.Lock()
+
+
+def _get_limit(backend: str) -> int:
+    return ptonppl.constants.BACKEND_MAX_CONCURRENCY.get(backend, ptonppl.constants.DEFAULT_WORKERS)
+
+
+def _get_semaphore(backend: str) -> threading.BoundedSemaphore:
+    with _backend_semaphores_lock:
+        semaphore = _backend_semaphores.get(backend)
+        if semaphore is None:
+            # backends registered later are bounded by the number of workers
+            semaphore = threading.BoundedSemaphore(_get_limit(backend))
+            _backend_semaphores[backend] = semaphore
+        return semaphore
+
+
+# noinspection PyBroadException
+def _run_attempt(
+        backend: str,
+        f: typing.Callable[[str], typing.Optional[ptonppl.abstract.AbstractPtonPerson]],
         value: str,
+        report: typing.Optional[typing.Dict[str, typing.Any]] = None,
 ) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
 
+    # (the outcome of the attempt, and its duration, are recorded in `report`)
+    report = report if report is not None else dict()
+
+    # backends whose circuit is open are skipped entirely
+    health = ptonppl.health.registry.get(backend)
+    if not health.allow():
+        report["outcome"] = "circuit open"
+        return None
+
+    time_start = time.monotonic()
+
+    # (operations retried by the backend, within this attempt, are counted)
+    counts: typing.Dict[typing.Tuple[str, str], int] = dict()
+
+    try:
+        with _get_semaphore(backend), ptonppl.metrics.collect() as counts:
+            obj = f(value)
+
+    except ValueError:
+        # the backend cannot search this kind of value
+        health.release()
+        report["outcome"] = "unsupported"
+        return None
+
+    except Exception:
+        # the backend is unreachable, timed out, or otherwise failed: this
+        # attempt is skipped, and counted against the backend's health
+        report["elapsed"] = time.monotonic() - time_start
+        report["retries"] = _count_retries(counts)
+        report["outcome"] = "error"
+        health.failure(latency=report["elapsed"])
+        return None
+
+    report["elapsed"] = time.monotonic() - time_start
+    report["retries"] = _count_retries(counts)
+    report["outcome"] = "found" if obj is not None else "not found"
+    health.success(latency=report["elapsed"])
+
+    return obj
+
+
+# Outcomes of the attempts that did not answer, so that the record may
+# exist although it was not found
+
+_FAILED_OUTCOMES = ["error", "circuit open", "busy"]
+
+
+def _count_retries(counts: typing.Dict[typing.Tuple[str, str], int]) -> int:
+    return sum(
+        count
+        for ((_, outcome), count) in counts.items()
+        if outcome == ptonppl.metrics.RETRY
+    )
+
+
+# noinspection PyBroadException
+def _run_batch(
+        backend: str,
+        f: typing.Callable[[], typing.Dict[str, ptonppl.abstract.AbstractPtonPerson]],
+) -> typing.Optional[typing.Dict[str, ptonppl.abstract.AbstractPtonPerson]]:
+
+    # (as `_run_attempt`, for batched searches; `None` when it failed)
+    health = ptonppl.health.registry.get(backend)
+    if not health.allow():
+        return None
+
+    time_start = time.monotonic()
+
+    try:
+        found = f()
+    except Exception:
+        health.failure(latency=time.monotonic() - time_start)
+        return None
+
+    health.success(latency=time.monotonic() - time_start)
+
+    return found
+
+
+# Hedged attempts that were still running when their search returned (and
+# which cannot be interrupted), by backend: once they hold every one of the
+# backend's slots, e.g., because it hangs, further hedged attempts on it are
+# skipped, rather than piling up on the shared threads waiting for a slot
+
+_abandoned: typing.Dict[str, int] = collections.Counter()
+_abandoned_lock = threading.Lock()
+
+
+def _abandon(backend: str, future: concurrent.futures.Future):
+    with _abandoned_lock:
+        _abandoned[backend] += 1
+
+    def done(_):
+        with _abandoned_lock:
+            _abandoned[backend] -= 1
+
+    # (called at once if the attempt has completed in the meantime)
+    future.add_done_callback(done)
+
+
+def _saturated(backend: str) -> bool:
+    with _abandoned_lock:
+        return _abandoned[backend] >= _get_limit(backend)
+
+
+def _run_hedged(
+        value: str,
+        attempts: typing.List[typing.Tuple[str, typing.Callable]],
+        hedge: float,
+        reports: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None,
+) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+
+    executor = ptonppl.executors.get_executor("hedge")
+
     obj: typing.Optional[ptonppl.abstract.AbstractPtonPerson] = None
 
-    attempts = []
+    if reports is None:
+        reports = [None for _ in attempts]
 
-    if "@" in value:
+    remaining = collections.deque(zip(attempts, reports))
+    pending: typing.Dict[
+        concurrent.futures.Future,
+        typing.Tuple[str, typing.Optional[typing.Dict[str, typing.Any]]]] = dict()
 
-        # using `old_value` instead of `val` is intentional here
-        old_value = value
-        attempts += [lambda _: ptonppl.ldap.search_one(ldap_field="mail", ldap_value=old_value)]
-        attempts += [lambda _: ptonppl.webdir.search_one(field="mail", value=old_value)]
-        attempts += [lambda _: ptonppl.ldapcmd.search_one(ldap_field="mail", ldap_value=old_value)]
+    def launch_next():
+        while len(remaining) > 0 and len(pending) < ptonppl.constants.HEDGE_MAX_INFLIGHT:
+            ((backend, f), report) = remaining.popleft()
 
-        # remove suffix of email, as it might match an alias or a NetID search
-        value = value.split("@")[0]
+            if _saturated(backend):
+                if report is not None:
+                    report["outcome"] = "busy"
+                continue
 
-    else:
-        possible_email = ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format(value)
+            if report is not None:
+                # (until the attempt returns, or is cancelled)
+                report["outcome"] = "pending"
+            future = executor.submit(_run_attempt, backend=backend, f=f, value=value, report=report)
+            pending[future] = (backend, report)
+            return
 
-        attempts += [lambda _: ptonppl.ldap.search_one(ldap_field="mail", ldap_value=possible_email)]
-        attempts += [lambda _: ptonppl.webdir.search_one(field="mail", value=possible_email)]
-        attempts += [lambda _: ptonppl.ldapcmd.search_one(ldap_field="mail", ldap_value=possible_email)]
+    launch_next()
 
-    # operations for NetID and alias
+    try:
+        while len(pending) > 0:
+            (done, _) = concurrent.futures.wait(
+                pending,
+                timeout=hedge,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
 
-    attempts += [lambda val: ptonppl.ldap.search_one(ldap_field="uid", ldap_value=val)]
-    attempts += [lambda val: ptonppl.ldap.search_one(
-        ldap_field="mail", ldap_value=ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format(val))]
-    attempts += [lambda val: ptonppl.webdir.search_one(field="uid", value=val)]
-    attempts += [lambda val: ptonppl.webdir.search_one(field="alias", value=val)]
-    attempts += [lambda val: ptonppl.ldapcmd.search_one(ldap_field="uid", ldap_value=val)]
-    attempts += [lambda val: ptonppl.ldapcmd.search_one(
-        ldap_field="mail", ldap_value=ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format(val))]
+            for future in done:
+                (_, report) = pending.pop(future)
+                new_obj = future.result()
 
-    # heuristic for PUIDs
-    if value.isdigit() and len(value) > 6:
-        attempts += [lambda val: ptonppl.ldap.search_one(ldap_field="universityid", ldap_value=val)]
-        attempts += [lambda val: ptonppl.ldapcmd.search_one(ldap_field="universityid", ldap_value=val)]
+                if new_obj is None:
+                    continue
 
-    # reestablish connection
-    ptonppl.ldap.connect(reconnect=True)
+                elif obj is None:
+                    obj = new_obj
 
-    for f in attempts:
-        try:
-            new_obj = f(value)
-        except ValueError:
+                else:
+                    obj = obj.merge(obj=new_obj)
+
+                if obj.complete and report is not None:
+                    report["complete"] = True
+                    break
+
+            if obj is not None and obj.complete:
+                break
+
+            # either an attempt came back without completing the record, or
+            # the slowest one is past the threshold: launch the next one
+            launch_next()
+
+    finally:
+        # the answers of attempts still in flight are ignored (those that
+        # have started cannot be cancelled, and are left to complete)
+        for (future, (backend, report)) in pending.items():
+            if future.cancel():
+                if report is not None:
+                    del report["outcome"]
+            else:
+                _abandon(backend=backend, future=future)
+
+    return obj
+
+
+_MISSING = object()
+
+
+def _lookup_caches(
+        value: str,
+        cache: typing.Optional[ptonppl.cache.PersistentCache] = None,
+        mirror: typing.Optional[ptonppl.mirror.Mirror] = None,
+) -> typing.Tuple[bool, typing.Optional[ptonppl.abstract.AbstractPtonPerson]]:
+
+    memory_cache = ptonppl.cache.memory_cache
+
+    if memory_cache is not None:
+        obj = memory_cache.get(value, default=_MISSING)
+        if obj is not _MISSING:
+            return True, obj
+
+    # (a value missing from the mirror may still be found by the backends)
+    for source in [cache, mirror]:
+        if source is not None:
+            obj = source.get(value)
+            if obj is not None:
+                if memory_cache is not None:
+                    memory_cache.put(obj, value=value)
+                return True, obj
+
+    return False, None
+
+
+def _store_caches(
+        value: str,
+        obj: typing.Optional[ptonppl.abstract.AbstractPtonPerson],
+        cache: typing.Optional[ptonppl.cache.PersistentCache] = None,
+):
+    memory_cache = ptonppl.cache.memory_cache
+
+    if obj is None:
+        if memory_cache is not None:
+            memory_cache.put_missing(value)
+        return
+
+    if memory_cache is not None:
+        memory_cache.put(obj, value=value)
+
+    if cache is not None:
+        cache.put(obj)
+
+
+def search(
+        value: str,
+        reconnect: typing.Optional[bool] = None,
+        hedge: typing.Optional[float] = None,
+        cache: typing.Optional[ptonppl.cache.PersistentCache] = None,
+        mirror: typing.Optional[ptonppl.mirror.Mirror] = None,
+        explain: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None,
+        tracer: typing.Optional[ptonppl.trace.Tracer] = None,
+        failures: typing.Optional[typing.Set[str]] = None,
+) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+    """
+    Lookup a PUID, NetID, alias or email address, following the plan of
+    `ptonppl.planner.plan` (the searches that may find it, on each backend
+    that supports them, cheapest first) until the record is complete.
+    Connections to LDAP are drawn from `ptonppl.ldap.pool` and kept alive
+    between searches; with `reconnect`, idle connections are closed first.
+
+    When `hedge` is a number of seconds, an attempt that has not returned
+    after that long no longer holds up the cascade: the next attempt is
+    launched alongside it, and whichever answers complete the record first
+    win, while the slower ones are ignored (they cannot be interrupted, but
+    once they hold all the slots of their backend, it is skipped by hedged
+    searches until they complete).
+
+    The in-memory `ptonppl.cache.memory_cache` and, when one is provided,
+    the persistent `cache` are checked before any backend, and updated
+    with the record that is found (or, in memory only, with the fact that
+    none was). So is a local `mirror` of the directory, if provided.
+
+    When `explain` is a list, a report of each step of the plan (with its
+    outcome and duration) is appended to it. When a `tracer` is provided,
+    the same reports are written to it, as one line of JSON per search.
+
+    When `failures` is a set, `value` is added to it if the record was not
+    found (or not completely) while some backend failed or was skipped: the
+    value may then exist, and be found by searching again later.
+    """
+
+    def run(reports):
+        (hit, obj) = _lookup_caches(value=value, cache=cache, mirror=mirror)
+        if hit:
+            if reports is not None:
+                reports.append({"step": "cache", "outcome": "found" if obj is not None else "not found"})
+            return obj
+
+        (obj, failed) = _search_backends(value=value, reconnect=reconnect, hedge=hedge, explain=reports)
+
+        # (a value is only known not to exist, and an incomplete record to
+        # be as complete as it gets, if every backend answered)
+        if not failed:
+            _store_caches(value=value, obj=obj, cache=cache)
+
+        if failed and failures is not None:
+            failures.add(value)
+
+        return obj
+
+    return _traced(value=value, f=run, explain=explain, tracer=tracer)
+
+
+# Keys of the reports that are written to the trace
+
+_TRACE_KEYS = ["step", "backend", "field", "value", "elapsed", "retries", "outcome", "complete"]
+
+
+def _traced(
+        value: str,
+        f: typing.Callable[
+            [typing.Optional[typing.List[typing.Dict[str, typing.Any]]]],
+            typing.Optional[ptonppl.abstract.AbstractPtonPerson]],
+        explain: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None,
+        tracer: typing.Optional[ptonppl.trace.Tracer] = None,
+) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+
+    # without a tracer, no report is even built unless it is asked for
+    if tracer is None:
+        return f(explain)
+
+    reports = explain if explain is not None else list()
+
+    start = time.time()
+    time_start = time.monotonic()
+
+    obj = f(reports)
+
+    elapsed = time.monotonic() - time_start
+
+    tracer.emit({
+        "query": value,
+        "kind": ptonppl.planner.classify(value),
+        "start": start,
+        "elapsed": elapsed,
+        "outcome": "found" if obj is not None else "not found",
+        "complete": obj is not None and obj.complete,
+
+        # the steps that were not needed, or not launched, are left out
+        # (and the reports of hedged attempts still in flight are copied
+        # key by key, as they may still be updated)
+        "attempts": [
+            {key: report[key] for key in _TRACE_KEYS if key in report}
+            for report in list(reports)
+            if report.get("outcome") not in [None, "not useful"]
+        ],
+    })
+
+    return obj
+
+
+def _search_backends(
+        value: str,
+        reconnect: typing.Optional[bool] = None,
+        hedge: typing.Optional[float] = None,
+        explain: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None,
+) -> typing.Tuple[typing.Optional[ptonppl.abstract.AbstractPtonPerson], bool]:
+
+    # returns the record found, and whether it may be missing (or incomplete)
+    # because some attempt failed or was skipped
+
+    import ptonppl.ldap
+
+    obj: typing.Optional[ptonppl.abstract.AbstractPtonPerson] = None
+
+    steps = ptonppl.planner.plan(value)
+
+    # (the outcome of each attempt is always reported, but the steps are
+    # only described when they are explained)
+    reports: typing.List[typing.Dict[str, typing.Any]] = [dict() for _ in steps]
+    if explain is not None:
+        for (step, report) in zip(steps, reports):
+            report.update({
+                "step": str(step),
+                "backend": step.backend.name,
+                "field": step.ldap_field,
+                "value": step.value,
+                "cost": step.cost,
+            })
+        explain.extend(reports)
+
+    # connections to LDAP are pooled and kept alive, unless asked otherwise
+    if reconnect is not None and reconnect:
+        ptonppl.ldap.pool.reset()
+
+    attempts = [
+        (step.backend.name, lambda _, step=step: step.run())
+        for step in steps
+    ]
+
+    if hedge is not None:
+        obj = _run_hedged(value=value, attempts=attempts, hedge=hedge, reports=reports)
+        return obj, _failed(obj=obj, reports=reports)
+
+    for (step, (backend, f), report) in zip(steps, attempts, reports):
+
+        # skip the backends that cannot provide any of the missing fields
+        if not step.useful(obj):
+            report["outcome"] = "not useful"
             continue
 
+        new_obj = _run_attempt(backend=backend, f=f, value=value, report=report)
+
         if new_obj is None:
             continue
 
@@ -76,6 +465,304 @@ def search(
             obj = obj.merge(obj=new_obj)
 
         if obj.complete:
+            report["complete"] = True
             break
 
-    return obj
+    return obj, _failed(obj=obj, reports=reports)
+
+
+def _failed(
+        obj: typing.Optional[ptonppl.abstract.AbstractPtonPerson],
+        reports: typing.List[typing.Dict[str, typing.Any]],
+) -> bool:
+    if obj is not None and obj.complete:
+        return False
+
+    return any(report.get("outcome") in _FAILED_OUTCOMES for report in reports)
+
+
+def _batch_lookup(
+        search_batch: typing.Callable[..., typing.Dict[str, ptonppl.abstract.AbstractPtonPerson]],
+        emails: typing.List[str],
+        puids: typing.List[str],
+        netids: typing.List[str],
+        chunk_size: typing.Optional[int] = None,
+) -> typing.Dict[str, ptonppl.abstract.AbstractPtonPerson]:
+
+    found: typing.Dict[str, ptonppl.abstract.AbstractPtonPerson] = dict()
+
+    found.update(search_batch(
+        ldap_field="mail", ldap_values=emails, chunk_size=chunk_size))
+    found.update(search_batch(
+        ldap_field="universityid", ldap_values=puids, chunk_size=chunk_size))
+    found.update(search_batch(
+        ldap_field="uid", ldap_values=netids, chunk_size=chunk_size))
+
+    # what is not a NetID may be an alias
+    aliases = {
+        ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format(value): value
+        for value in netids
+        if value not in found
+    }
+    for (email, obj) in search_batch(
+            ldap_field="mail", ldap_values=aliases.keys(), chunk_size=chunk_size).items():
+        found[aliases[email]] = obj
+
+    return found
+
+
+def _prefetch(
+        values: typing.List[str],
+        chunk_size: typing.Optional[int] = None,
+        cache: typing.Optional[ptonppl.cache.PersistentCache] = None,
+        mirror: typing.Optional[ptonppl.mirror.Mirror] = None,
+) -> typing.Dict[str, typing.Optional[ptonppl.abstract.AbstractPtonPerson]]:
+
+    import ptonppl.ldap
+    import ptonppl.ldapcmd
+
+    # values that are the same once normalized (e.g., differing only in
+    # case) are only looked up once, and share the same result
+    unique: typing.Dict[str, str] = dict()
+    for value in values:
+        unique.setdefault(ptonppl.abstract.normalize_identifier(value), value)
+
+    # values that are cached (even as not found) are not searched again
+    found: typing.Dict[str, typing.Optional[ptonppl.abstract.AbstractPtonPerson]] = dict()
+
+    remaining: typing.List[str] = list()
+    for value in unique.values():
+        (hit, obj) = _lookup_caches(value=value, cache=cache, mirror=mirror)
+        if hit:
+            found[value] = obj
+        else:
+            remaining.append(value)
+
+    cached = set(found.keys())
+
+    kinds = {value: ptonppl.planner.classify(value) for value in remaining}
+
+    emails = [value for value in remaining if kinds[value] == ptonppl.planner.KIND_EMAIL]
+    puids = [value for value in remaining if kinds[value] == ptonppl.planner.KIND_PUID]
+    netids = [value for value in remaining if kinds[value] == ptonppl.planner.KIND_NETID]
+
+    batch_found = _run_batch(backend="ldap", f=lambda: _batch_lookup(
+        search_batch=ptonppl.ldap.search_batch,
+        emails=emails, puids=puids, netids=netids, chunk_size=chunk_size))
+
+    if batch_found is None:
+        # the server cannot be reached directly, which is when the local
+        # `ldapsearch` command is used: run it once per chunk rather than
+        # once per value (batching is only an optimization, `search` will
+        # still be tried for whatever is not found)
+        batch_found = _run_batch(backend="ldapcmd", f=lambda: _batch_lookup(
+            search_batch=ptonppl.ldapcmd.search_batch,
+            emails=emails, puids=puids, netids=netids, chunk_size=chunk_size))
+
+    found.update(batch_found or dict())
+
+    # incomplete records will be completed (and cached) by `search`
+    for (value, obj) in found.items():
+        if value not in cached and obj.complete:
+            _store_caches(value=value, obj=obj, cache=cache)
+
+    # (the duplicates of a value, including those of cached values, share
+    # its result)
+    for value in values:
+        first_value = unique[ptonppl.abstract.normalize_identifier(value)]
+        if first_value in found:
+            found[value] = found[first_value]
+
+    return found
+
+
+def search_batch(
+        values: typing.Iterable[str],
+        chunk_size: typing.Optional[int] = None,
+        hedge: typing.Optional[float] = None,
+        cache: typing.Optional[ptonppl.cache.PersistentCache] = None,
+        mirror: typing.Optional[ptonppl.mirror.Mirror] = None,
+        tracer: typing.Optional[ptonppl.trace.Tracer] = None,
+        failures: typing.Optional[typing.Set[str]] = None,
+) -> typing.Iterator[typing.Tuple[str, typing.Optional[ptonppl.abstract.AbstractPtonPerson]]]:
+    """
+    Lookup many values, yielding `(value, record)` pairs in input order.
+
+    Values are first resolved in chunks with batched LDAP searches, so that
+    a large roster only costs a handful of round trips; any value that is
+    not found, or not found completely, this way then goes through the full
+    `search` cascade. Values found in the caches (or in the `mirror`) are
+    not searched, and neither are duplicates (once normalized) or other
+    identifiers of a person already found, which `memory_cache` indexes.
+    Each lookup is written to the `tracer`, if provided, and each value
+    whose lookup failed is added to `failures` (see `search`) before it is
+    yielded.
+    """
+
+    import ptonppl.ldap
+
+    if chunk_size is None:
+        chunk_size = ptonppl.constants.LDAP_BATCH_SIZE
+
+    for chunk in ptonppl.ldap._chunks(values, chunk_size):
+        found = _prefetch(values=chunk, chunk_size=chunk_size, cache=cache, mirror=mirror)
+
+        # (the duplicates of a value in the chunk share its lookup)
+        results: typing.Dict[str, typing.Tuple[typing.Optional[ptonppl.abstract.AbstractPtonPerson], bool]] = dict()
+
+        for value in chunk:
+            key = ptonppl.abstract.normalize_identifier(value)
+            if key not in results:
+                results[key] = _complete_once(value=value, found=found, hedge=hedge, cache=cache, tracer=tracer)
+
+            (obj, failed) = results[key]
+            if failed and failures is not None:
+                failures.add(value)
+
+            yield value, obj
+
+
+def _complete_once(
+        value: str,
+        found: typing.Dict[str, typing.Optional[ptonppl.abstract.AbstractPtonPerson]],
+        hedge: typing.Optional[float] = None,
+        cache: typing.Optional[ptonppl.cache.PersistentCache] = None,
+        tracer: typing.Optional[ptonppl.trace.Tracer] = None,
+) -> typing.Tuple[typing.Optional[ptonppl.abstract.AbstractPtonPerson], bool]:
+
+    # (whether the lookup failed is returned along with the record, as it
+    # is shared by the duplicates of the value)
+    failed: typing.Set[str] = set()
+    obj = _complete(value=value, found=found, hedge=hedge, cache=cache, tracer=tracer, failures=failed)
+    return obj, len(failed) > 0
+
+
+def _complete(
+        value: str,
+        found: typing.Dict[str, typing.Optional[ptonppl.abstract.AbstractPtonPerson]],
+        hedge: typing.Optional[float] = None,
+        cache: typing.Optional[ptonppl.cache.PersistentCache] = None,
+        tracer: typing.Optional[ptonppl.trace.Tracer] = None,
+        failures: typing.Optional[typing.Set[str]] = None,
+) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+
+    # caches have already been checked by `_prefetch`, and values that are
+    # known not to exist are not searched again
+
+    def run(reports):
+        obj = found.get(value)
+
+        if reports is not None and value in found:
+            reports.append({"step": "batch", "outcome": "found" if obj is not None else "not found"})
+
+        if value in found and obj is None:
+            return None
+
+        if obj is None or not obj.complete:
+            # since the chunk was prefetched, the person may have been
+            # found through another of their identifiers (which indexes
+            # all of them in memory)
+            (hit, cached_obj) = _lookup_caches(value=value)
+            if hit:
+                if reports is not None:
+                    reports.append({"step": "cache", "outcome": "found" if cached_obj is not None else "not found"})
+                return cached_obj
+
+            (new_obj, failed) = _search_backends(value=value, hedge=hedge, explain=reports)
+
+            # (the record of the batch may hold attributes the backends did
+            # not return)
+            if obj is not None and new_obj is not None:
+                obj = obj.merge(new_obj)
+            else:
+                obj = new_obj or obj
+
+            failed = failed and (obj is None or not obj.complete)
+
+            # (as in `search`, only what is known for sure is cached)
+            if not failed:
+                _store_caches(value=value, obj=obj, cache=cache)
+            elif failures is not None:
+                failures.add(value)
+
+        return obj
+
+    return _traced(value=value, f=run, tracer=tracer)
+
+
+def search_many(
+        values: typing.Iterable[str],
+        workers: typing.Optional[int] = None,
+        chunk_size: typing.Optional[int] = None,
+        hedge: typing.Optional[float] = None,
+        cache: typing.Optional[ptonppl.cache.PersistentCache] = None,
+        mirror: typing.Optional[ptonppl.mirror.Mirror] = None,
+        tracer: typing.Optional[ptonppl.trace.Tracer] = None,
+        failures: typing.Optional[typing.Set[str]] = None,
+) -> typing.Iterator[typing.Tuple[str, typing.Optional[ptonppl.abstract.AbstractPtonPerson]]]:
+    """
+    Lookup many values concurrently, on a pool of `workers` threads,
+    yielding `(value, record)` pairs in input order.
+
+    As with `search_batch`, values are first resolved in chunks with
+    batched LDAP searches; the remaining values are then looked up in
+    parallel, while the number of concurrent calls to any single backend
+    remains capped by `BACKEND_MAX_CONCURRENCY`. At most about two chunks
+    are in flight at any time, so that `values` may be a long stream.
+    Duplicate values share the same lookup (and, if it failed, are each
+    added to `failures` before they are yielded).
+    """
+
+    import ptonppl.ldap
+
+    if workers is None:
+        workers = ptonppl.constants.DEFAULT_WORKERS
+
+    if chunk_size is None:
+        chunk_size = ptonppl.constants.LDAP_BATCH_SIZE
+
+    pending: typing.Deque[typing.Tuple[str, concurrent.futures.Future]] = collections.deque()
+
+    # lookups in flight, by normalized value: the duplicates of a value that
+    # is still being looked up wait for the same lookup
+    in_flight: typing.Dict[str, concurrent.futures.Future] = dict()
+
+    def next_result() -> typing.Tuple[str, typing.Optional[ptonppl.abstract.AbstractPtonPerson]]:
+        (value, future) = pending.popleft()
+        (obj, failed) = future.result()
+
+        key = ptonppl.abstract.normalize_identifier(value)
+        if in_flight.get(key) is future:
+            del in_flight[key]
+
+        if failed and failures is not None:
+            failures.add(value)
+
+        return value, obj
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for chunk in ptonppl.ldap._chunks(values, chunk_size):
+                found = _prefetch(values=chunk, chunk_size=chunk_size, cache=cache, mirror=mirror)
+
+                for value in chunk:
+                    key = ptonppl.abstract.normalize_identifier(value)
+                    future = in_flight.get(key)
+                    if future is None:
+                        future = executor.submit(
+                            _complete_once, value=value, found=found,
+                            hedge=hedge, cache=cache, tracer=tracer)
+                        in_flight[key] = future
+                    pending.append((value, future))
+
+                # keep the next chunk busy while the previous one is consumed
+                while len(pending) > chunk_size:
+                    yield next_result()
+
+            while len(pending) > 0:
+                yield next_result()
+
+        finally:
+            # if the consumer stopped early, do not start any more lookups
+            for (_, future) in pending:
+                future.cancel()
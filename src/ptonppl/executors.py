@@ -0,0 +1,39 @@
+
+import concurrent.futures
+import threading
+import typing
+
+import ptonppl.constants
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "get_executor",
+]
+
+
+# Threads on which concurrent attempts run (created on first use), by name:
+# hedged attempts of `ptonppl.control`, and the sources raced by
+# `ptonppl.ldapcmd`, have threads of their own, as attempts of the former
+# may wait for the latter
+
+_executors: typing.Dict[str, concurrent.futures.ThreadPoolExecutor] = dict()
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Return the pool of threads called `name`, which is created on first use
+    and shared by every caller from then on.
+    """
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=ptonppl.constants.HEDGE_MAX_WORKERS,
+                thread_name_prefix="ptonppl-{}".format(name),
+            )
+            _executors[name] = executor
+
+    return executor
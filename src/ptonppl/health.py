@@ -0,0 +1,209 @@
+
+import collections
+import threading
+import time
+import typing
+
+import ptonppl.constants
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "CLOSED",
+    "OPEN",
+    "HALF_OPEN",
+    "BackendHealth",
+    "HealthRegistry",
+    "registry",
+]
+
+
+# States of the circuit breaker of a backend
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class BackendHealth:
+    """
+    Health of a backend, tracked from the outcome and latency of its most
+    recent calls, with a circuit breaker.
+
+    The circuit opens after too many failures (consecutive ones, or over the
+    rolling window), and then no call is let through until `cooldown` has
+    elapsed; a single call is then allowed, as a probe (the circuit is
+    half-open): if it succeeds, the circuit closes again, otherwise it
+    reopens for another `cooldown`.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            window: typing.Optional[int] = None,
+            min_calls: typing.Optional[int] = None,
+            max_error_rate: typing.Optional[float] = None,
+            max_consecutive_failures: typing.Optional[int] = None,
+            cooldown: typing.Optional[float] = None,
+    ):
+        self._name = name
+
+        self._min_calls = (
+            min_calls if min_calls is not None
+            else ptonppl.constants.HEALTH_MIN_CALLS)
+        self._max_error_rate = (
+            max_error_rate if max_error_rate is not None
+            else ptonppl.constants.HEALTH_MAX_ERROR_RATE)
+        self._max_consecutive_failures = (
+            max_consecutive_failures if max_consecutive_failures is not None
+            else ptonppl.constants.HEALTH_MAX_CONSECUTIVE_FAILURES)
+        self._cooldown = (
+            cooldown if cooldown is not None
+            else ptonppl.constants.HEALTH_COOLDOWN)
+
+        self._lock = threading.Lock()
+
+        # (success, latency) of the most recent calls
+        self._outcomes: typing.Deque[typing.Tuple[bool, float]] = collections.deque(
+            maxlen=window if window is not None else ptonppl.constants.HEALTH_WINDOW)
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+        self._consecutive_failures = 0
+        self._calls = 0
+        self._failures = 0
+        self._rejected = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self._cooldown:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        Return whether the backend may be called; if it is, the outcome must
+        then be reported with `success`, `failure` or `release`.
+        """
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self._cooldown:
+                self._state = HALF_OPEN
+
+            if self._state == CLOSED:
+                return True
+
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+
+            self._rejected += 1
+            return False
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+
+    def success(self, latency: float):
+        with self._lock:
+            self._outcomes.append((True, latency))
+            self._calls += 1
+            self._consecutive_failures = 0
+
+            if self._state != CLOSED:
+                self._state = CLOSED
+                self._probing = False
+
+                # the failures that opened the circuit are now irrelevant
+                self._outcomes.clear()
+                self._outcomes.append((True, latency))
+
+    def failure(self, latency: float):
+        with self._lock:
+            self._outcomes.append((False, latency))
+            self._calls += 1
+            self._failures += 1
+            self._consecutive_failures += 1
+
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+
+            if self._state != CLOSED:
+                return
+
+            if self._consecutive_failures >= self._max_consecutive_failures:
+                self._open()
+
+            elif (len(self._outcomes) >= self._min_calls and
+                  self._error_rate() >= self._max_error_rate):
+                self._open()
+
+    def release(self):
+        """
+        Report that a call that was allowed did not actually happen (for
+        instance, because the backend cannot search that kind of value).
+        """
+        with self._lock:
+            self._probing = False
+
+    def _error_rate(self) -> float:
+        if len(self._outcomes) == 0:
+            return 0.0
+        return sum(1 for (ok, _) in self._outcomes if not ok) / len(self._outcomes)
+
+    @property
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        state = self.state
+
+        with self._lock:
+            latencies = [latency for (_, latency) in self._outcomes]
+
+            return {
+                "state": state,
+                "calls": self._calls,
+                "failures": self._failures,
+                "rejected": self._rejected,
+                "error_rate": self._error_rate(),
+                "latency": sum(latencies) / len(latencies) if len(latencies) > 0 else None,
+            }
+
+
+class HealthRegistry:
+    """
+    Health of each backend, created on first use.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._backends: typing.Dict[str, BackendHealth] = dict()
+
+    def get(self, name: str) -> BackendHealth:
+        with self._lock:
+            health = self._backends.get(name)
+            if health is None:
+                health = BackendHealth(name=name, **self._kwargs)
+                self._backends[name] = health
+            return health
+
+    def __iter__(self) -> typing.Iterator[BackendHealth]:
+        with self._lock:
+            return iter(list(self._backends.values()))
+
+    def reset(self):
+        with self._lock:
+            self._backends.clear()
+
+
+# Health of the backends used by `ptonppl.control`
+
+registry = HealthRegistry()
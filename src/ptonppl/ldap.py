@@ -1,19 +1,35 @@
 
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
 import typing
 
 import backoff
 import ldap
+import ldap.controls
+import ldap.filter
 
 import ptonppl.abstract
 import ptonppl.constants
+import ptonppl.metrics
 
 
 __author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
 
 __all__ = [
+    "ConnectionPool",
+    "pool",
     "connect",
+    "is_restricted",
+    "attributes_for_fields",
+    "set_requested_fields",
     "LdapPtonPerson",
     "search_one",
+    "search_batch",
+    "iter_search",
 ]
 
 
@@ -32,7 +48,127 @@ ldap.set_option(ldap.OPT_REFERRALS, 0)
 ldap.set_option(ldap.OPT_NETWORK_TIMEOUT, 2)
 ldap.set_option(ldap.OPT_TIMEOUT, 1)
 
-# Connect to server
+# Connections to server (which are only established when first needed)
+
+class ConnectionPool:
+    """
+    Bounded pool of connections to the LDAP server, which can be shared by
+    concurrent callers.
+
+    Connections are kept alive from one search to the next; one that has
+    been idle for longer than `check_interval` seconds is checked with a
+    cheap "Who am I?" operation before being handed out again, and a
+    connection on which the server went down or timed out is discarded
+    rather than returned to the pool, so that reconnection only happens on
+    failure. At most `size` connections are in use at any time.
+    """
+
+    def __init__(
+            self,
+            uri: typing.Optional[str] = None,
+            size: typing.Optional[int] = None,
+            check_interval: typing.Optional[float] = None,
+    ):
+        self._uri = uri if uri is not None else ptonppl.constants.LDAP_URI
+        self._size = size if size is not None else ptonppl.constants.LDAP_POOL_SIZE
+        self._check_interval = (
+            check_interval if check_interval is not None
+            else ptonppl.constants.LDAP_POOL_CHECK_INTERVAL)
+
+        self._slots = threading.BoundedSemaphore(self._size)
+        self._lock = threading.Lock()
+
+        # idle connections, with the time they were last used
+        self._idle: typing.List[typing.Tuple[ldap.ldapobject.LDAPObject, float]] = []
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _create(self) -> ldap.ldapobject.LDAPObject:
+        conn = ldap.initialize(self._uri)
+        conn.protocol_version = 3
+        return conn
+
+    def _acquire(self) -> ldap.ldapobject.LDAPObject:
+        self._slots.acquire()
+
+        try:
+            while True:
+                with self._lock:
+                    if len(self._idle) == 0:
+                        break
+                    (conn, last_used) = self._idle.pop()
+
+                if time.monotonic() - last_used < self._check_interval:
+                    return conn
+
+                try:
+                    conn.whoami_s()
+                    return conn
+                except ldap.LDAPError:
+                    self._close(conn)
+
+            return self._create()
+
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(
+            self,
+            conn: ldap.ldapobject.LDAPObject,
+            discard: bool = False,
+    ):
+        if discard:
+            self._close(conn)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+
+        self._slots.release()
+
+    @staticmethod
+    def _close(conn: ldap.ldapobject.LDAPObject):
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    @contextlib.contextmanager
+    def connection(self) -> typing.Iterator[ldap.ldapobject.LDAPObject]:
+        conn = self._acquire()
+
+        try:
+            yield conn
+
+        except (ldap.SERVER_DOWN, ldap.TIMEOUT):
+            self._release(conn, discard=True)
+            raise
+
+        except BaseException:
+            self._release(conn)
+            raise
+
+        else:
+            self._release(conn)
+
+    def reset(self):
+        """
+        Close all idle connections, so that new ones are established.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+
+        for (conn, _) in idle:
+            self._close(conn)
+
+
+pool: ConnectionPool = ConnectionPool()
+
+
+# Single connection, kept for compatibility (searches use `pool`)
 
 _server: typing.Optional[ldap.ldapobject.LDAPObject] = None
 
@@ -46,53 +182,156 @@ def connect(
         _server = ldap.initialize(ptonppl.constants.LDAP_URI)
         _server.protocol_version = 3
 
-    return _server
-
+        # make sure pooled connections are also renewed
+        pool.reset()
 
-connect(reconnect=True)
+    return _server
 
 
 # Determine attributes that are available (on a sample of 100 results)
 
 def get_attributes() -> typing.Set[str]:
-    msg_id = _server.search_ext(
-        ptonppl.constants.LDAP_BASE_DN,
-        ldap.SCOPE_SUBTREE,
-        sizelimit=100,
-    )
+    with pool.connection() as server:
+        msg_id = server.search_ext(
+            ptonppl.constants.LDAP_BASE_DN,
+            ldap.SCOPE_SUBTREE,
+            sizelimit=100,
+        )
+
+        fields = set()
+
+        while True:
+            try:
+                _, new_results = server.result(msgid=msg_id, all=0)
+            except ldap.LDAPError as error:
+                break
 
-    fields = set()
+            if new_results is None or type(new_results) is not list:
+                break
 
-    while True:
-        try:
-            _, new_results = _server.result(msgid=msg_id, all=0)
-        except ldap.LDAPError as error:
-            break
+            try:
+                new_result = new_results[0]
+                _, new_record = new_result
+            except (IndexError, ValueError) as error:
+                # (including the end of the results, which is empty)
+                break
 
-        if new_results is None or type(new_results) is not list:
-            break
+            fields = fields.union(set(new_record.keys()))
 
-        try:
-            new_result = new_results[0]
-            _, new_record = new_result
-        except ValueError as error:
-            break
+    return fields
 
-        fields = fields.union(set(new_record.keys()))
 
-    return fields
+# The probe above is cached on disk, because which attributes are available
+# depends on where we connect from, which does not change from one run to
+# the next
 
+def _load_attributes() -> typing.Optional[typing.Set[str]]:
+    try:
+        with open(ptonppl.constants.LDAP_PROBE_CACHE_PATH) as f:
+            probe = json.load(f)
 
-_ldap_attributes: typing.Set[str] = get_attributes()
+        if (probe["uri"] != ptonppl.constants.LDAP_URI or
+                time.time() - probe["created"] > ptonppl.constants.LDAP_PROBE_CACHE_TTL):
+            return
 
+        return set(probe["attributes"])
 
-# If we only have a small number of attributes in common with ATTRIBUTES_FULL
-# we are probably in restricted LDAP
+    except (OSError, ValueError, KeyError, TypeError):
+        return
+
+
+def _save_attributes(attributes: typing.Set[str]):
+    try:
+        os.makedirs(os.path.dirname(ptonppl.constants.LDAP_PROBE_CACHE_PATH), exist_ok=True)
+
+        with open(ptonppl.constants.LDAP_PROBE_CACHE_PATH, "w") as f:
+            json.dump({
+                "uri": ptonppl.constants.LDAP_URI,
+                "created": time.time(),
+                "attributes": sorted(attributes),
+            }, f)
+
+    except OSError:
+        pass
+
+
+_ldap_restricted: typing.Optional[bool] = None
+_ldap_restricted_lock = threading.Lock()
+
+
+def is_restricted() -> bool:
+    """
+    Whether we only have access to the restricted (public) LDAP directory,
+    which is determined, on first call, by probing which attributes the
+    server returns (until a probe succeeds, the directory is assumed to be
+    restricted, and each call probes it again).
+    """
+    global _ldap_restricted
+
+    with _ldap_restricted_lock:
+        if _ldap_restricted is None:
+            attributes = _load_attributes()
+
+            if attributes is None:
+                attributes = get_attributes()
+
+                # an empty sample means the probe failed: its result is
+                # neither saved nor remembered, so that the next call (or
+                # run) probes again
+                if len(attributes) == 0:
+                    return True
+
+                _save_attributes(attributes)
+
+            # If we only have a small number of attributes in common with
+            # ATTRIBUTES_FULL we are probably in restricted LDAP
+
+            _ldap_restricted = (
+                    len(attributes.intersection(ptonppl.constants.ATTRIBUTES_FULL)) <=
+                    len(ptonppl.constants.ATTRIBUTES_PUBLIC)
+            )
+
+    return _ldap_restricted
 
-_ldap_restricted: bool = (
-        len(_ldap_attributes.intersection(ptonppl.constants.ATTRIBUTES_FULL)) <=
-        len(ptonppl.constants.ATTRIBUTES_PUBLIC)
-)
+
+# Attributes requested by searches: only those needed to build a record,
+# rather than every attribute of every entry (`None` requests them all)
+
+def attributes_for_fields(
+        fields: typing.Optional[typing.Iterable[str]] = None,
+) -> typing.List[str]:
+    """
+    Return the LDAP attributes needed to produce the given output fields
+    (by default, all of them) of a record.
+    """
+    if fields is None:
+        fields = ptonppl.constants.LDAP_FIELD_ATTRIBUTES.keys()
+
+    attributes = set(ptonppl.constants.LDAP_REQUIRED_ATTRIBUTES)
+    for field in fields:
+        attributes.update(ptonppl.constants.LDAP_FIELD_ATTRIBUTES.get(field, []))
+
+    return sorted(attributes)
+
+
+_attrlist: typing.Optional[typing.List[str]] = attributes_for_fields()
+
+
+def set_requested_fields(
+        fields: typing.Optional[typing.Iterable[str]] = None,
+        fetch_all: typing.Optional[bool] = None,
+):
+    """
+    Narrow the attributes requested by subsequent searches to those needed
+    for the given output fields, or, with `fetch_all`, request every
+    attribute (which is then available through `original`).
+    """
+    global _attrlist
+
+    if fetch_all is not None and fetch_all:
+        _attrlist = None
+    else:
+        _attrlist = attributes_for_fields(fields=fields)
 
 
 def _ldap_do_we_give_up(
@@ -100,60 +339,80 @@ def _ldap_do_we_give_up(
 ) -> bool:
 
     if isinstance(err, ldap.SERVER_DOWN) or isinstance(err, ldap.TIMEOUT):
-        # reconnect ...
-        connect(reconnect=True)
-
-        # ... and retry
+        # retry (the failed connection has been discarded from the pool,
+        # so the next attempt will reconnect)
         return False
 
     # neither one of those exceptions, therefore we should fail
     return True
 
 
+def _ldap_on_backoff(details: typing.Dict[str, typing.Any]):
+    ptonppl.metrics.record(backend="ldap", outcome=ptonppl.metrics.RETRY)
+
+
 ldap_retry = backoff.on_exception(
     wait_gen=backoff.constant,
     exception=ldap.LDAPError,
-    giveup=_ldap_do_we_give_up
+    giveup=_ldap_do_we_give_up,
+    max_tries=ptonppl.constants.LDAP_MAX_TRIES,
+    on_backoff=_ldap_on_backoff,
 )
 
 
+def _add_dn_attributes(
+        dn: str,
+        entry: typing.Dict[str, typing.Any],
+) -> typing.Dict[str, typing.Any]:
+
+    aux_attrs = {
+        field: value
+        for (field, value) in map(lambda s: s.split("="), map(str.strip, dn.split(",")))
+        if field.lower() not in ptonppl.constants.ATTRIBUTES_TOP_LEVEL
+    }
+    entry.update(aux_attrs)
+
+    return entry
+
+
 @ldap_retry
 def search_aux(
         ldap_filter: typing.Optional[str] = None,
         size_limit: int = 1,
+        attrlist: typing.Optional[typing.List[str]] = None,
 ):
-    msg_id = _server.search_ext(
-        base=ptonppl.constants.LDAP_BASE_DN,
-        scope=ldap.SCOPE_SUBTREE,
-        filterstr=ldap_filter,
-        sizelimit=size_limit,
-    )
+    if attrlist is None:
+        attrlist = _attrlist
 
-    results = []
+    with ptonppl.metrics.measure("ldap") as measurement, pool.connection() as server:
+        msg_id = server.search_ext(
+            base=ptonppl.constants.LDAP_BASE_DN,
+            scope=ldap.SCOPE_SUBTREE,
+            filterstr=ldap_filter,
+            attrlist=attrlist,
+            sizelimit=size_limit,
+        )
 
-    while True:
-        try:
-            _, new_results = _server.result(msgid=msg_id, all=0)
-            if new_results is None or len(new_results) == 0:
-                break
+        results = []
+
+        while True:
+            try:
+                _, new_results = server.result(msgid=msg_id, all=0)
+                if new_results is None or len(new_results) == 0:
+                    break
 
-            new_result = new_results[0]
-            res_type, res_data = new_result
+                new_result = new_results[0]
+                res_type, res_data = new_result
 
-            aux_attrs = {
-                field: value
-                for (field, value) in map(lambda s: s.split("="), map(str.strip, res_type.split(",")))
-                if field.lower() not in ptonppl.constants.ATTRIBUTES_TOP_LEVEL
-            }
-            res_data.update(aux_attrs)
+                results.append(_add_dn_attributes(dn=res_type, entry=res_data))
 
-            results.append(res_data)
+            except ldap.SIZELIMIT_EXCEEDED:
+                break
 
-        except ldap.SIZELIMIT_EXCEEDED:
-            break
+            except ValueError:
+                continue
 
-        except ValueError:
-            continue
+        measurement.outcome = ptonppl.metrics.HIT if len(results) > 0 else ptonppl.metrics.MISS
 
     return results
 
@@ -163,7 +422,7 @@ def search_many(
         ldap_value: str,
         size_limit: int = 1,
 ):
-    if _ldap_restricted and ldap_field not in ptonppl.constants.ATTRIBUTES_PUBLIC:
+    if ldap_field not in ptonppl.constants.ATTRIBUTES_PUBLIC and is_restricted():
         return None
 
     return search_aux(
@@ -172,6 +431,27 @@ def search_many(
     )
 
 
+def _grab_all_attr(
+        ldap_obj: typing.Dict[str, typing.Any],
+        ldap_field: str
+) -> typing.List[str]:
+
+    if ldap_obj is None:
+        return []
+
+    val = ldap_obj.get(ldap_field)
+    if val is None:
+        return []
+
+    if type(val) is not list:
+        val = [val]
+
+    return [
+        v.decode("ascii") if type(v) is bytes else v
+        for v in val
+    ]
+
+
 def _grab_attr(
         ldap_obj: typing.Dict[str, typing.Any],
         ldap_field: str
@@ -198,23 +478,29 @@ def _grab_attr(
 
 class LdapPtonPerson(ptonppl.abstract.AbstractPtonPerson):
 
+    __slots__ = ()
+
     def __init__(self, ldap_result: typing.Dict[str, typing.Any]):
-        self._original = ldap_result
 
-        self._puid = _grab_attr(self._original, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["puid"])
-        self._netid = _grab_attr(self._original, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["netid"])
-        self._email = _grab_attr(self._original, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["email"])
-        self._alias = _grab_attr(self._original, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["alias"])
-        self._pustatus = _grab_attr(self._original, "pustatus")
-        self._cn = _grab_attr(self._original, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["name"])
+        email = _grab_attr(ldap_result, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["email"])
+        if email is None:
+            val = _grab_attr(ldap_result, "eduPersonPrincipalName")
+            if val is not None and "@" in val:
+                email = val
 
-        if self._email is None:
-            val = _grab_attr(self._original, "eduPersonPrincipalName")
-            if "@" in val:
-                self._email = val
+        alias = _grab_attr(ldap_result, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["alias"])
+        if alias is not None:
+            alias = alias.split("@")[0]
 
-        if self._alias is not None:
-            self._alias = self._alias.split("@")[0]
+        super().__init__(
+            puid=_grab_attr(ldap_result, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["puid"]),
+            netid=_grab_attr(ldap_result, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["netid"]),
+            alias=alias,
+            email=email,
+            pustatus=_grab_attr(ldap_result, "pustatus"),
+            cn=_grab_attr(ldap_result, ptonppl.constants.LDAP_ATTRIBUTE_MAPPING["name"]),
+            original=ldap_result,
+        )
 
 
 def search_one(
@@ -230,3 +516,118 @@ def search_one(
 
     if ret is not None and len(ret) > 0:
         return LdapPtonPerson(ldap_result=ret[0])
+
+
+def _chunks(
+        iterable: typing.Iterable[typing.Any],
+        size: int,
+) -> typing.Iterator[typing.List[typing.Any]]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def search_batch(
+        ldap_field: str,
+        ldap_values: typing.Iterable[str],
+        chunk_size: typing.Optional[int] = None,
+) -> typing.Dict[str, LdapPtonPerson]:
+    """
+    Lookup many values of the same LDAP field using as few round trips as
+    possible, by packing up to `chunk_size` values into a single filter of
+    the form `(|(field=value1)(field=value2)...)`.
+
+    Returns a dictionary mapping each of the input values for which an
+    entry was found, to the corresponding record; values that were not
+    found are absent from the dictionary.
+    """
+
+    if chunk_size is None:
+        chunk_size = ptonppl.constants.LDAP_BATCH_SIZE
+
+    if ldap_field not in ptonppl.constants.ATTRIBUTES_PUBLIC and is_restricted():
+        return dict()
+
+    found: typing.Dict[str, LdapPtonPerson] = dict()
+
+    # LDAP matches on these attributes are case-insensitive, so keep track
+    # of the original spelling of each input to report results under it
+
+    for chunk in _chunks(ldap_values, chunk_size):
+        wanted: typing.Dict[str, typing.List[str]] = dict()
+        for value in chunk:
+            wanted.setdefault(value.lower(), []).append(value)
+
+        ldap_filter = "(|{})".format("".join(
+            "({}={})".format(ldap_field, ldap.filter.escape_filter_chars(value))
+            for value in wanted.keys()
+        ))
+
+        # no size limit: a chunk can legitimately match as many entries as
+        # it has values
+
+        results = search_aux(ldap_filter=ldap_filter, size_limit=0)
+
+        for result in results:
+            for key in map(str.lower, _grab_all_attr(result, ldap_field)):
+                for value in wanted.pop(key, []):
+                    found[value] = LdapPtonPerson(ldap_result=result)
+
+    return found
+
+
+def iter_search(
+        ldap_filter: str,
+        page_size: typing.Optional[int] = None,
+        attrlist: typing.Optional[typing.List[str]] = None,
+) -> typing.Iterator[LdapPtonPerson]:
+    """
+    Enumerate every entry matching `ldap_filter`, using the Simple Paged
+    Results control to retrieve them `page_size` at a time, so as not to
+    hit the server's size limit; records are yielded as each page arrives,
+    so memory use does not depend on the number of entries.
+    """
+
+    if page_size is None:
+        page_size = ptonppl.constants.LDAP_PAGE_SIZE
+
+    if attrlist is None:
+        attrlist = _attrlist
+
+    page_control = ldap.controls.SimplePagedResultsControl(
+        criticality=True, size=page_size, cookie="")
+
+    # the paging cookie is only valid on the connection it was issued on
+    with pool.connection() as server:
+        while True:
+            msg_id = server.search_ext(
+                base=ptonppl.constants.LDAP_BASE_DN,
+                scope=ldap.SCOPE_SUBTREE,
+                filterstr=ldap_filter,
+                attrlist=attrlist,
+                serverctrls=[page_control],
+            )
+
+            with ptonppl.metrics.measure("ldap"):
+                _, entries, _, response_controls = server.result3(msgid=msg_id)
+
+            for (dn, entry) in entries:
+                # skip search references
+                if dn is None or not isinstance(entry, dict):
+                    continue
+
+                yield LdapPtonPerson(ldap_result=_add_dn_attributes(dn=dn, entry=entry))
+
+            cookies = [
+                control.cookie
+                for control in response_controls
+                if control.controlType == ldap.controls.SimplePagedResultsControl.controlType
+            ]
+
+            if len(cookies) == 0 or not cookies[0]:
+                break
+
+            page_control.cookie = cookies[0]
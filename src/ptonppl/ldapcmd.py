@@ -1,10 +1,19 @@
 
+import base64
+import concurrent.futures
+import itertools
+import shlex
+import threading
 import typing
 import subprocess
 
+import ldap.filter
+
 import ptonppl.abstract
 import ptonppl.constants
+import ptonppl.executors
 import ptonppl.ldap
+import ptonppl.metrics
 import ptonppl.requests
 
 
@@ -12,6 +21,7 @@ __author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
 
 __all__ = [
     "search_one",
+    "search_batch",
 ]
 
 
@@ -27,66 +37,135 @@ def _check_uid(s:str) -> typing.Optional[str]:
     return s_l
 
 
-def _parse_ldapsearch_output(out:str) -> typing.Dict[str, typing.Dict[str, str]]:
+def _parse_ldif_line(line: str) -> typing.Optional[typing.Tuple[str, typing.Any]]:
+
+    # comments, and lines that are not attribute-value pairs
+    if line[0] == "#" or ":" not in line:
+        return
+
+    (field, value) = line.split(":", 1)
+    field = field.strip().lower()
+
+    # base64-encoded value (used for non-ASCII and binary values)
+    if value[:1] == ":":
+        value = base64.b64decode(value[1:].strip())
+        try:
+            value = value.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
+
+    else:
+        value = value.strip()
 
-    if out is None:
-        return dict()
+    return field, value
 
-    lines = out.split("\n")
 
-    # sentinel to flush
-    lines.append("dn: ")
+def _iter_ldif(lines: typing.Iterable[str]) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+    """
+    Parse LDIF (such as the output of `ldapsearch`) incrementally, yielding
+    the record of each entry as soon as it ends, so that at most one entry
+    is held in memory, whatever the size of the input.
+
+    Folded lines (continued on the following lines, which begin with a
+    space) are unfolded, and base64-encoded values (`field:: value`) are
+    decoded.
+    """
 
     current_dn = None
-    current_record = {}
+    current_record = dict()
+
+    # a line may be continued on the next ones, so it is only parsed once
+    # the next line that does not begin with a space is read (the extra empty
+    # line is a sentinel to flush the final entry)
 
-    identities = {}
+    pending: typing.Optional[str] = None
 
-    for line in lines:
-        if line == "" or line[0] == "#":
+    for line in itertools.chain(lines, [""]):
+        line = line.rstrip("\r\n")
+
+        if line[:1] == " ":
+            if pending is not None:
+                pending += line[1:]
             continue
 
-        if ":" in line:
-            (field, value) = line.split(":", 1)
-            field = field.strip().lower()
-            value = value.strip()
+        parsed = _parse_ldif_line(pending) if pending else None
+        pending = line
+
+        if parsed is not None:
+            (field, value) = parsed
 
             if field == "dn":
+                # (entries should be separated by an empty line, but no
+                # need to rely on it)
+                if current_dn is not None:
+                    yield current_record
 
-                # the last occurrence of "dn" is a sentinel meant to flush
-                # the final result
+                current_dn = value
+                current_record = dict()
 
-                if current_dn is not None and current_record is not None:
-                    key = current_record[ptonppl.constants.PARSED_LDAP_KEY]
-                    identities[key] = current_record
+            elif field and field not in ptonppl.constants.LDAP_IGNORE_FIELDS:
 
-                if value:
-                    current_dn = value
-                    current_record = {}
+                if field in current_record:
+                    curr = current_record[field]
 
-            elif field:
+                    if type(curr) is list:
+                        curr.append(value)
+                    else:
+                        current_record[field] = [curr, value]
 
-                if field not in ptonppl.constants.LDAP_IGNORE_FIELDS:
+                else:
+                    current_record[field] = value
 
-                    if field in current_record:
-                        curr = current_record[field]
+        # an empty line ends the current entry (blocks without a DN, such as
+        # the summary printed by `ldapsearch`, are not entries)
+        if line == "":
+            if current_dn is not None:
+                yield current_record
 
-                        if type(curr) is list:
-                            curr.append(value)
-                        else:
-                            current_record[field] = [curr, value]
+            current_dn = None
+            current_record = dict()
 
-                    else:
-                        current_record[field] = value
 
-    return identities
+class _Abort:
+    """
+    Allows another thread to stop a source of records (the `ldapsearch`
+    process, or the response of the proxy) that is being read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._aborted = False
+        self._callbacks: typing.List[typing.Callable[[], None]] = list()
+
+    @property
+    def aborted(self) -> bool:
+        return self._aborted
+
+    def register(self, callback: typing.Callable[[], None]):
+        with self._lock:
+            if not self._aborted:
+                self._callbacks.append(callback)
+                return
 
+        # the source was aborted before it was even started
+        callback()
 
-def _get_ldapsearch_output_from_proxy_url(
+    def abort(self):
+        with self._lock:
+            self._aborted = True
+            callbacks = self._callbacks
+            self._callbacks = list()
+
+        for callback in callbacks:
+            callback()
+
+
+def _iter_ldapsearch_output_from_proxy_url(
         ldap_field: str,
         ldap_value: str,
         proxy_url: typing.Optional[str] = None,
-) -> typing.Optional[str]:
+        abort: typing.Optional[_Abort] = None,
+) -> typing.Iterator[typing.Dict[str, typing.Any]]:
 
     if proxy_url is None:
         proxy_url = ptonppl.constants.LDAP_DEFAULT_PROXY_URL
@@ -95,65 +174,215 @@ def _get_ldapsearch_output_from_proxy_url(
     # requests escape a dict, because it also escapes the '@' and
     # percent-encodes it)
 
-    r = ptonppl.requests.get(proxy_url, params="{}={}".format(ldap_field, ldap_value))
-    if r.ok:
-        return r.content.decode("ascii")
+    r = ptonppl.requests.get(proxy_url, params="{}={}".format(ldap_field, ldap_value), stream=True)
 
+    if abort is not None:
+        abort.register(r.close)
 
-def _get_ldapsearch_output_from_local_cmd(
-        ldap_field: str,
-        ldap_value: str,
+    # the body is parsed as it is received, rather than once fully downloaded
+    try:
+        if r.ok:
+            yield from _iter_ldif(
+                line.decode("utf-8", errors="replace")
+                for line in r.iter_lines()
+            )
+    finally:
+        r.close()
+
+
+def _iter_local_cmd(
+        ldap_filter: str,
         local_cmd: typing.Optional[str] = None,
-) -> typing.Optional[str]:
+        abort: typing.Optional[_Abort] = None,
+) -> typing.Iterator[typing.Dict[str, typing.Any]]:
 
     if local_cmd is None:
         local_cmd = ptonppl.constants.LDAP_DEFAULT_CMD
 
-    cmd = ptonppl.constants.LDAP_CMD_PATTERN.format(
-        cmd=local_cmd,
-        query="{}={}".format(ldap_field, ldap_value),
+    # the command is run from a list of arguments, without a shell, so that
+    # the filter never needs to be quoted
+    args = shlex.split(local_cmd) + ptonppl.constants.LDAP_CMD_ARGS + [ldap_filter]
+
+    try:
+        proc = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+    except OSError:
+        # command not installed
+        return
+
+    if abort is not None:
+        abort.register(proc.kill)
+
+    # the output is parsed as the command produces it, and the command is
+    # stopped if the caller does not need the rest of it
+
+    try:
+        yield from _iter_ldif(proc.stdout)
+    except BaseException:
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+
+    # once the output has been read entirely, the command is expected to
+    # have succeeded, otherwise its output cannot be trusted (e.g., if the
+    # local copy of `ldapsearch` is outdated, or the server unreachable)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode=returncode, cmd=args)
+
+
+def _iter_ldapsearch_output_from_local_cmd(
+        ldap_field: str,
+        ldap_value: str,
+        local_cmd: typing.Optional[str] = None,
+        abort: typing.Optional[_Abort] = None,
+) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+
+    return _iter_local_cmd(
+        ldap_filter="{}={}".format(ldap_field, ldap_value),
+        local_cmd=local_cmd,
+        abort=abort,
     )
 
-    (status, out) = subprocess.getstatusoutput(cmd)
 
-    # If unsuspected problem, check here
-    # FIXME: add error correction
-    ## TO DEBUG:
-    ## print "Content-type: text/plain\n\n", (status, output)
-    ## if error 256 may be that the local copy of ldapsearch is outdated
+def _first(records: typing.Iterator[typing.Dict[str, typing.Any]]) -> typing.Optional[typing.Dict[str, typing.Any]]:
+
+    # only the first entry is needed: closing the iterator releases its
+    # source (process or HTTP response) without reading the rest
+    try:
+        return next(records, None)
+    finally:
+        records.close()
 
-    if status == 0:
-        return out
+
+def _first_measured(
+        name: str,
+        source: typing.Callable[..., typing.Iterator[typing.Dict[str, typing.Any]]],
+        ldap_field: str,
+        ldap_value: str,
+        abort: typing.Optional[_Abort] = None,
+) -> typing.Optional[typing.Dict[str, typing.Any]]:
+
+    # (`name` is that of the source in the metrics)
+    with ptonppl.metrics.measure(name) as measurement:
+        try:
+            record = _first(source(ldap_field=ldap_field, ldap_value=ldap_value, abort=abort))
+        except Exception:
+            # reading a source that was aborted can fail in all sorts of ways
+            if abort is not None and abort.aborted:
+                measurement.outcome = ptonppl.metrics.CANCELLED
+                return
+            raise
+
+        if abort is not None and abort.aborted:
+            measurement.outcome = ptonppl.metrics.CANCELLED
+        else:
+            measurement.outcome = ptonppl.metrics.HIT if record is not None else ptonppl.metrics.MISS
+
+        return record
+
+
+def _is_complete(record: typing.Dict[str, typing.Any]) -> bool:
+    return ptonppl.ldap.LdapPtonPerson(ldap_result=record).complete
+
+
+def _race_ldapsearch_output(
+        ldap_field: str,
+        ldap_value: str,
+) -> typing.Optional[typing.Dict[str, str]]:
+    """
+    Query the local `ldapsearch` command and the proxy concurrently, and
+    return the first complete record, stopping the slower source; only if
+    the first answer lacks some fields is the other one awaited, to fill
+    them in.
+    """
+
+    # (the sources are raced on threads of their own, see `ptonppl.control`)
+    executor = ptonppl.executors.get_executor("ldapcmd")
+
+    futures: typing.Dict[concurrent.futures.Future, _Abort] = dict()
+    for (name, source) in [
+        ("ldapsearch", _iter_ldapsearch_output_from_local_cmd),
+        ("proxy", _iter_ldapsearch_output_from_proxy_url),
+    ]:
+        abort = _Abort()
+        future = executor.submit(
+            _first_measured, name=name, source=source,
+            ldap_field=ldap_field, ldap_value=ldap_value, abort=abort)
+        futures[future] = abort
+
+    obj: typing.Optional[typing.Dict[str, typing.Any]] = None
+    error: typing.Optional[Exception] = None
+
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                new_obj = future.result()
+            except Exception as exc:
+                # only report the error if no source answered
+                error = error or exc
+                continue
+
+            if new_obj is None:
+                continue
+
+            if obj is None:
+                obj = new_obj
+            else:
+                for (field, value) in new_obj.items():
+                    obj.setdefault(field, value)
+
+            if _is_complete(obj):
+                break
+
+    finally:
+        for (future, abort) in futures.items():
+            if not future.done():
+                future.cancel()
+                abort.abort()
+
+    if obj is None and error is not None:
+        raise error
+
+    return obj
 
 
 def _get_ldapsearch_output(
         ldap_field: str,
         ldap_value: str,
         uid_check: typing.Optional[bool] = None,
+        race: typing.Optional[bool] = None,
 ) -> typing.Optional[typing.Dict[str, str]]:
 
+    race = race if race is not None else ptonppl.constants.LDAPCMD_RACE
+
     # escape bad characters
     if uid_check is not None and uid_check:
         ldap_value = _check_uid(ldap_value)
         if ldap_value is None:
             return
 
-    local_ret = _parse_ldapsearch_output(
-        out=_get_ldapsearch_output_from_local_cmd(
-            ldap_field=ldap_field,
-            ldap_value=ldap_value,
-        )
-    )
+    if race:
+        return _race_ldapsearch_output(ldap_field=ldap_field, ldap_value=ldap_value)
 
-    url_ret = _parse_ldapsearch_output(
-        out=_get_ldapsearch_output_from_proxy_url(
-            ldap_field=ldap_field,
-            ldap_value=ldap_value,
-        )
+    obj1 = _first_measured(
+        name="ldapsearch",
+        source=_iter_ldapsearch_output_from_local_cmd,
+        ldap_field=ldap_field,
+        ldap_value=ldap_value,
     )
 
-    obj1 = list(local_ret.values())[0] if len(local_ret) > 0 else None
-    obj2 = list(url_ret.values())[0] if len(url_ret) > 0 else None
+    obj2 = _first_measured(
+        name="proxy",
+        source=_iter_ldapsearch_output_from_proxy_url,
+        ldap_field=ldap_field,
+        ldap_value=ldap_value,
+    )
 
     if obj1 is None:
         return obj2
@@ -176,3 +405,54 @@ def search_one(
 
     if ret is not None:
         return ptonppl.ldap.LdapPtonPerson(ldap_result=ret)
+
+
+def search_batch(
+        ldap_field: str,
+        ldap_values: typing.Iterable[str],
+        chunk_size: typing.Optional[int] = None,
+        local_cmd: typing.Optional[str] = None,
+) -> typing.Dict[str, ptonppl.abstract.AbstractPtonPerson]:
+    """
+    Lookup many values of the same LDAP field with the local `ldapsearch`
+    command, running it once for every `chunk_size` values with a filter of
+    the form `(|(field=value1)(field=value2)...)`, rather than once per value.
+
+    Returns a dictionary mapping each of the input values for which an
+    entry was found, to the corresponding record (as `ptonppl.ldap.search_batch`).
+    """
+
+    if chunk_size is None:
+        chunk_size = ptonppl.constants.LDAP_BATCH_SIZE
+
+    # (the parser reports attribute names in lowercase)
+    field = ldap_field.lower()
+
+    found: typing.Dict[str, ptonppl.abstract.AbstractPtonPerson] = dict()
+
+    for chunk in ptonppl.ldap._chunks(ldap_values, chunk_size):
+        wanted: typing.Dict[str, typing.List[str]] = dict()
+        for value in chunk:
+            wanted.setdefault(value.lower(), []).append(value)
+
+        ldap_filter = "(|{})".format("".join(
+            "({}={})".format(ldap_field, ldap.filter.escape_filter_chars(value))
+            for value in wanted.keys()
+        ))
+
+        with ptonppl.metrics.measure("ldapsearch") as measurement:
+            count_found = len(found)
+
+            # split the output back per input value, as it is produced
+            for record in _iter_local_cmd(ldap_filter=ldap_filter, local_cmd=local_cmd):
+                keys = record.get(field, [])
+                if type(keys) is not list:
+                    keys = [keys]
+
+                for key in map(str.lower, keys):
+                    for value in wanted.pop(key, []):
+                        found[value] = ptonppl.ldap.LdapPtonPerson(ldap_result=record)
+
+            measurement.outcome = ptonppl.metrics.HIT if len(found) > count_found else ptonppl.metrics.MISS
+
+    return found
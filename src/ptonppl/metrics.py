@@ -0,0 +1,271 @@
+
+import bisect
+import contextlib
+import threading
+import time
+import typing
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "HIT",
+    "MISS",
+    "ERROR",
+    "RETRY",
+    "TIMEOUT",
+    "CACHED",
+    "CANCELLED",
+    "Histogram",
+    "MetricsRegistry",
+    "registry",
+    "record",
+    "measure",
+    "collect",
+]
+
+
+# Outcomes of the operations of the backends
+
+HIT = "hit"
+MISS = "miss"
+ERROR = "error"
+RETRY = "retry"
+TIMEOUT = "timeout"
+CACHED = "cached"
+CANCELLED = "cancelled"
+
+
+# Upper bounds (in seconds) of the buckets of latency histograms: they grow
+# geometrically, by 25%, from 0.1ms to about 2 minutes, so that percentiles
+# are known within 25%, in constant memory
+
+HISTOGRAM_BOUNDS: typing.List[float] = [0.0001 * 1.25 ** i for i in range(64)]
+
+
+class Histogram:
+    """
+    Distribution of latencies, counted in buckets of geometrically
+    increasing size (see `HISTOGRAM_BOUNDS`). Not thread-safe by itself.
+    """
+
+    def __init__(self):
+        # the last bucket counts whatever exceeds the last bound
+        self._buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def observe(self, value: float):
+        self._buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self._count += 1
+        self._total += value
+        self._max = max(self._max, value)
+
+    def merge(self, other: 'Histogram'):
+        for (index, count) in enumerate(other._buckets):
+            self._buckets[index] += count
+        self._count += other._count
+        self._total += other._total
+        self._max = max(self._max, other._max)
+
+    def percentile(self, q: float) -> typing.Optional[float]:
+        """
+        Return (an upper bound of) the `q`-th percentile, `q` in [0, 100].
+        """
+        if self._count == 0:
+            return None
+
+        rank = q / 100 * self._count
+        cumulative = 0
+
+        for (index, count) in enumerate(self._buckets):
+            cumulative += count
+            if count > 0 and cumulative >= rank:
+                if index < len(HISTOGRAM_BOUNDS):
+                    return min(HISTOGRAM_BOUNDS[index], self._max)
+                return self._max
+
+        return self._max
+
+    def summary(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "count": self._count,
+            "mean": self._total / self._count if self._count > 0 else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self._max if self._count > 0 else None,
+        }
+
+
+class MetricsRegistry:
+    """
+    In-process metrics of the backends: the number of operations of each
+    backend by outcome (hit, miss, error, retry, timeout...), and the
+    histogram of their latencies.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: typing.Dict[typing.Tuple[str, str], int] = dict()
+        self._histograms: typing.Dict[typing.Tuple[str, str], Histogram] = dict()
+
+    def record(
+            self,
+            backend: str,
+            outcome: str,
+            latency: typing.Optional[float] = None,
+    ):
+        key = (backend, outcome)
+
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+            if latency is not None:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = Histogram()
+                    self._histograms[key] = histogram
+                histogram.observe(latency)
+
+    @property
+    def backends(self) -> typing.List[str]:
+        with self._lock:
+            return sorted(set(backend for (backend, _) in self._counts.keys()))
+
+    def histogram(
+            self,
+            backend: str,
+            outcome: typing.Optional[str] = None,
+    ) -> Histogram:
+        """
+        Return (a copy of) the histogram of the latencies of `backend`, for
+        the given `outcome`, or for all of them.
+        """
+        result = Histogram()
+
+        with self._lock:
+            for ((key_backend, key_outcome), histogram) in self._histograms.items():
+                if key_backend == backend and (outcome is None or key_outcome == outcome):
+                    result.merge(histogram)
+
+        return result
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        """
+        Return the metrics as a dictionary (which can be serialized to JSON)
+        mapping each backend to its counts and latencies, by outcome.
+        """
+        result = dict()
+
+        for backend in self.backends:
+            with self._lock:
+                counts = {
+                    outcome: count
+                    for ((key_backend, outcome), count) in self._counts.items()
+                    if key_backend == backend
+                }
+                outcomes = [
+                    outcome
+                    for (key_backend, outcome) in self._histograms.keys()
+                    if key_backend == backend
+                ]
+
+            result[backend] = {
+                "counts": counts,
+                "latency": self.histogram(backend).summary(),
+                "latency_by_outcome": {
+                    outcome: self.histogram(backend, outcome).summary()
+                    for outcome in sorted(outcomes)
+                },
+            }
+
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._histograms.clear()
+
+
+# Metrics of the backends of `ptonppl`
+
+registry = MetricsRegistry()
+
+
+# Counts of the operations recorded on each thread while it is within
+# `collect` blocks (attempts may need to know, for instance, how many times
+# they were retried)
+
+_local = threading.local()
+
+
+def record(
+        backend: str,
+        outcome: str,
+        latency: typing.Optional[float] = None,
+):
+    registry.record(backend=backend, outcome=outcome, latency=latency)
+
+    scopes = getattr(_local, "scopes", None)
+    if scopes:
+        key = (backend, outcome)
+        for counts in scopes:
+            counts[key] = counts.get(key, 0) + 1
+
+
+@contextlib.contextmanager
+def collect() -> typing.Iterator[typing.Dict[typing.Tuple[str, str], int]]:
+    """
+    Count the operations that are recorded, on the current thread, within
+    the block, by `(backend, outcome)`.
+    """
+    counts: typing.Dict[typing.Tuple[str, str], int] = dict()
+
+    scopes = getattr(_local, "scopes", None)
+    if scopes is None:
+        scopes = list()
+        _local.scopes = scopes
+
+    scopes.append(counts)
+    try:
+        yield counts
+    finally:
+        scopes.remove(counts)
+
+
+class _Measurement:
+    def __init__(self):
+        self.outcome: typing.Optional[str] = None
+
+
+@contextlib.contextmanager
+def measure(backend: str) -> typing.Iterator[_Measurement]:
+    """
+    Record the duration of the operation of `backend` in the block, with
+    the outcome that the block sets (`hit` by default), or, if it raises,
+    `timeout` or `error`.
+    """
+    measurement = _Measurement()
+    time_start = time.monotonic()
+
+    try:
+        yield measurement
+
+    except Exception as exc:
+        # (the timeout exceptions of all the backends, and of the standard
+        # library, have "timeout" in their name)
+        outcome = TIMEOUT if "timeout" in type(exc).__name__.lower() else ERROR
+        record(backend=backend, outcome=outcome, latency=time.monotonic() - time_start)
+        raise
+
+    record(
+        backend=backend,
+        outcome=measurement.outcome or HIT,
+        latency=time.monotonic() - time_start,
+    )
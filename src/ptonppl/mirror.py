@@ -0,0 +1,277 @@
+
+import json
+import sqlite3
+import threading
+import time
+import typing
+
+import ptonppl.abstract
+import ptonppl.cache
+import ptonppl.constants
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "Mirror",
+]
+
+
+# (entries are indexed by identifier as in `ptonppl.cache.PersistentCache`)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    record TEXT NOT NULL,
+    modified TEXT,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+""" + ptonppl.cache._IDENTIFIERS_SCHEMA
+
+
+def _attributes() -> typing.List[str]:
+    import ptonppl.ldap
+
+    # the operational attribute `modifyTimestamp` is only returned when it
+    # is explicitly requested
+    return ptonppl.ldap.attributes_for_fields() + ["modifyTimestamp"]
+
+
+def _normalize_filter(ldap_filter: str) -> str:
+    # (a filter may be given without its enclosing parentheses, e.g.,
+    # `uid=foo`, which cannot be nested in another filter as such)
+    ldap_filter = ldap_filter.strip()
+    if not ldap_filter.startswith("("):
+        ldap_filter = "({})".format(ldap_filter)
+
+    return ldap_filter
+
+
+def _decode(values: typing.Any) -> typing.List[str]:
+    if type(values) is not list:
+        values = [values]
+
+    return [
+        value.decode("utf-8") if type(value) is bytes else str(value)
+        for value in values
+    ]
+
+
+class Mirror:
+    """
+    Local replica, stored in a SQLite file, of the LDAP directory fields
+    that `ptonppl` uses (PUID, NetID, email addresses and aliases, name and
+    status), which can answer searches without any network access.
+
+    The first `sync` downloads every entry matching the mirror's filter;
+    subsequent ones only request the entries whose `modifyTimestamp` is
+    more recent than the latest one seen so far. As this cannot detect
+    entries that were removed from the directory, a `full` sync may be
+    requested from time to time, which also drops them from the mirror.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+
+        # the connection is shared by all threads, and serialized here
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _get_meta(self, name: str) -> typing.Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+
+        if row is not None:
+            return row[0]
+
+    def _set_meta(self, name: str, value: typing.Any):
+        self._db.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+            (name, None if value is None else str(value)),
+        )
+
+    @property
+    def info(self) -> typing.Dict[str, typing.Any]:
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+
+        last_sync = self._get_meta("last_sync")
+
+        return {
+            "entries": count,
+            "filter": self._get_meta("filter"),
+            "modified": self._get_meta("modified"),
+            "last_sync": float(last_sync) if last_sync is not None else None,
+        }
+
+    def get(
+            self,
+            value: str,
+            default: typing.Any = None,
+    ) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+        import ptonppl.ldap
+
+        identifier = ptonppl.abstract.normalize_identifier(value)
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT entries.record FROM identifiers "
+                "JOIN entries ON entries.key = identifiers.key "
+                "WHERE identifiers.identifier = ?",
+                (identifier,),
+            ).fetchone()
+
+        if row is None:
+            return default
+
+        return ptonppl.ldap.LdapPtonPerson(ldap_result=json.loads(row[0]))
+
+    def _store(
+            self,
+            obj: ptonppl.abstract.AbstractPtonPerson,
+            attributes: typing.List[str],
+            generation: int,
+    ) -> typing.Optional[str]:
+
+        original = obj.original or dict()
+
+        record = {
+            attribute: _decode(original[attribute])
+            for attribute in attributes
+            if attribute in original
+        }
+
+        identifiers = obj.identifiers
+
+        # every email address (and alias) of the entry, not only the first,
+        # but only the local part of a Princeton address is an alias (that
+        # of an address elsewhere may well be someone else's NetID)
+        domain = ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format("")
+        for mail in record.get("mail", []):
+            mail = ptonppl.abstract.normalize_identifier(mail)
+            identifiers.add(mail)
+            if mail.endswith(domain):
+                identifiers.add(mail[:-len(domain)])
+
+        if len(identifiers) == 0:
+            return
+
+        key = ptonppl.cache._record_key(obj=obj, identifiers=identifiers)
+
+        modified = record.pop("modifyTimestamp", [None])[0]
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (key, record, modified, generation) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(record), modified, generation),
+        )
+        ptonppl.cache._index_identifiers(db=self._db, key=key, identifiers=identifiers)
+
+        return modified
+
+    def sync(
+            self,
+            ldap_filter: typing.Optional[str] = None,
+            full: typing.Optional[bool] = None,
+            page_size: typing.Optional[int] = None,
+    ) -> typing.Dict[str, typing.Any]:
+        """
+        Bring the mirror up to date with the LDAP directory, and return some
+        statistics about what was done.
+
+        Only the entries modified since the previous sync are requested,
+        unless `full` is set, or this is the first sync, or the filter is
+        not the same as that of the previous sync.
+        """
+        import ptonppl.ldap
+
+        if ldap_filter is None:
+            ldap_filter = self._get_meta("filter") or ptonppl.constants.LDAP_MIRROR_FILTER
+
+        ldap_filter = _normalize_filter(ldap_filter)
+
+        if page_size is None:
+            page_size = ptonppl.constants.LDAP_PAGE_SIZE
+
+        modified = self._get_meta("modified")
+
+        full = (
+            (full is not None and full) or
+            modified is None or
+            self._get_meta("filter") != ldap_filter
+        )
+
+        search_filter = ldap_filter
+        if not full:
+            search_filter = "(&{}(modifyTimestamp>={}))".format(ldap_filter, modified)
+
+        with self._lock:
+            (generation,) = self._db.execute(
+                "SELECT COALESCE(MAX(generation), 0) + 1 FROM entries").fetchone()
+
+        attributes = _attributes()
+
+        time_start = time.time()
+        count_updated = 0
+        count_removed = 0
+
+        for obj in ptonppl.ldap.iter_search(
+                ldap_filter=search_filter,
+                page_size=page_size,
+                attrlist=attributes):
+
+            with self._lock:
+                entry_modified = self._store(obj=obj, attributes=attributes, generation=generation)
+
+                # (timestamps are in LDAP generalized time format, which
+                # sorts chronologically)
+                if entry_modified is not None and (modified is None or entry_modified > modified):
+                    modified = entry_modified
+
+                # (changes are committed as each page is stored)
+                count_updated += 1
+                if count_updated % page_size == 0:
+                    self._db.commit()
+
+        with self._lock:
+            if full:
+                # whatever was not seen during a full sync has been removed
+                cursor = self._db.execute(
+                    "DELETE FROM entries WHERE generation < ?", (generation,))
+                count_removed = cursor.rowcount
+                ptonppl.cache._drop_orphan_identifiers(db=self._db, table="entries")
+
+            self._set_meta("filter", ldap_filter)
+            self._set_meta("modified", modified)
+            self._set_meta("last_sync", time_start)
+            self._db.commit()
+
+        return {
+            "full": full,
+            "updated": count_updated,
+            "removed": count_removed,
+            "elapsed": time.time() - time_start,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self) -> 'Mirror':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,144 @@
+
+import csv
+import json
+import sys
+import typing
+
+import ptonppl.abstract
+import ptonppl.constants
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "OUTPUT_TYPES",
+    "RecordWriter",
+    "needed_fields",
+]
+
+
+# Output types: "json" is a single JSON array of records, while "ndjson"
+# has one JSON record per line (and can be consumed as it is produced)
+
+OUTPUT_TYPES = ["term", "json", "ndjson", "csv", "emails"]
+
+
+def needed_fields(
+        type: str,
+        fields: typing.List[str],
+        header: bool = True,
+) -> typing.List[str]:
+    """
+    Return the fields of the records that are needed to output `fields` in
+    the output `type`, which may print more of them (e.g., the name of each
+    person, in the header of the "term" output, or in the "emails" output).
+    """
+    needed = fields[:]
+
+    if type == "emails" or (type == "term" and header):
+        if "name" not in needed:
+            needed.append("name")
+
+    return needed
+
+
+class RecordWriter:
+    """
+    Writes records to `file` (by default, the standard output) in one of
+    the `OUTPUT_TYPES`, keeping only `fields`, as they are produced: the
+    output is opened by `prologue`, and closed by `epilogue`.
+    """
+
+    def __init__(
+            self,
+            type: str,
+            fields: typing.Optional[typing.List[str]] = None,
+            header: bool = True,
+            file: typing.Optional[typing.TextIO] = None,
+    ):
+        if type not in OUTPUT_TYPES:
+            raise ValueError("unrecognized output type: {}  (choices are {})".format(
+                type, ", ".join(OUTPUT_TYPES)))
+
+        self._type = type
+        self._fields = fields if fields is not None else ptonppl.constants.OUTPUT_CSV_HEADER[:]
+        self._header = header
+        self._file = file if file is not None else sys.stdout
+        self._count = 0
+
+        self._csv_writer = None
+        if type == "csv":
+            self._csv_writer = csv.writer(self._file, lineterminator="\n")
+
+        # (the keys of JSON records are only encoded once)
+        self._json_keys = [
+            (field, json.dumps(field) + ": ")
+            for field in self._fields
+        ]
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def _encode(self, record: typing.Dict[str, typing.Any]) -> str:
+        # equivalent to `json.dumps` of the fields of `record`, but only
+        # the values are encoded for each record
+        return "{" + ", ".join([
+            key + json.dumps(record[field])
+            for (field, key) in self._json_keys
+            if field in record
+        ]) + "}"
+
+    def prologue(self):
+        if self._type == "json":
+            self._file.write("[")
+
+        elif self._type == "csv" and self._header:
+            self._csv_writer.writerow(self._fields)
+
+    def write(self, obj: ptonppl.abstract.AbstractPtonPerson):
+
+        if self._type == "csv":
+            # (the record is only computed once per row)
+            record = obj.as_dict
+            self._csv_writer.writerow([record.get(field, "") for field in self._fields])
+
+        elif self._type == "ndjson":
+            self._file.write(self._encode(obj.as_dict) + "\n")
+
+        elif self._type == "json":
+            # (records are separated, rather than followed, by commas, so
+            # that the output is valid JSON)
+            self._file.write("\n    " if self._count == 0 else ",\n    ")
+            self._file.write(self._encode(obj.as_dict))
+
+        elif self._type == "term":
+            pattern = "{}\n"
+            if self._header:
+                self._file.write("{}\n".format(obj.common_name))
+                pattern = "  {}\n"
+            if "netid" in self._fields:
+                self._file.write(pattern.format(obj.netid))
+            if "puid" in self._fields:
+                self._file.write(pattern.format(obj.puid))
+            if "email" in self._fields:
+                self._file.write(pattern.format(obj.email))
+            if self._header:
+                self._file.write("\n")
+
+        elif self._type == "emails":
+            self._file.write(
+                '"{name}" <{email}>,\n'.format(
+                    name=obj.common_name,
+                    email=obj.email.lower(),
+                )
+            )
+
+        self._count += 1
+
+    def epilogue(self):
+        if self._type == "json":
+            self._file.write("\n]\n" if self._count > 0 else "]\n")
+
+    def flush(self):
+        self._file.flush()
@@ -0,0 +1,163 @@
+
+import typing
+
+import ptonppl.abstract
+import ptonppl.backends
+import ptonppl.constants
+import ptonppl.health
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "KIND_EMAIL",
+    "KIND_PUID",
+    "KIND_NETID",
+    "Step",
+    "classify",
+    "queries",
+    "estimate_cost",
+    "plan",
+]
+
+
+# Kinds of values that can be searched
+
+KIND_EMAIL = "email"
+KIND_PUID = "puid"
+KIND_NETID = "netid or alias"
+
+
+def classify(value: str) -> str:
+    if "@" in value:
+        return KIND_EMAIL
+
+    if value.isdigit() and len(value) > 6:
+        return KIND_PUID
+
+    return KIND_NETID
+
+
+def queries(value: str) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Return the `(ldap_field, value)` searches that may find `value`, by
+    order of preference, without duplicates.
+    """
+
+    kind = classify(value)
+
+    if kind == KIND_PUID:
+        candidates = [("universityid", value)]
+
+    else:
+        # the local part of an email address may be an alias or a NetID
+        netid = value.split("@")[0]
+
+        candidates = [("mail", value)] if kind == KIND_EMAIL else []
+        candidates += [
+            ("uid", netid),
+            ("mail", ptonppl.constants.WEBDIR_EMAIL_FROM_NETID.format(netid)),
+        ]
+
+    result = []
+    seen = set()
+
+    for (ldap_field, query_value) in candidates:
+        key = (ldap_field, ptonppl.abstract.normalize_identifier(query_value))
+        if key not in seen:
+            seen.add(key)
+            result.append((ldap_field, query_value))
+
+    return result
+
+
+def estimate_cost(backend: ptonppl.backends.Backend) -> float:
+    """
+    Expected duration of a search on `backend`: its observed average
+    latency, once there have been enough searches, or its declared cost.
+    """
+    stats = ptonppl.health.registry.get(backend.name).stats
+
+    if stats["calls"] >= ptonppl.constants.PLANNER_MIN_OBSERVATIONS and stats["latency"] is not None:
+        return stats["latency"]
+
+    return backend.cost
+
+
+class Step:
+    """
+    Search of `value` in `ldap_field` on `backend`, as part of a plan.
+    """
+
+    def __init__(
+            self,
+            backend: ptonppl.backends.Backend,
+            ldap_field: str,
+            value: str,
+            cost: float,
+    ):
+        self._backend = backend
+        self._ldap_field = ldap_field
+        self._value = value
+        self._cost = cost
+
+    @property
+    def backend(self) -> ptonppl.backends.Backend:
+        return self._backend
+
+    @property
+    def ldap_field(self) -> str:
+        return self._ldap_field
+
+    @property
+    def value(self) -> str:
+        return self._value
+
+    @property
+    def cost(self) -> float:
+        return self._cost
+
+    def useful(self, obj: typing.Optional[ptonppl.abstract.AbstractPtonPerson]) -> bool:
+        """
+        Whether this step may provide some of the fields that `obj` is
+        missing to be complete.
+        """
+        if obj is None:
+            return True
+
+        missing = {
+            field
+            for field in ["puid", "netid", "email"]
+            if getattr(obj, field) is None
+        }
+
+        return len(missing & self._backend.attributes) > 0
+
+    def run(self) -> typing.Optional[ptonppl.abstract.AbstractPtonPerson]:
+        return self._backend.search(self._ldap_field, self._value)
+
+    def __str__(self) -> str:
+        return "{} {}={}".format(self._backend.name, self._ldap_field, self._value)
+
+
+def plan(value: str) -> typing.List[Step]:
+    """
+    Plan the search of `value`: every search (see `queries`) on every
+    backend that supports it, cheapest backend first.
+    """
+
+    # (sorting is stable, so equally costly backends keep their order of
+    # registration)
+    backends = sorted(
+        [(estimate_cost(backend), backend) for backend in ptonppl.backends.registry.values()],
+        key=lambda pair: pair[0],
+    )
+
+    steps = []
+
+    for (cost, backend) in backends:
+        for (ldap_field, query_value) in queries(value):
+            if backend.can_search(ldap_field):
+                steps.append(Step(backend=backend, ldap_field=ldap_field, value=query_value, cost=cost))
+
+    return steps
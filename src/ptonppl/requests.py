@@ -2,6 +2,8 @@
 import requests.adapters
 import requests.packages.urllib3.util.retry
 
+import ptonppl.metrics
+
 
 # should be __copy_paster__ = ... :-)
 __author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
@@ -36,7 +38,18 @@ class TimeoutHTTPAdapter(requests.adapters.HTTPAdapter):
         return super().send(request, **kwargs)
 
 
-retry_strategy = requests.packages.urllib3.util.retry.Retry(
+class CountingRetry(requests.packages.urllib3.util.retry.Retry):
+    """
+    Retry strategy that counts the retries in the metrics.
+    """
+
+    def increment(self, *args, **kwargs):
+        new_retry = super().increment(*args, **kwargs)
+        ptonppl.metrics.record(backend="http", outcome=ptonppl.metrics.RETRY)
+        return new_retry
+
+
+retry_strategy = CountingRetry(
     total=DEFAULT_RETRY,
     status_forcelist=[429, 500, 502, 503, 504],
     method_whitelist=["HEAD", "GET", "OPTIONS"],
@@ -51,4 +64,8 @@ session.mount("http://", adapter)
 
 
 def get(*args, **kwargs):
-    return session.get(*args, **kwargs)
+    with ptonppl.metrics.measure("http") as measurement:
+        r = session.get(*args, **kwargs)
+        measurement.outcome = ptonppl.metrics.HIT if r.ok else ptonppl.metrics.MISS
+
+    return r
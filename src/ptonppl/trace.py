@@ -0,0 +1,39 @@
+
+import json
+import threading
+import typing
+
+
+__author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
+
+__all__ = [
+    "Tracer",
+]
+
+
+class Tracer:
+    """
+    Writes the trace of each search (see `ptonppl.control.search`) to
+    `file`, as one line of JSON per query, which can be written to from
+    concurrent searches.
+    """
+
+    def __init__(self, file: typing.TextIO):
+        self._file = file
+        self._lock = threading.Lock()
+        self._count = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def emit(self, record: typing.Dict[str, typing.Any]):
+        line = json.dumps(record)
+
+        with self._lock:
+            self._file.write(line + "\n")
+
+            # each line is flushed, so that the trace of a job that is
+            # interrupted (or still running) can be analyzed
+            self._file.flush()
+            self._count += 1
@@ -1,17 +1,22 @@
 
+import importlib.util
 import typing
 
 import bs4
 
+import ptonppl.abstract
+import ptonppl.cache
 import ptonppl.constants
 import ptonppl.ldap
+import ptonppl.metrics
 import ptonppl.requests
 
 
 __author__ = "Jérémie Lumbroso <lumbroso@cs.princeton.edu>"
 
 __all__ = [
-    "search_one"
+    "harvest_index",
+    "search_one",
 ]
 
 
@@ -22,9 +27,44 @@ CLASS_RESULTS_BLOCK2 = "bordered"
 CLASS_RESULTS_ROW = "row"
 CLASS_RESULTS_DETAILS = "expanded-details-value"
 
+# Labels (of `h4` headers) and class names of the fields in a result row,
+# mapped to the LDAP attribute that they correspond to
+
+RESULT_HEADER_FIELDS = {
+    "NetID": "uid",
+    "University ID": "universityid",
+    "Office Location": "street",
+    "Interoffice Address": "puinterofficeaddress",
+}
+
+RESULT_INLINE_FIELDS = {
+    "title": "title",
+    "people-search-email": "mail",
+    "people-search-result-phone": "telephoneNumber",
+    "people-search-result-name": "pudisplayname",
+    "people-search-result-department": "ou",
+}
+
+# `lxml` is much faster than BeautifulSoup and the pure-Python parser of the
+# standard library, but it is an optional dependency, so only use it if it
+# is installed
+
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") is not None else "html.parser"
+
+# XPath condition selecting the elements that have a given class
+XPATH_HAS_CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+
+
+# Index of the people listed on the results pages fetched so far: as a page
+# (especially that of a "begins with" email search) may list several people,
+# all of them are indexed, so that later searches for any of them can be
+# answered without a request. Harvesting is disabled unless this is set to
+# a `ptonppl.cache.MemoryCache`.
+
+harvest_index: typing.Optional[ptonppl.cache.MemoryCache] = None
 
-# noinspection PyBroadException
-def _fetch_raw_results(url: str) -> typing.Optional[typing.List[bs4.element.Tag]]:
+
+def _fetch_content(url: str) -> typing.Optional[bytes]:
 
     # not a valid URL
     if url is None or type(url) is not str or len(url) == 0 or "http" not in url:
@@ -35,8 +75,14 @@ def _fetch_raw_results(url: str) -> typing.Optional[typing.List[bs4.element.Tag]
     if not r.ok:
         return
 
+    return r.content
+
+
+# noinspection PyBroadException
+def _parse_raw_results(content: bytes) -> typing.Optional[typing.List[bs4.element.Tag]]:
+
     # parse using BeautifulSoup
-    s = bs4.BeautifulSoup(r.content, features="html.parser")
+    s = bs4.BeautifulSoup(content, features="html.parser")
     if s is None:
         return
 
@@ -94,30 +140,21 @@ def _parse_result(obj: bs4.element.Tag) -> typing.Dict[str, typing.Any]:
 
     r = dict()
 
-    # NOTE: should remove all the hardcoded constants from below perhaps?
-    # or move to constants module
-
-    for header_name, field_name in [
-        ("NetID", "uid"),
-        ("University ID", "universityid"),
-        ("Office Location", "street"),
-        ("Interoffice Address", "puinterofficeaddress"),
-    ]:
+    for header_name, field_name in RESULT_HEADER_FIELDS.items():
         val = _get_header_content(obj=obj, header_name=header_name)
         if val is not None:
             r[field_name] = val
 
-    for class_name, field_name in [
-        ("title", "title"),
-        ("people-search-email", "mail"),
-        ("people-search-result-phone", "telephoneNumber"),
-        ("people-search-result-name", "pudisplayname"),
-        ("people-search-result-department", "ou"),
-    ]:
+    for class_name, field_name in RESULT_INLINE_FIELDS.items():
         val = _get_inline_content(obj=obj, class_name=class_name)
         if val is not None:
             r[field_name] = val
 
+    return _complete_result(r)
+
+
+def _complete_result(r: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+
     if "pudisplayname" in r:
         pudn = r.get("pudisplayname")
         last, first = pudn.split(", ")
@@ -132,6 +169,137 @@ def _parse_result(obj: bs4.element.Tag) -> typing.Dict[str, typing.Any]:
     return r
 
 
+def _parse_result_fast(obj: bs4.element.Tag) -> typing.Dict[str, typing.Any]:
+    """
+    Equivalent of `_parse_result`, which extracts all the fields in a single
+    traversal of the row, instead of one search of the row per field.
+    """
+
+    r = dict()
+    seen = set()
+
+    for tag in obj.find_all(True):
+
+        # only the first header with a given label counts, whether or not
+        # it is followed by a value (as in `_get_header_content`)
+        if tag.name == "h4":
+            field_name = RESULT_HEADER_FIELDS.get(tag.string)
+            if field_name is not None and field_name not in seen:
+                seen.add(field_name)
+                tag_value = tag.find_next_sibling("span", attrs={"class": CLASS_RESULTS_DETAILS})
+                if tag_value is not None:
+                    r[field_name] = ("".join(tag_value.stripped_strings) or "").strip()
+
+        for class_name in tag.get("class") or []:
+            field_name = RESULT_INLINE_FIELDS.get(class_name)
+            if field_name is not None and field_name not in seen:
+                seen.add(field_name)
+                r[field_name] = ("".join(tag.stripped_strings) or "").strip()
+
+    return _complete_result(r)
+
+
+def _lxml_text(obj) -> str:
+    # equivalent of `"".join(obj.stripped_strings)` for an `lxml` element
+    return "".join(
+        text.strip()
+        for text in obj.xpath(".//text()[not(parent::comment())]")
+    ).strip()
+
+
+def _parse_result_lxml(obj) -> typing.Dict[str, typing.Any]:
+    """
+    Equivalent of `_parse_result_fast` for a row parsed by `lxml`.
+    """
+
+    r = dict()
+    seen = set()
+
+    for tag in obj.iterdescendants():
+
+        # skip comments and processing instructions
+        if type(tag.tag) is not str:
+            continue
+
+        if tag.tag == "h4" and len(tag) == 0:
+            field_name = RESULT_HEADER_FIELDS.get(tag.text)
+            if field_name is not None and field_name not in seen:
+                seen.add(field_name)
+                tag_value = tag.xpath(
+                    "following-sibling::span[{}][1]".format(XPATH_HAS_CLASS.format(CLASS_RESULTS_DETAILS)))
+                if len(tag_value) > 0:
+                    r[field_name] = _lxml_text(tag_value[0])
+
+        for class_name in (tag.get("class") or "").split():
+            field_name = RESULT_INLINE_FIELDS.get(class_name)
+            if field_name is not None and field_name not in seen:
+                seen.add(field_name)
+                r[field_name] = _lxml_text(tag)
+
+    return _complete_result(r)
+
+
+def _parse_results_lxml(content: bytes) -> typing.Optional[typing.List[typing.Dict[str, typing.Any]]]:
+    import lxml.html
+
+    root = lxml.html.fromstring(content)
+
+    # get the subtree of the DOM containing results
+    b = root.xpath("(//div[{block1}])[1]/descendant::div[{block2}][1]".format(
+        block1=XPATH_HAS_CLASS.format(CLASS_RESULTS_BLOCK1),
+        block2=XPATH_HAS_CLASS.format(CLASS_RESULTS_BLOCK2),
+    ))
+    if len(b) == 0:
+        return
+
+    rows = b[0].xpath(".//div[{}]".format(XPATH_HAS_CLASS.format(CLASS_RESULTS_ROW)))
+
+    return list(map(_parse_result_lxml, rows))
+
+
+def _parse_results_fast(content: bytes) -> typing.Optional[typing.List[typing.Dict[str, typing.Any]]]:
+    """
+    Extract the results of a campus directory page, with `lxml` if it is
+    installed; otherwise, building a tree only for the block of results
+    (rather than the whole page, most of which is navigation and
+    boilerplate).
+    """
+
+    if HTML_PARSER == "lxml":
+        return _parse_results_lxml(content)
+
+    s = bs4.BeautifulSoup(
+        content,
+        features=HTML_PARSER,
+        parse_only=bs4.SoupStrainer("div", attrs={"class": CLASS_RESULTS_BLOCK1}),
+    )
+
+    b = s.find("div", attrs={"class": CLASS_RESULTS_BLOCK1})
+    if b is None:
+        return
+    b = b.find("div", attrs={"class": CLASS_RESULTS_BLOCK2})
+    if b is None:
+        return
+
+    return list(map(_parse_result_fast, b.find_all("div", attrs={"class": CLASS_RESULTS_ROW})))
+
+
+# noinspection PyBroadException
+def _parse_results(content: bytes) -> typing.Optional[typing.List[typing.Dict[str, typing.Any]]]:
+
+    try:
+        return _parse_results_fast(content)
+    except Exception:
+        pass
+
+    # fall back to parsing the whole page, if anything went wrong
+    raw_results = _parse_raw_results(content)
+    if raw_results is None:
+        return
+
+    return list(map(_parse_result, raw_results))
+
+
 def search_one(
         field: str,
         value: str,
@@ -151,13 +319,36 @@ def search_one(
         raise ValueError(
             "unrecognized field: {}  (choices are 'mail', 'uid')".format(field))
 
+    index = harvest_index
+
+    if index is not None:
+        obj = index.get(value)
+        if obj is not None:
+            ptonppl.metrics.record(backend="webdir", outcome=ptonppl.metrics.CACHED)
+            return obj
+
     url = url_pattern.format(value)
 
-    raw_results = _fetch_raw_results(url=url)
-    if raw_results is None:
-        return
+    with ptonppl.metrics.measure("webdir") as measurement:
+        content = _fetch_content(url=url)
+        results = _parse_results(content) if content is not None else None
 
-    results = list(map(_parse_result, raw_results))
+        if results is None or len(results) == 0:
+            measurement.outcome = ptonppl.metrics.MISS if content is not None else ptonppl.metrics.ERROR
+            return
 
-    if results is not None and len(results) > 0:
+    if index is None:
         return ptonppl.ldap.LdapPtonPerson(ldap_result=results[0])
+
+    objs = [ptonppl.ldap.LdapPtonPerson(ldap_result=result) for result in results]
+
+    for obj in objs:
+        index.put(obj)
+
+    # prefer the row of the person that was searched, if it is on the page
+    identifier = ptonppl.abstract.normalize_identifier(value)
+    for obj in objs:
+        if identifier in obj.identifiers:
+            return obj
+
+    return objs[0]
@@ -0,0 +1,68 @@
+import typing
+
+import pytest
+
+import ptonppl.abstract
+import ptonppl.backends
+import ptonppl.cache
+import ptonppl.health
+import ptonppl.ldap
+import ptonppl.ldapcmd
+
+
+@pytest.fixture(autouse=True)
+def _isolated_state(monkeypatch):
+    # (the records cached, and the latencies and failures observed, by one
+    # test do not affect the searches, or the plans, of the next ones)
+    monkeypatch.setattr(ptonppl.cache, "memory_cache", ptonppl.cache.MemoryCache())
+    monkeypatch.setattr(ptonppl.health, "registry", ptonppl.health.HealthRegistry())
+
+
+class FakeBackends:
+    """
+    Backends of `ptonppl.control`, replaced by those the test registers;
+    batched searches find nothing (so that each value goes through the
+    cascade), unless `search_batch` is given.
+    """
+
+    def __init__(self, monkeypatch):
+        self._monkeypatch = monkeypatch
+
+        monkeypatch.setattr(ptonppl.backends, "registry", dict())
+        monkeypatch.setattr(ptonppl.ldap, "search_batch", lambda **kwargs: dict())
+        monkeypatch.setattr(ptonppl.ldapcmd, "search_batch", lambda **kwargs: dict())
+
+    def search_batch(self, ldap: typing.Callable[..., typing.Dict[str, typing.Any]]):
+        self._monkeypatch.setattr(ptonppl.ldap, "search_batch", ldap)
+
+    def register(
+            self,
+            name: str,
+            search: typing.Callable[[str, str], typing.Any],
+            cost: float = 0.01,
+            attributes: typing.Iterable[str] = ("puid", "netid", "email"),
+    ):
+        ptonppl.backends.register(ptonppl.backends.Backend(
+            name=name, search=search, fields={"uid": "uid"},
+            attributes=attributes, cost=cost))
+
+    @staticmethod
+    def person(netid: str, **fields: typing.Any) -> ptonppl.abstract.AbstractPtonPerson:
+        """
+        Complete record of `netid`, unless some of its `fields` are given
+        (as `None`, to leave them out).
+        """
+        record = {
+            "puid": "912345678",
+            "netid": netid,
+            "email": "{}@princeton.edu".format(netid),
+        }
+        record.update(fields)
+
+        return ptonppl.abstract.AbstractPtonPerson.from_dict({
+            name: value for (name, value) in record.items() if value is not None})
+
+
+@pytest.fixture
+def backends(monkeypatch) -> FakeBackends:
+    return FakeBackends(monkeypatch=monkeypatch)
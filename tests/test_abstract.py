@@ -0,0 +1,89 @@
+
+import copy
+
+import pytest
+
+import ptonppl.abstract
+
+
+def _person(original, **kwargs):
+    return ptonppl.abstract.AbstractPtonPerson(original=original, **kwargs)
+
+
+def test_merge_shares_originals():
+    first = _person({"uid": [b"jdoe"], "cn": [b"John Doe"]}, netid="jdoe")
+    second = _person({"uid": [b"other"], "universityid": [b"912345678"]}, puid="912345678", netid="other")
+
+    merged = first.merge(second)
+
+    # the fields (and attributes) of the first record take precedence
+    assert (merged.netid, merged.puid) == ("jdoe", "912345678")
+    assert merged.original["uid"] == [b"jdoe"]
+    assert merged.original["universityid"] == [b"912345678"]
+
+    # neither record is modified
+    assert first.puid is None
+    assert "universityid" not in first.original
+
+
+def test_original_and_as_dict_are_protected():
+    obj = _person({"uid": [b"jdoe"]}, netid="jdoe", email="jdoe@princeton.edu")
+
+    original = obj.original
+    original["uid"].append(b"other")
+    assert obj.original == {"uid": [b"jdoe"]}
+
+    record = obj.as_dict
+    record["netid"] = "other"
+    assert obj.as_dict == {"netid": "jdoe", "email": "jdoe@princeton.edu"}
+
+
+def test_records_are_immutable():
+    obj = _person({"uid": [b"jdoe"]}, netid="jdoe", email="jdoe@princeton.edu")
+    assert obj.as_dict["netid"] == "jdoe"
+
+    with pytest.raises(AttributeError):
+        obj._netid = "other"
+
+    with pytest.raises(AttributeError):
+        del obj._email
+
+    with pytest.raises(AttributeError):
+        obj.nickname = "jd"
+
+    assert obj.as_dict == {"netid": "jdoe", "email": "jdoe@princeton.edu"}
+
+    # (copies are rebuilt, rather than modified field by field)
+    duplicate = copy.deepcopy(obj)
+    assert duplicate.as_dict == obj.as_dict
+    assert duplicate.original == {"uid": [b"jdoe"]}
+
+    with pytest.raises(AttributeError):
+        duplicate._netid = "other"
+
+
+def test_subclasses_set_fields_while_built():
+
+    class _Partial(ptonppl.abstract.AbstractPtonPerson):
+        __slots__ = ()
+
+        def __init__(self, netid):
+            self._netid = netid
+
+    class _Further(_Partial):
+        __slots__ = ()
+
+        def __init__(self, netid, email):
+            super().__init__(netid=netid)
+            self._email = email
+
+    obj = _Further(netid="jdoe", email="jdoe@princeton.edu")
+
+    # (the fields that were not set are missing)
+    assert obj.as_dict == {"netid": "jdoe", "email": "jdoe@princeton.edu"}
+
+    # once built, the records are immutable, as are those of their merges
+    for record in [obj, _Partial(netid="jdoe"), obj.merge(obj), copy.copy(obj)]:
+        assert type(record).__name__ in ["_Partial", "_Further"]
+        with pytest.raises(AttributeError):
+            record._puid = "912345678"
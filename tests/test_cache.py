@@ -0,0 +1,67 @@
+import ptonppl.abstract
+import ptonppl.cache
+
+
+def _person():
+    return ptonppl.abstract.AbstractPtonPerson.from_dict({
+        "puid": "912345678",
+        "netid": "jdoe",
+        "alias": "john.doe",
+        "email": "john.doe@princeton.edu",
+        "type": "faculty",
+        "name": "John Doe",
+    })
+
+
+def test_persistent_cache_all_identifiers(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    with ptonppl.cache.PersistentCache(path=path) as cache:
+        cache.put(_person())
+
+    with ptonppl.cache.PersistentCache(path=path) as cache:
+        for value in ["912345678", "jdoe", "JDoe@Princeton.EDU", "john.doe", "john.doe@princeton.edu"]:
+            obj = cache.get(value)
+            assert obj is not None
+            assert obj.as_dict == _person().as_dict
+
+        assert cache.get("someone.else") is None
+
+
+def test_persistent_cache_ttl(tmp_path):
+    with ptonppl.cache.PersistentCache(path=str(tmp_path / "cache.db"), ttl=0) as cache:
+        cache.put(_person())
+        assert cache.get("jdoe") is None
+        assert cache.purge() == 1
+
+
+def test_memory_cache_lru_and_negative():
+    cache = ptonppl.cache.MemoryCache(maxsize=6, negative_ttl=60)
+
+    cache.put(_person())
+    assert cache.get("John.Doe@princeton.edu").netid == "jdoe"
+
+    # a value cached as not found is distinct from a value not cached
+    cache.put_missing("nobody")
+    assert cache.get("nobody", default="miss") is None
+    assert cache.get("somebody", default="miss") == "miss"
+
+    # the least recently used identifiers of the record make room
+    cache.put_missing("nobody2")
+    assert len(cache) == 6
+    assert cache.stats["evictions"] == 1
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 1
+
+
+def test_recent_set_is_bounded():
+    seen = ptonppl.cache.RecentSet(maxsize=2)
+
+    assert seen.add("a")
+    assert seen.add("b")
+    assert not seen.add("a")
+
+    # "b" is the least recently seen, and is forgotten first
+    assert seen.add("c")
+    assert len(seen) == 2
+    assert "a" in seen and "b" not in seen
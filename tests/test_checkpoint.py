@@ -0,0 +1,126 @@
+import ptonppl.abstract
+import ptonppl.cache
+import ptonppl.checkpoint
+import ptonppl.control
+import ptonppl.health
+
+
+def _lookup(searched):
+    def lookup(values):
+        for value in values:
+            searched.append(value)
+            if value.startswith("nobody"):
+                yield (value, None)
+            else:
+                yield (value, ptonppl.abstract.AbstractPtonPerson.from_dict({
+                    "netid": value, "email": "{}@princeton.edu".format(value)}))
+    return lookup
+
+
+def test_checkpoint_resumes_completed_queries(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    values = ["jdoe", "nobody", "asmith", "bjones"]
+
+    # interrupted after two queries, and while recording the third
+    searched = []
+    checkpoint = ptonppl.checkpoint.Checkpoint(path=path)
+    results = checkpoint.resume(values=values, lookup=_lookup(searched))
+    assert [value for (value, _) in [next(results), next(results)]] == ["jdoe", "nobody"]
+    checkpoint.close()
+
+    with open(path, "a") as f:
+        f.write('{"query": "asm')
+
+    searched = []
+    checkpoint = ptonppl.checkpoint.Checkpoint(path=path)
+    results = dict(checkpoint.resume(values=values, lookup=_lookup(searched)))
+    checkpoint.close()
+
+    assert searched == ["asmith", "bjones"]
+    assert results["jdoe"].email == "jdoe@princeton.edu"
+    assert results["nobody"] is None
+    assert set(results) == set(values)
+    assert (checkpoint.resumed, checkpoint.recorded, checkpoint.completed) == (2, 2, 4)
+
+    # nothing is left to search
+    searched = []
+    checkpoint = ptonppl.checkpoint.Checkpoint(path=path)
+    assert len(list(checkpoint.resume(values=values, lookup=_lookup(searched)))) == 4
+    checkpoint.close()
+
+    assert searched == []
+
+
+def test_checkpoint_resumes_in_input_order(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    values = ["user{}".format(i) for i in range(8)]
+
+    checkpoint = ptonppl.checkpoint.Checkpoint(path=path)
+    for value in values[1::3]:
+        checkpoint.record(value, None)
+    checkpoint.close()
+
+    def lookup(values):
+        # (reads ahead of its output, as do the lookups of `ptonppl.control`)
+        values = list(values)
+        return _lookup([])(values)
+
+    # the results answered from the checkpoint are interleaved with the
+    # others, as in an uninterrupted run
+    checkpoint = ptonppl.checkpoint.Checkpoint(path=path)
+    results = list(checkpoint.resume(values=values, lookup=lookup))
+    checkpoint.close()
+
+    assert [value for (value, _) in results] == values
+    assert [obj is None for (_, obj) in results] == [i % 3 == 1 for i in range(8)]
+    assert (checkpoint.resumed, checkpoint.recorded) == (3, 5)
+
+
+def test_checkpoint_leaves_failed_queries_pending(backends, tmp_path, monkeypatch):
+    path = str(tmp_path / "checkpoint.jsonl")
+    values = ["jdoe", "nobody", "asmith"]
+
+    outage = {"down": True}
+    searched = []
+
+    def search(field, value):
+        if outage["down"]:
+            raise OSError("the server cannot be reached")
+        searched.append(value)
+        if value != "nobody":
+            return backends.person(value, puid="9{:08d}".format(len(value)))
+
+    backends.register(name="flaky", search=search)
+
+    def run():
+        # (as would a new process, with every circuit closed, and nothing
+        # cached in memory)
+        monkeypatch.setattr(ptonppl.health, "registry", ptonppl.health.HealthRegistry())
+        monkeypatch.setattr(ptonppl.cache, "memory_cache", ptonppl.cache.MemoryCache())
+        failures = set()
+        checkpoint = ptonppl.checkpoint.Checkpoint(path=path)
+        results = dict(checkpoint.resume(
+            values=values,
+            lookup=lambda values: ptonppl.control.search_batch(values=values, failures=failures),
+            failures=failures))
+        checkpoint.close()
+        return checkpoint, results
+
+    # every lookup fails (or is skipped, once the circuit is open)
+    (checkpoint, results) = run()
+    assert results == {value: None for value in values}
+    assert (checkpoint.recorded, checkpoint.failed) == (0, 3)
+
+    # nothing was completed (and failures are not cached): everything is
+    # searched again
+    outage["down"] = False
+    (checkpoint, results) = run()
+    assert searched == values
+    assert results["nobody"] is None and results["asmith"].netid == "asmith"
+    assert (checkpoint.resumed, checkpoint.recorded, checkpoint.failed) == (0, 3, 0)
+
+    # a value that does not exist is a completed lookup
+    searched.clear()
+    (checkpoint, results) = run()
+    assert searched == []
+    assert (checkpoint.resumed, checkpoint.recorded) == (3, 0)
@@ -0,0 +1,214 @@
+
+import collections
+import threading
+import time
+
+import ptonppl.cache
+import ptonppl.constants
+import ptonppl.control
+import ptonppl.executors
+
+
+def test_identifiers_of_a_person_are_searched_once(backends):
+    searches = []
+
+    def search(field, value):
+        searches.append((field, value))
+        if value == "jdoe":
+            return backends.person("jdoe", email="john.doe@princeton.edu")
+
+    # (batched searches find nothing, so that each value goes to `search`)
+    backends.register(name="fake", search=search)
+
+    values = ["jdoe", "JDoe", "jdoe@princeton.edu", "John.Doe@princeton.edu", "912345678"]
+
+    results = list(ptonppl.control.search_batch(values=values))
+
+    assert [value for (value, _) in results] == values
+    assert {obj.netid for (_, obj) in results} == {"jdoe"}
+    assert searches == [("uid", "jdoe")]
+
+    # concurrent lookups of the same value wait for the same search (other
+    # identifiers may be searched concurrently, before it is known that
+    # they are those of the same person)
+    ptonppl.cache.memory_cache.clear()
+    searches.clear()
+
+    results = list(ptonppl.control.search_many(values=["jdoe", "JDoe", "JDOE"], workers=4))
+
+    assert {obj.netid for (_, obj) in results} == {"jdoe"}
+    assert searches == [("uid", "jdoe")]
+
+
+def test_duplicates_are_searched_once_without_memory_cache(backends, monkeypatch):
+    searches = []
+    batched = []
+
+    def search(field, value):
+        searches.append((field, value))
+        return backends.person(value)
+
+    def search_batch(ldap_field, ldap_values, chunk_size=None):
+        batched.extend(ldap_values)
+        return {
+            value: search(field=ldap_field, value=value)
+            for value in ldap_values
+            if ldap_field == "uid" and value == "jdoe"
+        }
+
+    backends.search_batch(ldap=search_batch)
+    backends.register(name="fake", search=search)
+    monkeypatch.setattr(ptonppl.cache, "memory_cache", None)
+
+    # ("jdoe" is found by the batched search, "asmith" by the cascade)
+    values = ["jdoe", "JDoe", "asmith", "JDOE", "ASmith"]
+
+    results = list(ptonppl.control.search_batch(values=values))
+
+    assert [value for (value, _) in results] == values
+    assert [obj.netid for (_, obj) in results] == ["jdoe", "jdoe", "asmith", "jdoe", "asmith"]
+    assert {"JDoe", "JDOE", "ASmith"}.isdisjoint(batched)
+    assert len(batched) == len(set(batched))
+    assert searches == [("uid", "jdoe"), ("uid", "asmith")]
+
+
+def _install_hedging(backends, monkeypatch, slow):
+    monkeypatch.setattr(ptonppl.cache, "memory_cache", None)
+    monkeypatch.setattr(ptonppl.control, "_backend_semaphores", dict())
+    monkeypatch.setattr(ptonppl.control, "_abandoned", collections.Counter())
+    monkeypatch.setattr(ptonppl.executors, "_executors", dict())
+    monkeypatch.setattr(ptonppl.constants, "BACKEND_MAX_CONCURRENCY", {"slow": 2})
+
+    # (the slow backend, which is cheaper, is always tried first)
+    monkeypatch.setattr(ptonppl.constants, "PLANNER_MIN_OBSERVATIONS", float("inf"))
+
+    backends.register(name="slow", search=slow, cost=0.01)
+    backends.register(name="fast", search=lambda field, value: backends.person(value), cost=0.02)
+
+
+def test_hedged_search_returns_fastest_answer(backends, monkeypatch):
+    released = threading.Event()
+
+    def slow(field, value):
+        released.wait(timeout=10)
+        return backends.person("slow", puid=None, email=None)
+
+    _install_hedging(backends, monkeypatch, slow=slow)
+
+    try:
+        reports = []
+        time_start = time.monotonic()
+        obj = ptonppl.control.search(value="jdoe", hedge=0.05, explain=reports)
+
+        assert time.monotonic() - time_start < 5
+        assert obj.netid == "jdoe"
+        assert [(report["backend"], report["outcome"]) for report in reports] == [
+            ("slow", "pending"), ("fast", "found")]
+        assert reports[1]["complete"]
+
+    finally:
+        released.set()
+
+
+def test_hung_backend_does_not_exhaust_hedging(backends, monkeypatch):
+    released = threading.Event()
+    calls = []
+
+    def hung(field, value):
+        calls.append(value)
+        released.wait(timeout=10)
+
+    _install_hedging(backends, monkeypatch, slow=hung)
+
+    try:
+        # (more searches than there are threads for hedged attempts)
+        count = ptonppl.constants.HEDGE_MAX_WORKERS + 8
+        time_start = time.monotonic()
+        for i in range(count):
+            reports = []
+            obj = ptonppl.control.search(value="jdoe{}".format(i), hedge=0.01, explain=reports)
+            assert obj.netid == "jdoe{}".format(i)
+
+        # once its slots are all held by attempts that were left running,
+        # the hung backend is skipped
+        assert time.monotonic() - time_start < 5
+        assert len(calls) == 2
+        assert reports[0]["outcome"] == "busy"
+
+    finally:
+        released.set()
+
+
+def test_search_many_yields_results_in_input_order(backends):
+    values = ["user{}".format(i) for i in range(8)]
+    answered = []
+    running = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def search(field, value):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+
+        # (the first values are answered last)
+        time.sleep(0.02 * (len(values) - values.index(value)))
+
+        with lock:
+            running["now"] -= 1
+            answered.append(value)
+        return backends.person(value)
+
+    backends.register(name="fake", search=search)
+
+    results = list(ptonppl.control.search_many(values=values, workers=4, chunk_size=4))
+
+    assert running["max"] > 1
+    assert answered != values
+    assert [value for (value, _) in results] == values
+    assert [obj.netid for (_, obj) in results] == values
+
+
+def test_incomplete_records_are_not_cached_when_a_backend_failed(backends, tmp_path):
+    calls = []
+
+    def down(field, value):
+        calls.append("down")
+        raise OSError("the server cannot be reached")
+
+    def partial(field, value):
+        calls.append("partial")
+        return backends.person(value, email=None)
+
+    def search_batch(ldap_field, ldap_values, chunk_size=None):
+        return {
+            value: backends.person(value, puid=None)
+            for value in ldap_values
+            if ldap_field == "uid" and value == "asmith"
+        }
+
+    backends.search_batch(ldap=search_batch)
+    backends.register(name="down", search=down, cost=0.01)
+    backends.register(name="partial", search=partial, cost=0.02)
+
+    cache = ptonppl.cache.PersistentCache(path=str(tmp_path / "cache.sqlite"))
+
+    # the record may be incomplete because a backend failed: it is not
+    # cached, so that the next search tries the backends again
+    for _ in range(2):
+        calls.clear()
+        failures = set()
+        obj = ptonppl.control.search(value="jdoe", cache=cache, failures=failures)
+
+        assert (obj.netid, obj.email) == ("jdoe", None)
+        assert failures == {"jdoe"}
+        assert "partial" in calls
+        assert cache.get("jdoe") is None
+
+    # the record of the batch is completed by (merged with) that of the
+    # backends, rather than replaced by it
+    failures = set()
+    ((_, obj),) = ptonppl.control.search_batch(values=["asmith"], cache=cache, failures=failures)
+
+    assert (obj.puid, obj.netid, obj.email) == ("912345678", "asmith", "asmith@princeton.edu")
+    assert failures == set()
+    assert cache.get("asmith").email == "asmith@princeton.edu"
@@ -0,0 +1,49 @@
+import ptonppl.health
+
+
+def test_circuit_opens_after_consecutive_failures():
+    health = ptonppl.health.BackendHealth(name="webdir", max_consecutive_failures=3, cooldown=60)
+
+    for _ in range(3):
+        assert health.allow()
+        health.failure(latency=1.0)
+
+    assert health.state == ptonppl.health.OPEN
+    assert not health.allow()
+    assert health.stats["rejected"] == 1
+
+
+def test_circuit_opens_on_error_rate():
+    health = ptonppl.health.BackendHealth(
+        name="ldap", window=10, min_calls=10, max_error_rate=0.5,
+        max_consecutive_failures=100, cooldown=60)
+
+    for i in range(10):
+        assert health.allow()
+        if i % 2 == 0:
+            health.success(latency=0.01)
+        else:
+            health.failure(latency=0.01)
+
+    assert health.state == ptonppl.health.OPEN
+
+
+def test_half_open_probe():
+    health = ptonppl.health.BackendHealth(name="ldapcmd", max_consecutive_failures=1, cooldown=0)
+
+    assert health.allow()
+    health.failure(latency=1.0)
+
+    # after the cooldown, a single probe is let through
+    assert health.state == ptonppl.health.HALF_OPEN
+    assert health.allow()
+    assert not health.allow()
+
+    # a failed probe reopens the circuit, a successful one closes it
+    health.failure(latency=1.0)
+    assert health.allow()
+    health.success(latency=0.1)
+
+    assert health.state == ptonppl.health.CLOSED
+    assert health.allow()
+    assert health.allow()
@@ -0,0 +1,54 @@
+import json
+import subprocess
+import sys
+
+
+# Importing `ptonppl` should neither touch the network nor load any of the
+# backends' dependencies, which are only needed once a search is made
+
+LAZY_MODULES = ["ldap", "bs4", "requests", "ptonppl.ldap", "ptonppl.webdir", "ptonppl.ldapcmd"]
+
+# Upper bound on the cumulative import time of `ptonppl` (in microseconds)
+IMPORT_TIME_BUDGET = 250000
+
+
+def _run(code: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+
+def test_import_is_lazy():
+    out = _run(
+        "import json, sys, ptonppl; "
+        "print(json.dumps([m for m in {} if m in sys.modules]))".format(LAZY_MODULES)
+    ).stdout
+
+    assert json.loads(out) == []
+
+
+def test_import_time():
+    err = _run("import ptonppl", "-X", "importtime").stderr
+
+    # lines are of the form "import time: self [us] | cumulative | name"
+    cumulative = {
+        fields[2].strip(): int(fields[1])
+        for fields in (line.split(":", 1)[1].split("|") for line in err.splitlines())
+        if fields[1].strip().isdigit()
+    }
+
+    assert cumulative["ptonppl"] < IMPORT_TIME_BUDGET
+
+
+def test_ldap_constants_are_lazy():
+    out = _run(
+        "import json, sys, ptonppl.constants; "
+        "loaded = 'ldap' in sys.modules; "
+        "print(json.dumps([loaded, ptonppl.constants.LDAP_24_API, 'ldap' in sys.modules]))"
+    ).stdout
+
+    assert json.loads(out) == [False, True, True]
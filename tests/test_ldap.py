@@ -0,0 +1,289 @@
+import re
+import threading
+
+import click.testing
+import ldap
+import ldap.controls
+import pytest
+
+import ptonppl.__main__
+import ptonppl.constants
+import ptonppl.ldap
+
+
+class _FakeConnection:
+    """
+    Stand-in for a connection to the LDAP server, which answers searches
+    from `entries` (filters may only be equalities, or disjunctions of
+    equalities), and logs them.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.searches = []
+        self._results = dict()
+
+    def _matches(self, ldap_filter, entry):
+        if ldap_filter is None:
+            return True
+        if not ldap_filter.startswith("("):
+            ldap_filter = "({})".format(ldap_filter)
+        for (field, value) in re.findall(r"\(([^()|&=]+)=([^()]*)\)", ldap_filter):
+            if value == "*" or value.lower() in [
+                    v.decode("ascii").lower() for v in entry.get(field, [])]:
+                return True
+        return False
+
+    def search_ext(self, base, scope, filterstr=None, attrlist=None, sizelimit=0, **kwargs):
+        self.searches.append({"filter": filterstr, "attrlist": attrlist})
+        msg_id = len(self.searches)
+        self._results[msg_id] = [
+            (dn, {
+                field: values
+                for (field, values) in entry.items()
+                if attrlist is None or field in attrlist
+            })
+            for (dn, entry) in self.entries
+            if self._matches(filterstr, entry)
+        ]
+        return msg_id
+
+    def result(self, msgid, all=1, timeout=None):
+        results = self._results[msgid]
+        if len(results) == 0:
+            return ldap.RES_SEARCH_RESULT, []
+        return ldap.RES_SEARCH_ENTRY, [results.pop(0)]
+
+
+class _FakePool(ptonppl.ldap.ConnectionPool):
+
+    def __init__(self, conn, **kwargs):
+        super().__init__(**kwargs)
+        self._conn = conn
+
+    def _create(self):
+        return self._conn
+
+
+def _entry(netid, puid, name):
+    return (
+        "uid={},o=Princeton University,c=US".format(netid),
+        {
+            "uid": [netid.encode("ascii")],
+            "universityid": [puid.encode("ascii")],
+            "mail": ["{}@princeton.edu".format(netid).encode("ascii")],
+            "cn": [name.encode("ascii")],
+            "pustatus": [b"undergraduate"],
+        },
+    )
+
+
+def _install(monkeypatch, entries):
+    conn = _FakeConnection(entries=entries)
+    monkeypatch.setattr(ptonppl.ldap, "pool", _FakePool(conn=conn))
+    monkeypatch.setattr(ptonppl.ldap, "_ldap_restricted", False)
+    return conn
+
+
+def test_requested_attributes_are_narrowed_to_fields(monkeypatch):
+    conn = _install(monkeypatch, entries=[_entry("jdoe", "912345678", "John Doe")])
+    monkeypatch.setattr(ptonppl.ldap, "_attrlist", ptonppl.ldap._attrlist)
+
+    # the attributes that determine whether a record is complete are
+    # always requested
+    assert ptonppl.ldap.attributes_for_fields(fields=["netid"]) == sorted(
+        ptonppl.constants.LDAP_REQUIRED_ATTRIBUTES)
+    assert "cn" in ptonppl.ldap.attributes_for_fields(fields=["netid", "name"])
+    assert "pustatus" in ptonppl.ldap.attributes_for_fields()
+
+    ptonppl.ldap.set_requested_fields(fields=["puid", "netid"])
+    obj = ptonppl.ldap.search_one(ldap_field="uid", ldap_value="jdoe")
+
+    assert conn.searches[-1]["attrlist"] == sorted(ptonppl.constants.LDAP_REQUIRED_ATTRIBUTES)
+    assert (obj.netid, obj.puid, obj.common_name) == ("jdoe", "912345678", None)
+
+    ptonppl.ldap.set_requested_fields(fields=["puid", "netid"], fetch_all=True)
+    obj = ptonppl.ldap.search_one(ldap_field="uid", ldap_value="jdoe")
+
+    assert conn.searches[-1]["attrlist"] is None
+    assert obj.common_name == "John Doe"
+
+
+def test_search_batch_chunks_values_into_filters(monkeypatch):
+    conn = _install(monkeypatch, entries=[
+        _entry("jdoe", "912345678", "John Doe"),
+        _entry("asmith", "912345679", "Ann Smith"),
+        _entry("bjones", "912345670", "Bob Jones"),
+    ])
+
+    found = ptonppl.ldap.search_batch(
+        ldap_field="uid",
+        ldap_values=["JDoe", "asmith", "nobody", "jdoe", "bjones", "a*b"],
+        chunk_size=3,
+    )
+
+    # one OR-filter per chunk, with each value once (and escaped)
+    assert [search["filter"] for search in conn.searches] == [
+        "(|(uid=jdoe)(uid=asmith)(uid=nobody))",
+        "(|(uid=jdoe)(uid=bjones)(uid=a\\2ab))",
+    ]
+
+    # entries are reported under the spelling of each value searched, and
+    # values that were not found are absent
+    assert sorted(found) == ["JDoe", "asmith", "bjones", "jdoe"]
+    assert found["JDoe"].netid == "jdoe"
+    assert found["bjones"].puid == "912345670"
+
+
+class _CountingPool(ptonppl.ldap.ConnectionPool):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.created = []
+
+    def _create(self):
+        conn = _FakeConnection(entries=[])
+        conn.whoami_s = lambda: ""
+        conn.unbind_s = lambda: setattr(conn, "closed", True)
+        self.created.append(conn)
+        return conn
+
+
+def test_pool_reuses_connections():
+    pool = _CountingPool(size=2)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert len(pool.created) == 1
+
+    # a connection on which the server went down is discarded
+    with pytest.raises(ldap.SERVER_DOWN):
+        with pool.connection() as conn:
+            raise ldap.SERVER_DOWN()
+
+    assert getattr(conn, "closed", False)
+    with pool.connection() as conn:
+        assert conn is not first
+    assert len(pool.created) == 2
+
+    # (other errors do not affect the connection)
+    with pytest.raises(ldap.SIZELIMIT_EXCEEDED):
+        with pool.connection() as other:
+            raise ldap.SIZELIMIT_EXCEEDED()
+    assert other is conn
+
+
+def test_pool_checks_idle_connections():
+    pool = _CountingPool(size=1, check_interval=0)
+
+    with pool.connection() as conn:
+        pass
+
+    def whoami_s():
+        raise ldap.SERVER_DOWN()
+
+    conn.whoami_s = whoami_s
+
+    # the connection, idle for too long, fails its check and is replaced
+    with pool.connection() as other:
+        assert other is not conn
+    assert getattr(conn, "closed", False)
+
+
+def test_pool_is_bounded():
+    pool = _CountingPool(size=2)
+    acquired = threading.Event()
+
+    def acquire():
+        with pool.connection():
+            acquired.set()
+
+    with pool.connection(), pool.connection():
+        thread = threading.Thread(target=acquire)
+        thread.start()
+
+        # no more than `size` connections are handed out at once
+        assert not acquired.wait(timeout=0.1)
+
+    assert acquired.wait(timeout=5)
+    thread.join()
+    assert len(pool.created) == 2
+
+
+class _PagedConnection(_FakeConnection):
+    """
+    Stand-in for a connection that returns the entries in pages, with the
+    Simple Paged Results control.
+    """
+
+    def search_ext(self, base, scope, filterstr=None, attrlist=None, serverctrls=None, **kwargs):
+        msg_id = super().search_ext(base, scope, filterstr=filterstr, attrlist=attrlist)
+
+        (control,) = serverctrls
+        self.searches[-1]["cookie"] = control.cookie
+
+        start = int(control.cookie or "0")
+        end = start + control.size
+        entries = self._results[msg_id]
+
+        self._results[msg_id] = (
+            entries[start:end],
+            str(end).encode("ascii") if end < len(entries) else b"",
+        )
+        return msg_id
+
+    def result3(self, msgid, all=1, timeout=None):
+        (entries, cookie) = self._results.pop(msgid)
+        control = ldap.controls.SimplePagedResultsControl(criticality=True, size=0, cookie=cookie)
+        return ldap.RES_SEARCH_RESULT, entries, msgid, [control]
+
+
+def test_iter_search_follows_pages(monkeypatch):
+    entries = [
+        _entry("user{}".format(i), "9123456{:02d}".format(i), "User {}".format(i))
+        for i in range(7)
+    ]
+    conn = _PagedConnection(entries=entries)
+    monkeypatch.setattr(ptonppl.ldap, "pool", _FakePool(conn=conn))
+    monkeypatch.setattr(ptonppl.ldap, "_attrlist", ptonppl.ldap._attrlist)
+
+    netids = [obj.netid for obj in ptonppl.ldap.iter_search(ldap_filter="(uid=*)", page_size=3)]
+
+    assert netids == ["user{}".format(i) for i in range(7)]
+
+    # each page is requested with the cookie returned with the previous one
+    assert [search["cookie"] for search in conn.searches] == ["", b"3", b"6"]
+
+    # the enumerate command streams the same entries
+    result = click.testing.CliRunner().invoke(
+        ptonppl.__main__.cli, ["enumerate", "(uid=*)", "--page-size", "2", "-t", "csv", "-f", "netid"])
+
+    assert result.exit_code == 0
+    assert result.output.split() == ["netid"] + netids
+    assert len(conn.searches) == 3 + 4
+
+
+def test_failed_probe_is_not_remembered(tmp_path, monkeypatch):
+    conn = _install(monkeypatch, entries=[_entry("jdoe", "912345678", "John Doe")])
+    monkeypatch.setattr(ptonppl.ldap, "_ldap_restricted", None)
+    monkeypatch.setattr(ptonppl.constants, "LDAP_PROBE_CACHE_PATH", str(tmp_path / "ldap-probe.json"))
+    monkeypatch.setattr(ptonppl.constants, "ATTRIBUTES_PUBLIC", ["uid"])
+    monkeypatch.setattr(ptonppl.constants, "ATTRIBUTES_FULL", ["uid", "universityid", "mail", "cn"])
+
+    def result(msgid, all=1, timeout=None):
+        raise ldap.TIMEOUT()
+
+    # (the probe finds no attribute, as the server fails to answer)
+    conn.result = result
+    assert ptonppl.ldap.is_restricted()
+    assert not (tmp_path / "ldap-probe.json").exists()
+
+    # the next call probes again
+    del conn.result
+    assert not ptonppl.ldap.is_restricted()
+    assert (tmp_path / "ldap-probe.json").exists()
+    assert len(conn.searches) == 2
@@ -0,0 +1,171 @@
+
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+import ptonppl.constants
+import ptonppl.ldapcmd
+import ptonppl.requests
+
+
+# Stand-in for `ldapsearch`, which logs its arguments and prints the entries
+# of a tiny directory that match any of the values of the filter
+
+FAKE_LDAPSEARCH = textwrap.dedent("""
+    import re
+    import sys
+
+    with open(sys.argv[1], "a") as f:
+        f.write(" ".join(sys.argv[2:]) + "\\n")
+
+    entries = [
+        {"uid": "jdoe", "mail": "John.Doe@princeton.edu", "universityid": "912345678"},
+        {"uid": "asmith", "mail": "asmith@princeton.edu", "universityid": "987654321"},
+    ]
+
+    wanted = [value.lower() for value in re.findall(r"=([^()]*)\\)", sys.argv[-1])]
+
+    print("# extended LDIF")
+    for entry in entries:
+        if any(value.lower() in wanted for value in entry.values()):
+            print("dn: uid={},o=Princeton University,c=US".format(entry["uid"]))
+            for (field, value) in entry.items():
+                print("{}: {}".format(field, value))
+            print("")
+""")
+
+
+def test_search_batch_single_process(tmp_path):
+    script = tmp_path / "ldapsearch.py"
+    script.write_text(FAKE_LDAPSEARCH)
+    log = tmp_path / "calls.log"
+
+    found = ptonppl.ldapcmd.search_batch(
+        ldap_field="mail",
+        ldap_values=["john.doe@princeton.edu", "asmith@princeton.edu", "nobody@princeton.edu"],
+        local_cmd="{} {} {}".format(sys.executable, script, log),
+    )
+
+    assert sorted(found.keys()) == ["asmith@princeton.edu", "john.doe@princeton.edu"]
+    assert found["john.doe@princeton.edu"].netid == "jdoe"
+    assert found["asmith@princeton.edu"].puid == "987654321"
+
+    calls = log.read_text().splitlines()
+    assert len(calls) == 1
+    assert calls[0].endswith(
+        "(|(mail=john.doe@princeton.edu)(mail=asmith@princeton.edu)(mail=nobody@princeton.edu))")
+
+
+LDIF = """\
+# extended LDIF
+#
+# LDAPv3
+# with a comment that is
+  folded
+
+dn: uid=jdoe,o=Princeton University,c=US
+uid: jdoe
+cn: John
+  Doe
+displayName:: Sm9zw6kgRG9l
+mail: jdoe@princeton.edu
+mail: john.doe@princeton.edu
+
+dn: uid=asmith,o=Princeton University,c=US
+uid: asmith
+
+# search result
+search: 2
+result: 0 Success
+"""
+
+
+def test_iter_ldif():
+    records = list(ptonppl.ldapcmd._iter_ldif(LDIF.splitlines(True)))
+
+    assert records == [
+        {
+            "uid": "jdoe",
+            "cn": "John Doe",
+            "displayname": "José Doe",
+            "mail": ["jdoe@princeton.edu", "john.doe@princeton.edu"],
+        },
+        {
+            "uid": "asmith",
+        },
+    ]
+
+
+def test_iter_ldif_is_incremental():
+    consumed = []
+
+    def _lines():
+        for line in LDIF.splitlines():
+            consumed.append(line)
+            yield line
+
+    records = ptonppl.ldapcmd._iter_ldif(_lines())
+
+    assert next(records)["uid"] == "jdoe"
+    assert len(consumed) < len(LDIF.splitlines())
+
+
+class _FakeResponse:
+    ok = True
+
+    def __init__(self, body: str):
+        self._body = body
+        self.closed = False
+
+    def iter_lines(self):
+        return iter(line.encode("utf-8") for line in self._body.splitlines())
+
+    def close(self):
+        self.closed = True
+
+
+def test_race_returns_first_complete_answer(tmp_path, monkeypatch):
+    script = tmp_path / "ldapsearch.py"
+    script.write_text("import time\ntime.sleep(30)\n")
+
+    response = _FakeResponse(
+        "dn: uid=jdoe,o=Princeton University,c=US\n"
+        "uid: jdoe\n"
+        "universityid: 912345678\n"
+        "mail: jdoe@princeton.edu\n"
+    )
+
+    monkeypatch.setattr(ptonppl.constants, "LDAP_DEFAULT_CMD", "{} {}".format(sys.executable, script))
+    monkeypatch.setattr(ptonppl.requests, "get", lambda *args, **kwargs: response)
+
+    time_start = time.time()
+    obj = ptonppl.ldapcmd.search_one(ldap_field="uid", ldap_value="jdoe")
+
+    assert obj.netid == "jdoe"
+    assert obj.complete
+    assert time.time() - time_start < 10
+    assert response.closed
+
+
+def test_failed_command_is_an_error(tmp_path):
+    # (as an outdated `ldapsearch`, which prints part of the output, then fails)
+    script = tmp_path / "ldapsearch.py"
+    script.write_text(FAKE_LDAPSEARCH + "sys.exit(1)\n")
+    log = tmp_path / "calls.log"
+
+    with pytest.raises(subprocess.CalledProcessError):
+        ptonppl.ldapcmd.search_batch(
+            ldap_field="uid",
+            ldap_values=["jdoe"],
+            local_cmd="{} {} {}".format(sys.executable, script, log),
+        )
+
+    # reading only the beginning of the output is not a failure
+    records = ptonppl.ldapcmd._iter_local_cmd(
+        ldap_filter="(uid=jdoe)",
+        local_cmd="{} {} {}".format(sys.executable, script, log),
+    )
+    assert ptonppl.ldapcmd._first(records)["uid"] == "jdoe"
@@ -0,0 +1,50 @@
+import pytest
+
+import ptonppl.metrics
+
+
+def test_histogram_percentiles():
+    histogram = ptonppl.metrics.Histogram()
+    for i in range(1, 101):
+        histogram.observe(i / 1000)
+
+    # percentiles are upper bounds, within the size of a bucket (25%)
+    for (q, expected) in [(50, 0.050), (95, 0.095), (99, 0.099)]:
+        assert expected <= histogram.percentile(q) <= expected * 1.25
+
+    assert histogram.percentile(100) == pytest.approx(0.1)
+    assert ptonppl.metrics.Histogram().percentile(50) is None
+
+
+def test_registry_snapshot():
+    registry = ptonppl.metrics.MetricsRegistry()
+
+    registry.record(backend="ldap", outcome="hit", latency=0.01)
+    registry.record(backend="ldap", outcome="miss", latency=0.02)
+    registry.record(backend="ldap", outcome="retry")
+    registry.record(backend="webdir", outcome="error", latency=1.5)
+
+    snapshot = registry.snapshot()
+
+    assert snapshot["ldap"]["counts"] == {"hit": 1, "miss": 1, "retry": 1}
+    assert snapshot["ldap"]["latency"]["count"] == 2
+    assert snapshot["ldap"]["latency_by_outcome"]["hit"]["max"] == pytest.approx(0.01)
+    assert snapshot["webdir"]["counts"] == {"error": 1}
+
+
+def test_measure_outcomes(monkeypatch):
+    registry = ptonppl.metrics.MetricsRegistry()
+    monkeypatch.setattr(ptonppl.metrics, "registry", registry)
+
+    class ReadTimeout(Exception):
+        pass
+
+    with ptonppl.metrics.measure("proxy") as measurement:
+        measurement.outcome = ptonppl.metrics.MISS
+
+    for exc in [ReadTimeout(), OSError()]:
+        with pytest.raises(type(exc)):
+            with ptonppl.metrics.measure("proxy"):
+                raise exc
+
+    assert registry.snapshot()["proxy"]["counts"] == {"miss": 1, "timeout": 1, "error": 1}
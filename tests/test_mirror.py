@@ -0,0 +1,120 @@
+
+import re
+import sqlite3
+
+import ptonppl.ldap
+import ptonppl.mirror
+
+
+class _FakeDirectory:
+    """
+    Stand-in for `ptonppl.ldap.iter_search` over `entries`, which only
+    understands the filters of the mirror (the filter of all entries, and
+    the entries modified since a given time), and counts the entries of
+    the mirror at `path` that are committed before each one is yielded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = dict()
+        self.searches = []
+        self.committed = []
+
+    def put(self, netid, puid, modified):
+        self.entries[netid] = {
+            "uid": [netid.encode("ascii")],
+            "universityid": [puid.encode("ascii")],
+            "mail": ["first.last.{}@princeton.edu".format(netid).encode("ascii")],
+            "modifyTimestamp": [modified.encode("ascii")],
+        }
+
+    def iter_search(self, ldap_filter, page_size=None, attrlist=None):
+        self.searches.append(ldap_filter)
+
+        since = re.search(r"\(modifyTimestamp>=([0-9]+Z)\)", ldap_filter)
+
+        for entry in list(self.entries.values()):
+            if since is not None and entry["modifyTimestamp"][0].decode("ascii") < since.group(1):
+                continue
+
+            with sqlite3.connect(self.path) as db:
+                self.committed.append(db.execute("SELECT COUNT(*) FROM entries").fetchone()[0])
+
+            yield ptonppl.ldap.LdapPtonPerson(ldap_result=dict(entry))
+
+
+def test_mirror_sync(tmp_path, monkeypatch):
+    path = str(tmp_path / "mirror.sqlite")
+
+    directory = _FakeDirectory(path=path)
+    for i in range(5):
+        directory.put("user{}".format(i), "91234567{}".format(i), "2024010{}000000Z".format(i + 1))
+    monkeypatch.setattr(ptonppl.ldap, "iter_search", directory.iter_search)
+
+    with ptonppl.mirror.Mirror(path=path) as mirror:
+
+        # the first sync is full (and the filter is completed)
+        stats = mirror.sync(ldap_filter="uid=*", page_size=2)
+        assert (stats["full"], stats["updated"], stats["removed"]) == (True, 5, 0)
+        assert directory.searches[-1] == "(uid=*)"
+
+        # (changes are committed once every page)
+        assert directory.committed == [0, 0, 2, 2, 4]
+
+        assert mirror.get("USER3").puid == "912345673"
+        assert mirror.get("first.last.user3@princeton.edu").netid == "user3"
+
+        # the next ones only request the entries modified since the last one
+        directory.put("user1", "912345671", "20240201000000Z")
+        directory.entries["user1"]["mail"] = [b"new.alias@princeton.edu"]
+        del directory.entries["user4"]
+
+        stats = mirror.sync()
+        assert (stats["full"], stats["updated"], stats["removed"]) == (False, 1, 0)
+        assert directory.searches[-1] == "(&(uid=*)(modifyTimestamp>=20240105000000Z))"
+
+        # (along with the identifiers the entry no longer has)
+        assert mirror.get("new.alias").netid == "user1"
+        assert mirror.get("first.last.user1") is None
+        assert mirror.info["modified"] == "20240201000000Z"
+
+        # entries removed from the directory are only dropped by a full sync
+        assert mirror.get("user4") is not None
+
+        stats = mirror.sync(full=True)
+        assert (stats["full"], stats["updated"], stats["removed"]) == (True, 4, 1)
+        assert mirror.get("user4") is None
+        assert mirror.get("912345674") is None
+        assert mirror.info["entries"] == 4
+
+
+def test_mirror_identifiers_are_not_taken_over(tmp_path, monkeypatch):
+    path = str(tmp_path / "mirror.sqlite")
+
+    directory = _FakeDirectory(path=path)
+    directory.put("bsmith", "912345671", "20240101000000Z")
+    directory.entries["bsmith"]["mail"] = [b"bsmith@princeton.edu", b"jdoe@alumni.princeton.edu"]
+    monkeypatch.setattr(ptonppl.ldap, "iter_search", directory.iter_search)
+
+    with ptonppl.mirror.Mirror(path=path) as mirror:
+        mirror.sync(ldap_filter="uid=*")
+
+        # the local part of an address outside of Princeton is not an alias
+        assert mirror.get("jdoe") is None
+        assert mirror.get("jdoe@alumni.princeton.edu").netid == "bsmith"
+
+        # an identifier claimed by another entry goes to the entry whose
+        # NetID it is, whichever is stored first
+        directory.put("jdoe", "912345672", "20240102000000Z")
+        directory.entries["bsmith"]["mail"].append(b"jdoe@princeton.edu")
+        mirror.sync(full=True)
+
+        assert mirror.get("jdoe").netid == "jdoe"
+        assert mirror.get("jdoe@princeton.edu").netid == "jdoe"
+
+        directory.put("bsmith", "912345671", "20240103000000Z")
+        directory.entries["bsmith"]["mail"] = [b"jdoe@princeton.edu"]
+        mirror.sync()
+
+        assert mirror.get("jdoe").netid == "jdoe"
+        assert mirror.get("bsmith").netid == "bsmith"
@@ -0,0 +1,68 @@
+
+import csv
+import io
+import json
+
+import ptonppl.abstract
+import ptonppl.output
+
+
+def _people():
+    return [
+        ptonppl.abstract.AbstractPtonPerson.from_dict({
+            "puid": "912345678",
+            "netid": "jdoe",
+            "email": "john.doe@princeton.edu",
+            "type": "faculty",
+            "name": 'Doe, John "Jack"',
+        }),
+        ptonppl.abstract.AbstractPtonPerson.from_dict({
+            "puid": "912345679",
+            "netid": "asmith",
+            "email": "asmith@princeton.edu",
+            "name": "Ann Smith",
+        }),
+    ]
+
+
+def _write(type, people, **kwargs) -> str:
+    output = io.StringIO()
+
+    writer = ptonppl.output.RecordWriter(type=type, file=output, **kwargs)
+    writer.prologue()
+    for obj in people:
+        writer.write(obj)
+    writer.epilogue()
+
+    return output.getvalue()
+
+
+def test_json_is_valid():
+    records = [obj.as_dict for obj in _people()]
+
+    assert json.loads(_write("json", _people())) == records
+    assert json.loads(_write("json", [])) == []
+
+    lines = _write("ndjson", _people()).splitlines()
+    assert list(map(json.loads, lines)) == records
+
+
+def test_csv_quotes_cells():
+    output = _write("csv", _people(), fields=["netid", "name", "alias"])
+
+    rows = list(csv.reader(io.StringIO(output)))
+    assert rows == [
+        ["netid", "name", "alias"],
+        ["jdoe", 'Doe, John "Jack"', ""],
+        ["asmith", "Ann Smith", ""],
+    ]
+
+
+def test_needed_fields_include_printed_name():
+    fields = ["puid", "netid", "email"]
+
+    assert ptonppl.output.needed_fields(type="term", fields=fields) == fields + ["name"]
+    assert ptonppl.output.needed_fields(type="term", fields=fields, header=False) == fields
+    assert ptonppl.output.needed_fields(type="emails", fields=["email"]) == ["email", "name"]
+    assert ptonppl.output.needed_fields(type="csv", fields=fields) == fields
+    assert ptonppl.output.needed_fields(type="json", fields=["name", "netid"]) == ["name", "netid"]
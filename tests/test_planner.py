@@ -0,0 +1,39 @@
+import ptonppl.planner
+
+
+def test_classify():
+    assert ptonppl.planner.classify("jdoe@princeton.edu") == ptonppl.planner.KIND_EMAIL
+    assert ptonppl.planner.classify("912345678") == ptonppl.planner.KIND_PUID
+    assert ptonppl.planner.classify("jdoe") == ptonppl.planner.KIND_NETID
+
+
+def test_queries_are_deduplicated():
+    # the alias address of the local part is the address itself
+    assert ptonppl.planner.queries("JDoe@princeton.edu") == [
+        ("mail", "JDoe@princeton.edu"),
+        ("uid", "JDoe"),
+    ]
+
+    assert ptonppl.planner.queries("jdoe") == [
+        ("uid", "jdoe"),
+        ("mail", "jdoe@princeton.edu"),
+    ]
+
+    assert ptonppl.planner.queries("912345678") == [("universityid", "912345678")]
+
+
+def test_plan_cheapest_first():
+    steps = ptonppl.planner.plan("jdoe")
+
+    costs = [step.cost for step in steps]
+    assert costs == sorted(costs)
+
+    # each backend only gets the searches it supports, once
+    descriptions = list(map(str, steps))
+    assert len(descriptions) == len(set(descriptions))
+    assert "webdir uid=jdoe" in descriptions
+
+    assert [str(step) for step in ptonppl.planner.plan("912345678")] == [
+        "ldap universityid=912345678",
+        "ldapcmd universityid=912345678",
+    ]
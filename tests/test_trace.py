@@ -0,0 +1,55 @@
+
+import io
+import json
+
+import ptonppl.abstract
+import ptonppl.control
+import ptonppl.metrics
+import ptonppl.trace
+
+
+class _Person(ptonppl.abstract.AbstractPtonPerson):
+
+    def __init__(self, puid=None, netid=None, email=None):
+        self._puid = puid
+        self._netid = netid
+        self._email = email
+
+
+def _search_partial(field, value):
+    # (as would a backend whose first request was retried)
+    ptonppl.metrics.record(backend="partial", outcome=ptonppl.metrics.RETRY)
+    return _Person(netid=value)
+
+
+def _search_full(field, value):
+    return _Person(puid=912345678, netid=value, email="{}@princeton.edu".format(value))
+
+
+def test_trace_records_attempts(backends):
+    backends.register(name="partial", search=_search_partial, cost=0.01, attributes=["netid"])
+    backends.register(name="full", search=_search_full, cost=0.02)
+
+    output = io.StringIO()
+    tracer = ptonppl.trace.Tracer(file=output)
+
+    obj = ptonppl.control.search(value="tracedoe", tracer=tracer)
+    assert obj.complete
+
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 1
+
+    trace = json.loads(lines[0])
+    assert trace["query"] == "tracedoe"
+    assert trace["outcome"] == "found"
+    assert trace["complete"]
+
+    (first, second) = trace["attempts"]
+
+    assert (first["backend"], first["field"], first["value"]) == ("partial", "uid", "tracedoe")
+    assert first["retries"] == 1
+    assert "complete" not in first
+
+    assert second["backend"] == "full"
+    assert second["retries"] == 0
+    assert second["complete"]
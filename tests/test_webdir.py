@@ -0,0 +1,65 @@
+
+import os
+
+import ptonppl.cache
+import ptonppl.webdir
+
+
+RESULTS_PAGE = os.path.join(os.path.dirname(__file__), "data", "webdir-results.html")
+
+
+def _content() -> bytes:
+    with open(RESULTS_PAGE, "rb") as f:
+        return f.read()
+
+
+def test_fast_extraction_matches_full_parse():
+    content = _content()
+
+    expected = list(map(ptonppl.webdir._parse_result, ptonppl.webdir._parse_raw_results(content)))
+    results = ptonppl.webdir._parse_results_fast(content)
+
+    assert len(expected) > 1
+    assert results == expected
+
+
+def test_fast_extraction_fields():
+    first = ptonppl.webdir._parse_results(_content())[0]
+
+    assert first["uid"] == "alovela"
+    assert first["mail"] == "alovela@princeton.edu"
+    assert first["displayName"] == "Ada Lovelace"
+    assert first["universityid"].startswith("9")
+
+
+def test_fast_extraction_no_results():
+    assert ptonppl.webdir._parse_results(b"<html><body><p>No results</p></body></html>") is None
+
+
+def test_fast_extraction_without_lxml(monkeypatch):
+    monkeypatch.setattr(ptonppl.webdir, "HTML_PARSER", "html.parser")
+    content = _content()
+
+    expected = list(map(ptonppl.webdir._parse_result, ptonppl.webdir._parse_raw_results(content)))
+
+    assert ptonppl.webdir._parse_results_fast(content) == expected
+
+
+def test_harvest_index(monkeypatch):
+    urls = []
+
+    def _fetch_content(url):
+        urls.append(url)
+        return _content()
+
+    monkeypatch.setattr(ptonppl.webdir, "_fetch_content", _fetch_content)
+    monkeypatch.setattr(ptonppl.webdir, "harvest_index", ptonppl.cache.MemoryCache())
+
+    obj = ptonppl.webdir.search_one(field="mail", value="ghopper@princeton.edu")
+    assert obj.netid == "ghopper"
+    assert len(urls) == 1
+
+    # everyone else on the page is now known, whichever identifier is used
+    assert ptonppl.webdir.search_one(field="netid", value="alovela").netid == "alovela"
+    assert ptonppl.webdir.search_one(field="alias", value="dknuth").netid == "dknuth"
+    assert len(urls) == 1